@@ -1,17 +1,292 @@
 import sqlite3
 import os
+import hashlib
+import logging
+import mimetypes
+import time
 from datetime import datetime
+from functools import wraps
+from itertools import count
+
+from query_stats import QueryStats
+from singleflight import FlightTimeout, SingleFlight
+from tags import normalize_tag
+
+logger = logging.getLogger('portfolio.dal')
+
+# SQLite result codes meaning the database is temporarily out of reach, so a
+# retry may succeed (extended codes such as SQLITE_BUSY_SNAPSHOT included)
+_UNAVAILABLE_CODES = ('SQLITE_BUSY', 'SQLITE_LOCKED', 'SQLITE_CANTOPEN', 'SQLITE_IOERR', 'SQLITE_FULL')
+# The same as primary result codes (an extended code's low byte), for errors
+# without sqlite_errorname (Python < 3.11)
+_UNAVAILABLE_NUMBERS = (5, 6, 14, 10, 13)
+# ... and as parts of the messages SQLite gives them, for errors without either
+# ("database is locked", "database schema is locked: main", "database table is locked", ...)
+_UNAVAILABLE_MESSAGES = ('is locked', 'is busy', 'unable to open database', 'disk i/o error',
+                         'database or disk is full')
+
+
+def is_unavailable(error):
+    """True if a sqlite3.Error means the database is busy, locked or out of reach"""
+    name = getattr(error, 'sqlite_errorname', None)
+    if name is not None:
+        return name.startswith(_UNAVAILABLE_CODES)
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return (code & 0xff) in _UNAVAILABLE_NUMBERS
+    message = str(error).lower()
+    return any(part in message for part in _UNAVAILABLE_MESSAGES)
+
+
+class DALError(Exception):
+    """A database operation failed"""
+    
+    def __init__(self, message, method=None):
+        super().__init__(message)
+        self.method = method
+
+
+class DatabaseUnavailable(DALError):
+    """The database is busy, locked or can't be opened; retrying later may work"""
+
+
+def coalesced(method):
+    """Have concurrent calls to a read method with the same arguments share one query"""
+    name = method.__name__
+    
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (name, args, tuple(sorted(kwargs.items())))
+        try:
+            return self.flights.do(key, method, self, *args, **kwargs)
+        except FlightTimeout as e:
+            raise DatabaseUnavailable(f"{name} failed: {e}", method=name) from e
+    return wrapper
+
+
+class _OpenStatement:
+    """A statement whose rows may still be fetched"""
+    
+    __slots__ = ('sql', 'parameters', 'seconds', 'rows', 'done')
+    
+    def __init__(self, sql, parameters, seconds):
+        self.sql = sql
+        self.parameters = parameters
+        self.seconds = seconds
+        self.rows = 0
+        self.done = False
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that remembers its connection's last statement and how long it took
+    
+    With query statistics on, it also times fetches and counts rows, and
+    reports each statement once its rows are exhausted or the cursor closes.
+    """
+    
+    _statement = None
+    
+    def execute(self, sql, parameters=()):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        finally:
+            seconds = time.perf_counter() - start
+            self.connection.record_statement(sql, seconds)
+        self._begin(sql, parameters, seconds)
+        return self
+    
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        finally:
+            seconds = time.perf_counter() - start
+            self.connection.record_statement(sql, seconds)
+        # No single set of parameters to explain it with
+        self._begin(sql, None, seconds)
+        return self
+    
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, 0 if row is None else 1, row is None)
+        return row
+    
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(start, len(rows), len(rows) < size)
+        return rows
+    
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows), True)
+        return rows
+    
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(start, 0, True)
+            raise
+        self._fetched(start, 1, False)
+        return row
+    
+    def close(self):
+        self._finish()
+        super().close()
+    
+    def _begin(self, sql, parameters, seconds):
+        self._statement = self.connection.open_statement(sql, parameters, seconds)
+        if self.description is None:
+            # Returns no rows, so it's finished already
+            self._finish()
+    
+    def _fetched(self, start, rows, exhausted):
+        statement = self._statement
+        if statement is not None:
+            statement.seconds += time.perf_counter() - start
+            statement.rows += rows
+            if exhausted:
+                self._finish()
+    
+    def _finish(self):
+        statement, self._statement = self._statement, None
+        if statement is not None:
+            self.connection.finish_statement(statement)
+
+
+class TracedConnection(sqlite3.Connection):
+    """Connection whose cursors are TracedCursors"""
+    
+    last_sql = None
+    last_duration = None
+    # QueryStats fed with this connection's statements, or None
+    query_stats = None
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._open_statements = []
+    
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+    
+    def open_statement(self, sql, parameters, seconds):
+        """Start tracking a statement until its rows are fetched; None without query stats"""
+        if self.query_stats is None:
+            return None
+        statement = _OpenStatement(sql, parameters, seconds)
+        self._open_statements.append(statement)
+        return statement
+    
+    def finish_statement(self, statement):
+        """Report a statement to query_stats, once"""
+        if statement.done:
+            return
+        statement.done = True
+        self._open_statements.remove(statement)
+        self.query_stats.record(self, statement.sql, statement.parameters, statement.seconds, statement.rows)
+    
+    def close(self):
+        # Statements whose rows weren't all fetched end here
+        for statement in list(self._open_statements):
+            self.finish_statement(statement)
+        super().close()
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+    
+    def record_statement(self, sql, duration):
+        self.last_sql = sql
+        self.last_duration = duration
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("SQL statement", extra={'sql': ' '.join(sql.split()),
+                                                 'duration_ms': round(duration * 1000, 3)})
+
+
+# Distinguishes the in-memory databases created by one process
+_memory_ids = count(1)
+
+# Stored in PRAGMA user_version by init_database; bump it whenever
+# init_database changes, so existing databases are migrated on next open
+SCHEMA_VERSION = 1
 
 class DatabaseAccessLayer:
-    def __init__(self, db_name="projects.db"):
+    def __init__(self, db_name="projects.db", template=None, flight_timeout=5.0, slow_query_ms=100,
+                 images_dir="static/images"):
+        """Open db_name, a path or a "file:" URI
+        
+        With template (the path of an initialized database) the schema and
+        data are copied from it instead of being created from scratch; a
+        database already at SCHEMA_VERSION is opened without writing to it.
+        flight_timeout bounds how long a coalesced read waits for the query
+        another thread is already running; statements slower than
+        slow_query_ms go to the slow-query log. images_dir holds the images
+        an empty asset catalog starts from; None starts it empty.
+        """
         self.db_name = db_name
-        self.init_database()
+        self.images_dir = images_dir
+        self._uri = db_name.startswith('file:')
+        self._write_listeners = []
+        self.flights = SingleFlight(timeout=flight_timeout)
+        self.query_stats = QueryStats(slow_ms=slow_query_ms)
+        # An in-memory database only lives while a connection to it is open
+        self._keepalive = self.get_connection() if 'mode=memory' in db_name else None
+        if template is not None:
+            self.copy_from(template)
+        elif self.schema_version() != SCHEMA_VERSION:
+            self.init_database()
+    
+    @classmethod
+    def in_memory(cls, template=None):
+        """A private in-memory database, shared by this DAL's connections"""
+        name = f"file:dal-{os.getpid()}-{next(_memory_ids)}?mode=memory&cache=shared"
+        return cls(name, template=template)
+    
+    def copy_from(self, source_path):
+        """Replace this database's contents with a copy of source_path (backup API)"""
+        source = sqlite3.connect(source_path)
+        conn = self.get_connection()
+        try:
+            source.backup(conn)
+        finally:
+            source.close()
+            conn.close()
+    
+    def close(self):
+        """Release an in-memory database; file databases need no cleanup"""
+        if self._keepalive is not None:
+            self._keepalive.close()
+            self._keepalive = None
+    
+    def schema_version(self):
+        """The SCHEMA_VERSION the database was last initialized at (0 if never)"""
+        conn = self.get_connection()
+        try:
+            return conn.execute('PRAGMA user_version').fetchone()[0]
+        except sqlite3.Error as e:
+            raise self._failure('schema_version', conn, e) from e
+        finally:
+            conn.close()
     
     def init_database(self):
         """Initialize the database and create tables if they don't exist"""
-        conn = sqlite3.connect(self.db_name)
+        conn = self.get_connection()
         cursor = conn.cursor()
         
+        # New databases give freed pages back with incremental_vacuum (see
+        # maintenance.py); existing ones keep their mode until a full VACUUM
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        
         # Create projects table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS projects (
@@ -24,12 +299,274 @@ class DatabaseAccessLayer:
             )
         ''')
         
+        # Index for listing and pager navigation in created order
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_projects_created
+            ON projects (created_date, id)
+        ''')
+        
+        # Create assets table (uploaded and imported files)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS assets (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sha256 TEXT NOT NULL,
+                filename TEXT NOT NULL UNIQUE,
+                original_name TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_assets_sha256 ON assets (sha256)')
+        
+        # Intrinsic size and placeholder of each distinct image, by content hash
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS image_metadata (
+                sha256 TEXT PRIMARY KEY,
+                width INTEGER,
+                height INTEGER,
+                placeholder TEXT,
+                created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Change log for incremental sync, one row per project write
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS project_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                project_id INTEGER NOT NULL,
+                action TEXT NOT NULL,
+                changed_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_project_changes_project
+            ON project_changes (project_id, seq)
+        ''')
+        
+        # Small key/value table for change feed and cache version bookkeeping
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS change_feed_state (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        ''')
+        
+        # Aggregates kept up to date by every project write (see _adjust_stats)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS portfolio_stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS project_stats_monthly (
+                month TEXT PRIMARY KEY,
+                projects INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS image_usage (
+                image_filename TEXT PRIMARY KEY,
+                projects INTEGER NOT NULL
+            )
+        ''')
+        if cursor.execute("SELECT 1 FROM portfolio_stats WHERE name = 'projects'").fetchone() is None:
+            self._rebuild_stats(cursor)
+        
+        # Housekeeping runs, and leases that pick one worker to run them
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS maintenance_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job TEXT NOT NULL,
+                started REAL NOT NULL,
+                duration_ms REAL NOT NULL,
+                status TEXT NOT NULL,
+                bytes_reclaimed INTEGER NOT NULL DEFAULT 0,
+                detail TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_maintenance_runs_job
+            ON maintenance_runs (job, id)
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires REAL NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tags (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE
+            )
+        ''')
+        # Keyed tag first, so each tag's projects are one contiguous range: the
+        # posting lists of an inverted index
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS project_tags (
+                tag_id INTEGER NOT NULL,
+                project_id INTEGER NOT NULL,
+                PRIMARY KEY (tag_id, project_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_project_tags_project
+            ON project_tags (project_id, tag_id)
+        ''')
+        
+        # Projects that predate the change log enter it as adds, oldest first
+        cursor.execute('''
+            INSERT INTO project_changes (project_id, action)
+            SELECT id, 'add' FROM projects
+            WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'project_changes')
+            ORDER BY created_date, id
+        ''')
+        
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
         conn.commit()
         conn.close()
     
     def get_connection(self):
         """Get a database connection"""
-        return sqlite3.connect(self.db_name)
+        try:
+            conn = sqlite3.connect(self.db_name, uri=self._uri, factory=TracedConnection)
+        except sqlite3.Error as e:
+            raise self._failure('get_connection', None, e) from e
+        conn.query_stats = self.query_stats
+        return conn
+    
+    def _failure(self, method, conn, error):
+        """Log a failed operation and return the typed exception to raise for it"""
+        unavailable = is_unavailable(error)
+        last_sql = getattr(conn, 'last_sql', None)
+        last_duration = getattr(conn, 'last_duration', None)
+        logger.error("DAL operation failed", extra={
+            'dal_method': method,
+            'sql': ' '.join(last_sql.split()) if last_sql else None,
+            'duration_ms': round(last_duration * 1000, 3) if last_duration is not None else None,
+            'error': f"{type(error).__name__}: {error}",
+        })
+        exception_class = DatabaseUnavailable if unavailable else DALError
+        return exception_class(f"{method} failed: {error}", method=method)
+    
+    def add_write_listener(self, listener):
+        """Register listener(action, project_id), called after each committed write"""
+        self._write_listeners.append(listener)
+    
+    def remove_write_listener(self, listener):
+        """Unregister a write listener"""
+        if listener in self._write_listeners:
+            self._write_listeners.remove(listener)
+    
+    def _notify_write(self, action, project_id):
+        # Reads started before the commit may miss it, so later calls mustn't join them
+        self.flights.forget()
+        for listener in list(self._write_listeners):
+            listener(action, project_id)
+    
+    def _record_change(self, cursor, project_id, action):
+        """Append to the change log inside the caller's transaction"""
+        cursor.execute(
+            'INSERT INTO project_changes (project_id, action) VALUES (?, ?)',
+            (project_id, action)
+        )
+    
+    def _bump_tags_version(self, cursor):
+        """Mark the tag postings changed, inside the caller's transaction"""
+        cursor.execute('''
+            INSERT INTO change_feed_state (key, value) VALUES ('tags_version', 1)
+            ON CONFLICT (key) DO UPDATE SET value = value + 1
+        ''')
+    
+    def _adjust_stats(self, cursor, project_id, delta):
+        """Count a project's current row in (delta=1) or out of (delta=-1) the aggregates
+        
+        Runs inside the caller's transaction. A project that doesn't exist
+        changes nothing.
+        """
+        cursor.execute('''
+            INSERT INTO portfolio_stats (name, value)
+            SELECT 'projects', ? FROM projects WHERE id = ?
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+        ''', (delta, project_id))
+        cursor.execute('''
+            INSERT INTO project_stats_monthly (month, projects)
+            SELECT substr(created_date, 1, 7), ? FROM projects WHERE id = ?
+            ON CONFLICT (month) DO UPDATE SET projects = projects + excluded.projects
+        ''', (delta, project_id))
+        cursor.execute('''
+            INSERT INTO image_usage (image_filename, projects)
+            SELECT image_filename, ? FROM projects WHERE id = ?
+            ON CONFLICT (image_filename) DO UPDATE SET projects = projects + excluded.projects
+        ''', (delta, project_id))
+        if delta < 0:
+            cursor.execute('''
+                DELETE FROM project_stats_monthly WHERE projects <= 0
+                AND month = (SELECT substr(created_date, 1, 7) FROM projects WHERE id = ?)
+            ''', (project_id,))
+            cursor.execute('''
+                DELETE FROM image_usage WHERE projects <= 0
+                AND image_filename = (SELECT image_filename FROM projects WHERE id = ?)
+            ''', (project_id,))
+    
+    def _rebuild_stats(self, cursor):
+        cursor.execute('DELETE FROM portfolio_stats')
+        cursor.execute('DELETE FROM project_stats_monthly')
+        cursor.execute('DELETE FROM image_usage')
+        cursor.execute("INSERT INTO portfolio_stats (name, value) SELECT 'projects', COUNT(*) FROM projects")
+        cursor.execute('''
+            INSERT INTO project_stats_monthly (month, projects)
+            SELECT substr(created_date, 1, 7), COUNT(*) FROM projects GROUP BY 1
+        ''')
+        cursor.execute('''
+            INSERT INTO image_usage (image_filename, projects)
+            SELECT image_filename, COUNT(*) FROM projects GROUP BY 1
+        ''')
+    
+    def enable_wal(self):
+        """Switch the database to write-ahead logging so reads don't wait on writers"""
+        conn = self.get_connection()
+        try:
+            mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+            return mode == 'wal'
+        finally:
+            conn.close()
+    
+    def warm_cache(self):
+        """Read every page of the projects table and its indexes; returns the row count"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT COUNT(*), SUM(LENGTH(title) + LENGTH(description) + LENGTH(image_filename))
+                FROM projects
+            ''')
+            rows = cursor.fetchone()[0]
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'projects'")
+            for (index,) in cursor.fetchall():
+                cursor.execute(f'SELECT COUNT(*) FROM projects INDEXED BY "{index}"')
+            return rows
+        except sqlite3.Error as e:
+            raise self._failure('warm_cache', conn, e) from e
+        finally:
+            conn.close()
+    
+    def ping(self):
+        """Open a connection and read a row; returns the seconds it took"""
+        start = time.perf_counter()
+        conn = self.get_connection()
+        
+        try:
+            conn.execute('SELECT id FROM projects LIMIT 1').fetchall()
+            return time.perf_counter() - start
+        except sqlite3.Error as e:
+            raise self._failure('ping', conn, e) from e
+        finally:
+            conn.close()
     
     def add_project(self, title, description, image_filename):
         """Add a new project to the database"""
@@ -41,16 +578,19 @@ class DatabaseAccessLayer:
                 INSERT INTO projects (title, description, image_filename)
                 VALUES (?, ?, ?)
             ''', (title, description, image_filename))
+            project_id = cursor.lastrowid
+            self._adjust_stats(cursor, project_id, 1)
+            self._record_change(cursor, project_id, 'add')
             
             conn.commit()
-            project_id = cursor.lastrowid
+            self._notify_write('add', project_id)
             return project_id
-        except Exception as e:
-            print(f"Error adding project: {e}")
-            return None
+        except sqlite3.Error as e:
+            raise self._failure('add_project', conn, e) from e
         finally:
             conn.close()
     
+    @coalesced
     def get_all_projects(self):
         """Get all projects from the database"""
         conn = self.get_connection()
@@ -60,17 +600,44 @@ class DatabaseAccessLayer:
             cursor.execute('''
                 SELECT id, title, description, image_filename, created_date, updated_date
                 FROM projects
-                ORDER BY created_date DESC
+                ORDER BY created_date DESC, id DESC
             ''')
             
             projects = cursor.fetchall()
             return projects
-        except Exception as e:
-            print(f"Error getting projects: {e}")
-            return []
+        except sqlite3.Error as e:
+            raise self._failure('get_all_projects', conn, e) from e
         finally:
             conn.close()
     
+    def iter_projects(self, chunk_size=500):
+        """Yield every project in id order, reading chunk_size rows per query
+        
+        Each chunk uses its own short read transaction (keyset pagination on
+        id), so a long iteration never pins the WAL. Rows written meanwhile
+        may or may not be included, depending on where the iteration is.
+        """
+        last_id = 0
+        while True:
+            conn = self.get_connection()
+            try:
+                rows = conn.execute('''
+                    SELECT id, title, description, image_filename, created_date, updated_date
+                    FROM projects
+                    WHERE id > ?
+                    ORDER BY id
+                    LIMIT ?
+                ''', (last_id, chunk_size)).fetchall()
+            except sqlite3.Error as e:
+                raise self._failure('iter_projects', conn, e) from e
+            finally:
+                conn.close()
+            yield from rows
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1][0]
+    
+    @coalesced
     def get_project_by_id(self, project_id):
         """Get a specific project by ID"""
         conn = self.get_connection()
@@ -85,9 +652,53 @@ class DatabaseAccessLayer:
             
             project = cursor.fetchone()
             return project
-        except Exception as e:
-            print(f"Error getting project: {e}")
-            return None
+        except sqlite3.Error as e:
+            raise self._failure('get_project_by_id', conn, e) from e
+        finally:
+            conn.close()
+    
+    @coalesced
+    def get_project_window(self, project_id, radius=1):
+        """Get a project with up to radius newer and older neighbours
+        
+        Returns (newer, project, older), where newer and older are lists of rows
+        ordered nearest first, or None if the project doesn't exist.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT id, title, description, image_filename, created_date, updated_date
+                FROM projects
+                WHERE id = ?
+            ''', (project_id,))
+            project = cursor.fetchone()
+            if project is None:
+                return None
+            
+            position = (project[4], project[0])
+            cursor.execute('''
+                SELECT id, title, description, image_filename, created_date, updated_date
+                FROM projects
+                WHERE (created_date, id) > (?, ?)
+                ORDER BY created_date, id
+                LIMIT ?
+            ''', position + (radius,))
+            newer = cursor.fetchall()
+            
+            cursor.execute('''
+                SELECT id, title, description, image_filename, created_date, updated_date
+                FROM projects
+                WHERE (created_date, id) < (?, ?)
+                ORDER BY created_date DESC, id DESC
+                LIMIT ?
+            ''', position + (radius,))
+            older = cursor.fetchall()
+            
+            return newer, project, older
+        except sqlite3.Error as e:
+            raise self._failure('get_project_window', conn, e) from e
         finally:
             conn.close()
     
@@ -97,17 +708,23 @@ class DatabaseAccessLayer:
         cursor = conn.cursor()
         
         try:
+            self._adjust_stats(cursor, project_id, -1)
             cursor.execute('''
                 UPDATE projects 
                 SET title = ?, description = ?, image_filename = ?, updated_date = CURRENT_TIMESTAMP
                 WHERE id = ?
             ''', (title, description, image_filename, project_id))
+            updated = cursor.rowcount > 0
+            if updated:
+                self._adjust_stats(cursor, project_id, 1)
+                self._record_change(cursor, project_id, 'update')
             
             conn.commit()
-            return cursor.rowcount > 0
-        except Exception as e:
-            print(f"Error updating project: {e}")
-            return False
+            if updated:
+                self._notify_write('update', project_id)
+            return updated
+        except sqlite3.Error as e:
+            raise self._failure('update_project', conn, e) from e
         finally:
             conn.close()
     
@@ -117,19 +734,513 @@ class DatabaseAccessLayer:
         cursor = conn.cursor()
         
         try:
+            self._adjust_stats(cursor, project_id, -1)
+            cursor.execute('DELETE FROM project_tags WHERE project_id = ?', (project_id,))
             cursor.execute('DELETE FROM projects WHERE id = ?', (project_id,))
+            deleted = cursor.rowcount > 0
+            if deleted:
+                self._record_change(cursor, project_id, 'delete')
+                self._bump_tags_version(cursor)
+            conn.commit()
+            if deleted:
+                self._notify_write('delete', project_id)
+            return deleted
+        except sqlite3.Error as e:
+            raise self._failure('delete_project', conn, e) from e
+        finally:
+            conn.close()
+    
+    def set_project_tags(self, project_id, tags):
+        """Replace a project's tags; names are normalized and new tags created
+        
+        Returns False if the project doesn't exist.
+        """
+        names = []
+        for tag in tags:
+            name = normalize_tag(tag)
+            if name and name not in names:
+                names.append(name)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('SELECT 1 FROM projects WHERE id = ?', (project_id,))
+            if cursor.fetchone() is None:
+                return False
+            cursor.executemany('INSERT OR IGNORE INTO tags (name) VALUES (?)', [(name,) for name in names])
+            cursor.execute(f'''
+                DELETE FROM project_tags
+                WHERE project_id = ?
+                AND tag_id NOT IN (SELECT id FROM tags WHERE name IN ({', '.join('?' * len(names))}))
+            ''', (project_id, *names))
+            cursor.executemany('''
+                INSERT OR IGNORE INTO project_tags (tag_id, project_id)
+                SELECT id, ? FROM tags WHERE name = ?
+            ''', [(project_id, name) for name in names])
+            self._bump_tags_version(cursor)
+            conn.commit()
+            self._notify_write('tags', project_id)
+            return True
+        except sqlite3.Error as e:
+            raise self._failure('set_project_tags', conn, e) from e
+        finally:
+            conn.close()
+    
+    def get_project_tags(self, project_ids):
+        """Map each of project_ids to its tag names, alphabetically; untagged projects are left out"""
+        project_ids = list(project_ids)
+        tags = {}
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            # Chunked to stay under SQLite's bound-parameter limit
+            for start in range(0, len(project_ids), 500):
+                chunk = project_ids[start:start + 500]
+                cursor.execute(f'''
+                    SELECT pt.project_id, t.name
+                    FROM project_tags pt JOIN tags t ON t.id = pt.tag_id
+                    WHERE pt.project_id IN ({', '.join('?' * len(chunk))})
+                    ORDER BY pt.project_id, t.name
+                ''', chunk)
+                for project_id, name in cursor.fetchall():
+                    tags.setdefault(project_id, []).append(name)
+            return tags
+        except sqlite3.Error as e:
+            raise self._failure('get_project_tags', conn, e) from e
+        finally:
+            conn.close()
+    
+    @coalesced
+    def get_tag_postings(self):
+        """Map each tag in use to the ids of its projects, in id order"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT t.name, pt.project_id
+                FROM project_tags pt JOIN tags t ON t.id = pt.tag_id
+                ORDER BY pt.tag_id, pt.project_id
+            ''')
+            postings = {}
+            for name, project_id in cursor.fetchall():
+                postings.setdefault(name, []).append(project_id)
+            return postings
+        except sqlite3.Error as e:
+            raise self._failure('get_tag_postings', conn, e) from e
+        finally:
+            conn.close()
+    
+    def get_tags_version(self):
+        """Get a number that changes whenever any project's tags may have (0 before the first change)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("SELECT value FROM change_feed_state WHERE key = 'tags_version'")
+            row = cursor.fetchone()
+            return row[0] if row else 0
+        except sqlite3.Error as e:
+            raise self._failure('get_tags_version', conn, e) from e
+        finally:
+            conn.close()
+    
+    def get_projects_by_tags(self, tags):
+        """Projects carrying every one of tags, newest first (all projects if tags is empty)"""
+        names = sorted({normalize_tag(tag) for tag in tags} - {''})
+        if not names:
+            return self.get_all_projects()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute(f'''
+                SELECT id, title, description, image_filename, created_date, updated_date
+                FROM projects
+                WHERE id IN (
+                    SELECT pt.project_id
+                    FROM tags t JOIN project_tags pt ON pt.tag_id = t.id
+                    WHERE t.name IN ({', '.join('?' * len(names))})
+                    GROUP BY pt.project_id
+                    HAVING COUNT(*) = ?
+                )
+                ORDER BY created_date DESC, id DESC
+            ''', (*names, len(names)))
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            raise self._failure('get_projects_by_tags', conn, e) from e
+        finally:
+            conn.close()
+    
+    def get_stats(self):
+        """Portfolio aggregates, read from the maintained tables rather than projects
+        
+        Returns a dict with the project count, (month, projects) pairs
+        newest month first and (image_filename, projects) pairs most used first.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            row = cursor.execute("SELECT value FROM portfolio_stats WHERE name = 'projects'").fetchone()
+            per_month = cursor.execute(
+                'SELECT month, projects FROM project_stats_monthly ORDER BY month DESC'
+            ).fetchall()
+            image_usage = cursor.execute(
+                'SELECT image_filename, projects FROM image_usage ORDER BY projects DESC, image_filename'
+            ).fetchall()
+            return {'projects': row[0] if row else 0, 'per_month': per_month, 'image_usage': image_usage}
+        except sqlite3.Error as e:
+            raise self._failure('get_stats', conn, e) from e
+        finally:
+            conn.close()
+    
+    def rebuild_stats(self):
+        """Recompute the aggregates from projects; returns True if they had drifted"""
+        before = self.get_stats()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            self._rebuild_stats(cursor)
+            conn.commit()
+        except sqlite3.Error as e:
+            raise self._failure('rebuild_stats', conn, e) from e
+        finally:
+            conn.close()
+        return self.get_stats() != before
+    
+    def get_latest_change_seq(self):
+        """Get the sequence number of the newest change (0 if there is none)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'project_changes'")
+            row = cursor.fetchone()
+            return row[0] if row else 0
+        except sqlite3.Error as e:
+            raise self._failure('get_latest_change_seq', conn, e) from e
+        finally:
+            conn.close()
+    
+    def get_cache_versions(self):
+        """Get (newest change sequence number, tags version) in one round trip"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT (SELECT seq FROM sqlite_sequence WHERE name = 'project_changes'),
+                       (SELECT value FROM change_feed_state WHERE key = 'tags_version')
+            ''')
+            seq, tags_version = cursor.fetchone()
+            return seq or 0, tags_version or 0
+        except sqlite3.Error as e:
+            raise self._failure('get_cache_versions', conn, e) from e
+        finally:
+            conn.close()
+    
+    def get_changes(self, since=0, limit=100):
+        """Get changes after sequence number since, oldest first
+        
+        Returns (changes, compacted_through). Each change is
+        (seq, project_id, action, changed_date, project) where project is the
+        current row, or None once deleted. If since is below compacted_through,
+        deletes may have been compacted away and the consumer must resync.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("SELECT value FROM change_feed_state WHERE key = 'compacted_through'")
+            row = cursor.fetchone()
+            compacted_through = row[0] if row else 0
+            
+            cursor.execute('''
+                SELECT c.seq, c.project_id, c.action, c.changed_date,
+                       p.id, p.title, p.description, p.image_filename, p.created_date, p.updated_date
+                FROM project_changes c
+                LEFT JOIN projects p ON p.id = c.project_id
+                WHERE c.seq > ?
+                ORDER BY c.seq
+                LIMIT ?
+            ''', (since, limit))
+            changes = [row[:4] + ((row[4:] if row[4] is not None else None),)
+                       for row in cursor.fetchall()]
+            return changes, compacted_through
+        except sqlite3.Error as e:
+            raise self._failure('get_changes', conn, e) from e
+        finally:
+            conn.close()
+    
+    def compact_changes(self, tombstone_max_age_days=None):
+        """Shrink the change log; returns the number of rows removed
+        
+        Changes superseded by a later change to the same project are always
+        dropped, since consumers only need the latest state. Delete entries
+        older than tombstone_max_age_days are dropped too, which raises the
+        compacted_through mark that forces slower consumers to resync.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                DELETE FROM project_changes
+                WHERE seq < (SELECT MAX(later.seq) FROM project_changes later
+                             WHERE later.project_id = project_changes.project_id)
+            ''')
+            removed = cursor.rowcount
+            
+            if tombstone_max_age_days is not None:
+                cursor.execute('''
+                    SELECT MAX(seq) FROM project_changes
+                    WHERE action = 'delete' AND changed_date < datetime('now', ?)
+                ''', (f"{-float(tombstone_max_age_days)} days",))
+                through = cursor.fetchone()[0]
+                if through is not None:
+                    cursor.execute(
+                        "DELETE FROM project_changes WHERE action = 'delete' AND seq <= ?",
+                        (through,)
+                    )
+                    removed += cursor.rowcount
+                    cursor.execute('''
+                        INSERT INTO change_feed_state (key, value) VALUES ('compacted_through', ?)
+                        ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)
+                    ''', (through,))
+            
+            conn.commit()
+            return removed
+        except sqlite3.Error as e:
+            raise self._failure('compact_changes', conn, e) from e
+        finally:
+            conn.close()
+    
+    def acquire_lease(self, name, holder, ttl):
+        """Take or renew the lease called name for ttl seconds; False if another holder has it"""
+        now = time.time()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                INSERT INTO leases (name, holder, expires) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires = excluded.expires
+                WHERE leases.holder = excluded.holder OR leases.expires < ?
+            ''', (name, holder, now + ttl, now))
             conn.commit()
             return cursor.rowcount > 0
-        except Exception as e:
-            print(f"Error deleting project: {e}")
-            return False
+        except sqlite3.Error as e:
+            raise self._failure('acquire_lease', conn, e) from e
+        finally:
+            conn.close()
+    
+    def release_lease(self, name, holder):
+        """Give up a lease held by holder"""
+        conn = self.get_connection()
+        
+        try:
+            conn.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (name, holder))
+            conn.commit()
+        except sqlite3.Error as e:
+            raise self._failure('release_lease', conn, e) from e
+        finally:
+            conn.close()
+    
+    def record_maintenance_run(self, job, started, duration_ms, status, bytes_reclaimed=0, detail=None):
+        """Log one housekeeping run; started is a Unix timestamp"""
+        conn = self.get_connection()
+        
+        try:
+            conn.execute('''
+                INSERT INTO maintenance_runs (job, started, duration_ms, status, bytes_reclaimed, detail)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (job, started, duration_ms, status, bytes_reclaimed, detail))
+            conn.commit()
+        except sqlite3.Error as e:
+            raise self._failure('record_maintenance_run', conn, e) from e
+        finally:
+            conn.close()
+    
+    def get_maintenance_runs(self, job=None, status=None, limit=20):
+        """Newest housekeeping runs first, as (id, job, started, duration_ms, status, bytes_reclaimed, detail)"""
+        conn = self.get_connection()
+        
+        try:
+            cursor = conn.execute('''
+                SELECT id, job, started, duration_ms, status, bytes_reclaimed, detail
+                FROM maintenance_runs
+                WHERE (? IS NULL OR job = ?) AND (? IS NULL OR status = ?)
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (job, job, status, status, limit))
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            raise self._failure('get_maintenance_runs', conn, e) from e
+        finally:
+            conn.close()
+    
+    def add_asset(self, sha256, filename, original_name, content_type, size):
+        """Register a stored file; returns the asset row, existing or new"""
+        return self.add_assets([(sha256, filename, original_name, content_type, size)])[0]
+    
+    def add_assets(self, assets):
+        """Register (sha256, filename, original_name, content_type, size) tuples in one transaction
+        
+        Returns the asset rows, existing or new, in the same order; on failure
+        none of them is registered.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.executemany('''
+                INSERT OR IGNORE INTO assets (sha256, filename, original_name, content_type, size)
+                VALUES (?, ?, ?, ?, ?)
+            ''', assets)
+            rows = []
+            for asset in assets:
+                cursor.execute('''
+                    SELECT id, sha256, filename, original_name, content_type, size, created_date
+                    FROM assets
+                    WHERE filename = ?
+                ''', (asset[1],))
+                rows.append(cursor.fetchone())
+            conn.commit()
+            return rows
+        except sqlite3.Error as e:
+            raise self._failure('add_assets', conn, e) from e
+        finally:
+            conn.close()
+    
+    def get_asset_by_hash(self, sha256):
+        """Get the first asset with the given content hash"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT id, sha256, filename, original_name, content_type, size, created_date
+                FROM assets
+                WHERE sha256 = ?
+                ORDER BY id
+                LIMIT 1
+            ''', (sha256,))
+            return cursor.fetchone()
+        except sqlite3.Error as e:
+            raise self._failure('get_asset_by_hash', conn, e) from e
+        finally:
+            conn.close()
+    
+    def get_image_assets(self):
+        """Get (filename, label) pairs for every image asset
+        
+        The first call on an empty catalog registers the files already in
+        images_dir, so existing projects keep their images.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT filename, original_name
+                FROM assets
+                WHERE content_type LIKE 'image/%'
+                ORDER BY original_name, filename
+            ''')
+            images = cursor.fetchall()
+        except sqlite3.Error as e:
+            raise self._failure('get_image_assets', conn, e) from e
         finally:
             conn.close()
+        
+        if not images and self.import_image_directory():
+            return self.get_image_assets()
+        return images
+    
+    def get_image_metadata(self, filenames):
+        """Map each known image filename to (sha256, measured, width, height, placeholder)
+        
+        measured is False, and the rest None, for images not yet measured.
+        """
+        filenames = list(dict.fromkeys(filenames))
+        if not filenames:
+            return {}
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute(f'''
+                SELECT a.filename, a.sha256, m.sha256 IS NOT NULL, m.width, m.height, m.placeholder
+                FROM assets a
+                LEFT JOIN image_metadata m ON m.sha256 = a.sha256
+                WHERE a.filename IN ({', '.join('?' * len(filenames))})
+            ''', filenames)
+            return {row[0]: (row[1], bool(row[2])) + row[3:] for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            raise self._failure('get_image_metadata', conn, e) from e
+        finally:
+            conn.close()
+    
+    def save_image_metadata(self, sha256, width, height, placeholder):
+        """Store the measurements of the image with the given content hash"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                INSERT OR REPLACE INTO image_metadata (sha256, width, height, placeholder)
+                VALUES (?, ?, ?, ?)
+            ''', (sha256, width, height, placeholder))
+            conn.commit()
+        except sqlite3.Error as e:
+            raise self._failure('save_image_metadata', conn, e) from e
+        finally:
+            conn.close()
+    
+    def get_images_missing_metadata(self):
+        """Get (sha256, filename) of one file per image hash that hasn't been measured"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT a.sha256, MIN(a.filename)
+                FROM assets a
+                LEFT JOIN image_metadata m ON m.sha256 = a.sha256
+                WHERE a.content_type LIKE 'image/%' AND m.sha256 IS NULL
+                GROUP BY a.sha256
+                ORDER BY MIN(a.id)
+            ''')
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            raise self._failure('get_images_missing_metadata', conn, e) from e
+        finally:
+            conn.close()
+    
+    def import_image_directory(self, images_dir=None):
+        """Register the images in images_dir (default: the DAL's) as assets; returns how many were added"""
+        images_dir = images_dir or self.images_dir
+        added = 0
+        for filename in self.get_available_images(images_dir):
+            path = os.path.join(images_dir, filename)
+            hasher = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    hasher.update(chunk)
+            extension = os.path.splitext(filename)[1].lower().lstrip('.')
+            content_type = mimetypes.guess_type(filename)[0] or f"image/{extension}"
+            if self.add_asset(hasher.hexdigest(), filename, filename, content_type, os.path.getsize(path)):
+                added += 1
+        return added
     
-    def get_available_images(self):
-        """Get list of available images in the static/images folder"""
-        images_dir = "static/images"
-        if not os.path.exists(images_dir):
+    @coalesced
+    def get_available_images(self, images_dir=None):
+        """Get list of available images in images_dir (default: the DAL's)"""
+        images_dir = images_dir or self.images_dir
+        if not images_dir or not os.path.exists(images_dir):
             return []
         
         image_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
@@ -142,4 +1253,4 @@ class DatabaseAccessLayer:
         return sorted(images)
 
 # Create a global instance
-dal = DatabaseAccessLayer()
+dal = DatabaseAccessLayer(os.environ.get('DATABASE_PATH', 'projects.db'))
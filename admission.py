@@ -0,0 +1,291 @@
+"""
+Admission control for write endpoints
+Token-bucket rate limiting (per client IP and global), per-route concurrency
+caps and latency-based load shedding in front of the POST handlers
+"""
+
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+
+# Seconds between sweeps that drop buckets which have refilled completely
+SWEEP_INTERVAL = 60.0
+
+
+def _full_at(tokens, now, rate, burst):
+    """When a bucket holding tokens at now is full again, and so no different from a missing one"""
+    return now + (burst - tokens) / rate
+
+
+class MemoryBucketStore:
+    """Token buckets kept in process memory (one budget per worker)
+
+    Buckets that have refilled are dropped every SWEEP_INTERVAL seconds, so
+    memory follows the clients seen recently rather than every client ever.
+    """
+
+    def __init__(self, sweep_interval=SWEEP_INTERVAL):
+        self.sweep_interval = sweep_interval
+        # key -> (tokens, updated, full_at)
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def take(self, key, rate, burst, cost=1.0):
+        """Take cost tokens from a bucket; return seconds to wait, 0 if allowed"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep >= self.sweep_interval:
+                self._sweep(now)
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+            if not wait:
+                tokens -= cost
+            self._buckets[key] = (tokens, now, _full_at(tokens, now, rate, burst))
+        return wait
+
+    def _sweep(self, now):
+        self._last_sweep = now
+        for key in [key for key, bucket in self._buckets.items() if bucket[2] <= now]:
+            del self._buckets[key]
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SqliteBucketStore:
+    """Token buckets in a local SQLite file shared by every worker on the host
+
+    Each process deletes the rows of refilled buckets every SWEEP_INTERVAL
+    seconds, so the table follows the clients seen recently.
+    """
+
+    def __init__(self, db_name="ratelimit.db", sweep_interval=SWEEP_INTERVAL):
+        self.db_name = db_name
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.time()
+        conn = sqlite3.connect(self.db_name)
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS token_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    full_at REAL NOT NULL DEFAULT 0
+                )
+            ''')
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(token_buckets)')]
+            if 'full_at' not in columns:
+                # Tables made before buckets expired; their rows are swept on first use
+                conn.execute('ALTER TABLE token_buckets ADD COLUMN full_at REAL NOT NULL DEFAULT 0')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_token_buckets_full_at ON token_buckets (full_at)')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def take(self, key, rate, burst, cost=1.0):
+        """Take cost tokens from a bucket; return seconds to wait, 0 if allowed
+
+        Raises ServiceUnavailable if the store stays locked for a second.
+        """
+        now = time.time()
+        conn = sqlite3.connect(self.db_name, timeout=1.0, isolation_level=None)
+        try:
+            # BEGIN IMMEDIATE serializes the read-modify-write across processes
+            conn.execute('BEGIN IMMEDIATE')
+            if now - self._last_sweep >= self.sweep_interval:
+                self._last_sweep = now
+                conn.execute('DELETE FROM token_buckets WHERE full_at <= ?', (now,))
+            row = conn.execute(
+                'SELECT tokens, updated FROM token_buckets WHERE key = ?', (key,)
+            ).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+            if not wait:
+                tokens -= cost
+            conn.execute(
+                'INSERT OR REPLACE INTO token_buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)',
+                (key, tokens, now, _full_at(tokens, now, rate, burst))
+            )
+            conn.execute('COMMIT')
+            return wait
+        except sqlite3.OperationalError as e:
+            # Busy or locked past the timeout: ask the client to come back
+            raise ServiceUnavailable(retry_after=1) from e
+        finally:
+            conn.close()
+
+    def __len__(self):
+        conn = sqlite3.connect(self.db_name)
+        try:
+            return conn.execute('SELECT COUNT(*) FROM token_buckets').fetchone()[0]
+        finally:
+            conn.close()
+
+    def reset(self):
+        conn = sqlite3.connect(self.db_name)
+        try:
+            conn.execute('DELETE FROM token_buckets')
+            conn.commit()
+        finally:
+            conn.close()
+
+
+class AdmissionController:
+    """Decides whether a write request may proceed, reading limits from app.config
+
+    RATELIMIT_ENABLED      switch the whole layer on or off
+    RATELIMIT_STORAGE      None for in-process buckets, or a SQLite path shared by workers
+                           (defaults to $RATELIMIT_STORAGE, which gunicorn.conf.py sets)
+    RATELIMIT_PER_IP       (tokens per second, burst) for each client IP and route
+    RATELIMIT_GLOBAL       (tokens per second, burst) shared by all write requests
+    WRITE_CONCURRENCY      {route: max in-flight requests per worker}
+    WRITE_LATENCY_TARGET   seconds of smoothed DB write latency before shedding starts
+    """
+
+    # Weight of the newest sample in the write latency moving average
+    latency_alpha = 0.2
+    # The average halves every this many seconds without new samples, so
+    # shedding recovers even when every write is being rejected
+    latency_half_life = 5.0
+
+    def __init__(self):
+        self._store = None
+        self._store_path = None
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        self.write_latency = 0.0
+        self._latency_updated = time.monotonic()
+
+    @staticmethod
+    def init_app(app):
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMIT_STORAGE', os.environ.get('RATELIMIT_STORAGE') or None)
+        app.config.setdefault('RATELIMIT_PER_IP', (0.2, 20))
+        app.config.setdefault('RATELIMIT_GLOBAL', (10.0, 100))
+        app.config.setdefault('WRITE_CONCURRENCY', {'add_project': 4, 'contact': 8})
+        app.config.setdefault('WRITE_LATENCY_TARGET', 0.25)
+
+    def get_store(self):
+        path = current_app.config['RATELIMIT_STORAGE']
+        with self._lock:
+            if self._store is None or path != self._store_path:
+                self._store = SqliteBucketStore(path) if path else MemoryBucketStore()
+                self._store_path = path
+            return self._store
+
+    def _semaphore(self, route):
+        limit = current_app.config['WRITE_CONCURRENCY'].get(route)
+        if limit is None:
+            return None
+        with self._lock:
+            entry = self._semaphores.get(route)
+            if entry is None or entry[0] != limit:
+                entry = (limit, threading.BoundedSemaphore(limit))
+                self._semaphores[route] = entry
+            return entry[1]
+
+    def check_rate(self, route):
+        """Raise 429/503 if the client or the site is over its write budget"""
+        store = self.get_store()
+        rate, burst = current_app.config['RATELIMIT_PER_IP']
+        wait = store.take(f"ip:{route}:{request.remote_addr}", rate, burst)
+        if wait:
+            raise TooManyRequests(retry_after=math.ceil(wait))
+
+        rate, burst = current_app.config['RATELIMIT_GLOBAL']
+        wait = store.take('global', rate, burst)
+        if wait:
+            raise ServiceUnavailable(retry_after=math.ceil(wait))
+
+    def check_latency(self):
+        """Shed a share of writes proportional to how far latency is over target"""
+        target = current_app.config['WRITE_LATENCY_TARGET']
+        latency = self.current_write_latency()
+        if not target or latency <= target:
+            return
+        shed_probability = min(1.0, (latency - target) / target)
+        if random.random() < shed_probability:
+            raise ServiceUnavailable(retry_after=max(1, math.ceil(latency)))
+
+    def current_write_latency(self):
+        """The write latency average, decayed for the time since the last sample"""
+        idle = time.monotonic() - self._latency_updated
+        return self.write_latency * 0.5 ** (idle / self.latency_half_life)
+
+    def record_write_latency(self, seconds):
+        """Fold a DB write duration into the moving average used for shedding"""
+        with self._lock:
+            latency = self.current_write_latency()
+            self.write_latency = latency + self.latency_alpha * (seconds - latency)
+            self._latency_updated = time.monotonic()
+
+    @contextmanager
+    def track_write(self):
+        """Time the enclosed DB write and record it"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_write_latency(time.perf_counter() - start)
+
+    def limit(self, route):
+        """Decorator applying admission control to the POST requests of a view"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method != 'POST' or not current_app.config['RATELIMIT_ENABLED']:
+                    return view(*args, **kwargs)
+
+                self.check_latency()
+                self.check_rate(route)
+
+                semaphore = self._semaphore(route)
+                if semaphore is None:
+                    return view(*args, **kwargs)
+                if not semaphore.acquire(blocking=False):
+                    raise ServiceUnavailable(retry_after=1)
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    semaphore.release()
+            return wrapper
+        return decorator
+
+    def reset(self):
+        """Forget bucket state, in-flight limits and the latency average
+
+        This empties a shared SqliteBucketStore for every worker; a new worker
+        uses reset_after_fork instead.
+        """
+        with self._lock:
+            if self._store is not None:
+                self._store.reset()
+        self.reset_after_fork()
+
+    def reset_after_fork(self):
+        """Drop this process's store handle, in-flight limits and latency average
+
+        Buckets in a shared store are left alone, so starting or recycling a
+        worker doesn't hand every client a fresh budget.
+        """
+        with self._lock:
+            self._store = None
+            self._semaphores.clear()
+            self.write_latency = 0.0
+            self._latency_updated = time.monotonic()
@@ -1,13 +1,163 @@
-from flask import Flask, render_template_string, request, redirect, url_for, flash, send_from_directory
+from flask import Flask, request, redirect, url_for, flash, get_flashed_messages, send_from_directory, session, make_response, abort, jsonify, g
+from markupsafe import Markup, escape
+from jinja2 import TemplateError
+from jinja2.sandbox import SandboxedEnvironment
 from flask_wtf import FlaskForm
+from flask_wtf.csrf import validate_csrf
 from wtforms import StringField, TextAreaField, SubmitField, SelectField
-from wtforms.validators import DataRequired, Email, Length
+from wtforms.validators import DataRequired, Email, Length, Optional, ValidationError
+import hmac
 import os
-from DAL import dal
+import re
+import uuid
+from datetime import datetime, timezone
+from functools import lru_cache
+from DAL import dal, DALError, DatabaseUnavailable
+from admission import AdmissionController
+from assets import AssetStore
+from change_feed import ChangeNotifier, change_to_dict
+from pdf_index import PdfIndex
+from critical_css import FrontendAssets
+from dedup import DuplicateFilter, fingerprint
+from export import FORMATS as EXPORT_FORMATS, export_projects
+from feeds import ATOM, SITEMAP, FeedCache
+from form_cache import FormMarkupCache
+from image_meta import ImageMetadataWorker, img_attributes, read_dimensions
+from maintenance import Maintenance
+from page_cache import AnonymousPageCache, STORE_MARKER, cacheable
+from prefetch import is_prefetch, speculation_markup
+from query_stats import report as query_stats_report
+from project_cache import ProjectDetailCache
+from service_worker import ServiceWorker, page_urls, web_manifest
+from sessions import has_session_cookie, make_session_interface
+from structured_logging import LogPipeline, REQUEST_ID, REQUEST_PURPOSE
+from tags import TagIndex, parse_tags
+from tenants import ENVIRON_KEY as TENANT_ENVIRON_KEY, TenantMiddleware, TenantRegistry
+from warmup import Readiness, warm_up
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'  # Change this to a random secret key
 
+# JSON logs written off the request path by a background thread
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO').upper()
+log_pipeline = LogPipeline(level=app.config['LOG_LEVEL'])
+log_pipeline.install('portfolio', app.logger.name)
+# Seconds clients are asked to wait when the database is busy or locked
+app.config['DB_UNAVAILABLE_RETRY_AFTER'] = 1
+
+# Seconds that shared caches may keep pages served to anonymous visitors
+app.config['ANONYMOUS_CACHE_MAX_AGE'] = 60
+# 'cookie' (signed cookie) or 'sqlite' (server-side store at SESSION_SQLITE_PATH)
+app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', 'cookie')
+app.config['SESSION_SQLITE_PATH'] = os.environ.get('SESSION_SQLITE_PATH', 'sessions.db')
+app.session_interface = make_session_interface(app.config)
+
+# Rate limits, concurrency caps and load shedding for the POST handlers
+app.config['WRITE_CONCURRENCY'] = {'add_project': 4, 'contact': 8, 'upload_assets': 2}
+write_admission = AdmissionController()
+write_admission.init_app(app)
+
+# Repeated contact messages (same email and text within the window) are caught
+# by a Bloom filter in a memory-mapped file shared by the workers, before
+# anything is stored: 'drop' answers them like a success, 'flag' lets them
+# through with a log line, 'off' disables the check
+app.config['CONTACT_DEDUP'] = os.environ.get('CONTACT_DEDUP', 'drop')
+app.config['CONTACT_DEDUP_PATH'] = os.environ.get('CONTACT_DEDUP_PATH', 'contact_dedup.bloom')
+app.config['CONTACT_DEDUP_WINDOW'] = float(os.environ.get('CONTACT_DEDUP_WINDOW', 86400))
+app.config['CONTACT_DEDUP_CAPACITY'] = int(os.environ.get('CONTACT_DEDUP_CAPACITY', 10000))
+app.config['CONTACT_DEDUP_FP_RATE'] = float(os.environ.get('CONTACT_DEDUP_FP_RATE', 0.001))
+contact_filter = DuplicateFilter(app.config['CONTACT_DEDUP_PATH'],
+                                 window=app.config['CONTACT_DEDUP_WINDOW'],
+                                 capacity=app.config['CONTACT_DEDUP_CAPACITY'],
+                                 fp_rate=app.config['CONTACT_DEDUP_FP_RATE'])
+
+# Uploaded files, stored once per distinct content below static/assets
+app.config['MAX_UPLOAD_BYTES'] = 20 * 1024 * 1024
+asset_store = AssetStore('static/assets', max_bytes=app.config['MAX_UPLOAD_BYTES'])
+
+# Static form markup is built once per form and reused across GET requests
+form_cache = FormMarkupCache()
+
+# Critical CSS and self-hosted fonts written by build_assets.py
+frontend_assets = FrontendAssets('static')
+# Announce the render-critical assets in a Link header on HTML pages, which a
+# front proxy can relay as 103 Early Hints
+app.config['EARLY_HINTS'] = True
+
+# /sw.js, generated from the page routes and versioned by static file hashes
+app.config['SERVICE_WORKER'] = True
+service_worker = ServiceWorker('static', frontend_assets)
+
+# Page-level full-text index of the PDFs, built offline by pdf_index.py
+pdf_index = PdfIndex(os.environ.get('PDF_INDEX_PATH', 'pdf_index.db'))
+
+# Project detail rows with their pager neighbours, invalidated by DAL writes
+project_cache = ProjectDetailCache()
+
+# Tag -> project ids for /projects?tag=... filters and facet counts
+tag_index = TagIndex()
+
+# Wakes long-poll requests on /api/projects/changes when projects are written
+change_notifier = ChangeNotifier()
+
+# Complete pages for visitors without a session cookie, served before Flask runs
+page_cache = AnonymousPageCache(
+    app, request_headers=lambda environ: [('X-Request-ID', request_id_for(environ.get('HTTP_X_REQUEST_ID', '')))])
+
+# Speculation rules prefetch internal links on hover and prerender nav links on
+# pointer down. Prefetches the page cache can't answer draw on PREFETCH_BUDGET
+# (tokens per second, burst), shared like the write limits; past it they get
+# 503 and the browser simply loads the page when it is clicked. Form pages are
+# left out so speculation never starts sessions.
+app.config['SPECULATION_RULES'] = True
+app.config['PREFETCH_BUDGET'] = (5.0, 20)
+app.config['PREFETCH_EXCLUDE'] = ('/add-project', '/contact', '/thank-you')
+
+# Further portfolios hosted from this process, each under tenants/<name>/ and
+# reached as <name>.<TENANT_BASE_DOMAIN> or /t/<name>/
+app.config['TENANTS_ROOT'] = os.environ.get('TENANTS_ROOT', 'tenants')
+app.config['TENANT_BASE_DOMAIN'] = os.environ.get('TENANT_BASE_DOMAIN')
+app.config['MAX_OPEN_TENANTS'] = int(os.environ.get('MAX_OPEN_TENANTS', 256))
+app.config['TENANT_IDLE_SECONDS'] = 300
+tenant_registry = TenantRegistry(app.config['TENANTS_ROOT'],
+                                 max_open=app.config['MAX_OPEN_TENANTS'],
+                                 idle_seconds=app.config['TENANT_IDLE_SECONDS'])
+app.wsgi_app = TenantMiddleware(page_cache, tenant_registry,
+                                base_domain=app.config['TENANT_BASE_DOMAIN'])
+
+# Image sizes and placeholders, measured in the background once per content
+# hash; cached pages are dropped when new measurements land
+image_metadata = ImageMetadataWorker('static', on_update=page_cache.clear)
+# Project cards above the fold on a typical screen load eagerly, the rest lazily
+app.config['EAGER_PROJECT_IMAGES'] = 3
+
+# Deploy warm-up run in each new worker, and the load balancer's health checks.
+# WARMUP_HOST is the Host the page cache is filled under, so it should match
+# the public host name.
+app.config['WARMUP_HOST'] = os.environ.get('WARMUP_HOST', 'localhost')
+app.config['WARMUP_PROJECTS'] = 10
+app.config['READY_DB_LATENCY_MS'] = 250
+readiness = Readiness()
+
+# SQLite housekeeping (checkpoint, analyze, vacuum) in the MAINTENANCE_WINDOW,
+# local time, run by whichever worker holds the maintenance lease. Set
+# MAINTENANCE_IN_PROCESS=0 to leave it to `python maintenance.py run` in cron.
+app.config['MAINTENANCE_WINDOW'] = os.environ.get('MAINTENANCE_WINDOW', '02:00-05:00')
+app.config['MAINTENANCE_IN_PROCESS'] = os.environ.get('MAINTENANCE_IN_PROCESS', '1') == '1'
+maintenance = Maintenance(window=app.config['MAINTENANCE_WINDOW'])
+
+# Per-statement query statistics and the slow-query log, served to holders of
+# ADMIN_TOKEN at /admin/query-stats (404 while no token is set)
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
+dal.query_stats.slow_ms = app.config['SLOW_QUERY_MS']
+
+# Shown in the header, footer and titles of the main site
+DEFAULT_OWNER = "Saad Siddique"
+
+# sitemap.xml and projects.atom, rebuilt from the change log after writes
+feed_cache = FeedCache(title=f"{DEFAULT_OWNER} - Projects")
+
 class ContactForm(FlaskForm):
     first_name = StringField('First Name', validators=[DataRequired(), Length(min=2, max=50)])
     last_name = StringField('Last Name', validators=[DataRequired(), Length(min=2, max=50)])
@@ -19,13 +169,13 @@ class ProjectForm(FlaskForm):
     title = StringField('Project Title', validators=[DataRequired(), Length(min=2, max=200)])
     description = TextAreaField('Project Description', validators=[DataRequired(), Length(min=10, max=2000)])
     image_filename = SelectField('Project Image', validators=[DataRequired()])
+    tags = StringField('Tags', validators=[Optional(), Length(max=400)])
     submit = SubmitField('Add Project')
     
     def __init__(self, *args, **kwargs):
         super(ProjectForm, self).__init__(*args, **kwargs)
-        # Populate image choices from available images
-        available_images = dal.get_available_images()
-        self.image_filename.choices = [(img, img) for img in available_images]
+        # Populate image choices from the asset catalog
+        self.image_filename.choices = current_dal().get_image_assets()
 
 # Base HTML Template with CSS link
 BASE_TEMPLATE = """
@@ -35,14 +185,38 @@ BASE_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>{{ title }}</title>
+    <link rel="alternate" type="application/atom+xml" title="Projects" href="/projects.atom">
+    {% if config.SPECULATION_RULES %}
+    {{ speculation_markup(request.script_root, config.PREFETCH_EXCLUDE) | safe }}
+    {% endif %}
+    {% if config.SERVICE_WORKER %}
+    <link rel="manifest" href="/manifest.webmanifest">
+    <script>if ('serviceWorker' in navigator) addEventListener('load', function () { navigator.serviceWorker.register('{{ request.script_root }}/sw.js', {scope: '{{ request.script_root }}/'}); });</script>
+    {% endif %}
+    {% set critical_css = frontend_assets.critical_css(request.endpoint) %}
+    {% if frontend_assets.fonts %}
+    {% for font in frontend_assets.fonts %}
+    <link rel="preload" href="/static/fonts/{{ font.file }}" as="font" type="font/woff2" crossorigin>
+    {% endfor %}
+    <style>{{ frontend_assets.font_face_css() | safe }}</style>
+    {% endif %}
+    {% if critical_css %}
+    <style>{{ critical_css | safe }}</style>
+    <link rel="preload" href="/static/css/style.css" as="style" onload="this.onload=null;this.rel='stylesheet'">
+    <noscript><link rel="stylesheet" href="/static/css/style.css"></noscript>
+    {% else %}
     <link rel="stylesheet" href="/static/css/style.css">
+    {% endif %}
+    {% if not frontend_assets.fonts %}
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <link href="https://fonts.googleapis.com/css2?family=Libre+Baskerville:wght@400;700&family=Source+Sans+Pro:wght@300;400;600;700&display=swap" rel="stylesheet">
+    {% endif %}
 </head>
 <body>
     <header class="header">
         <div class="container">
             <h1 class="logo">
-                <a href="/">Saad Siddique</a>
+                <a href="/">{{ site_owner }}</a>
             </h1>
             <nav class="nav">
                 <ul class="nav-list">
@@ -58,6 +232,7 @@ BASE_TEMPLATE = """
 
     <main class="main">
         <!-- Flash Messages -->
+        {% if session_active() and not prefetch_request() %}
         {% with messages = get_flashed_messages(with_categories=true) %}
             {% if messages %}
                 <div class="flash-messages">
@@ -67,20 +242,191 @@ BASE_TEMPLATE = """
                 </div>
             {% endif %}
         {% endwith %}
+        {% endif %}
 
         {{ content | safe }}
     </main>
 
     <footer class="footer">
         <div class="container">
-            <p>&copy; 2024 Saad Siddique. All rights reserved.</p>
+            <p>&copy; 2024 {{ site_owner }}. All rights reserved.</p>
         </div>
     </footer>
 </body>
 </html>
 """
 
+def current_tenant():
+    """The hosted portfolio this request is for, or None for the main site"""
+    return request.environ.get(TENANT_ENVIRON_KEY)
+
+def current_dal():
+    """Database of the current tenant or the main site"""
+    tenant = current_tenant()
+    return tenant.dal if tenant is not None else dal
+
+@lru_cache(maxsize=64)
+def _page_template(source):
+    """Compiled base template; render_template_string would compile it per request"""
+    return app.jinja_env.from_string(source)
+
+# Tenant templates are untrusted: they see only tenant_template_context, and the
+# sandbox keeps them from reaching Python internals through its values
+tenant_jinja_env = SandboxedEnvironment(autoescape=True)
+
+@lru_cache(maxsize=256)
+def _tenant_template(source):
+    """Compiled tenant base template"""
+    return tenant_jinja_env.from_string(source)
+
+def tenant_template_context(tenant, title, content):
+    """Everything a tenant's templates/base.html can use; no config, request or app objects"""
+    return {
+        'title': title,
+        'content': Markup(content),
+        'site_owner': tenant.owner,
+        'script_root': request.script_root,
+        'messages': get_flashed_messages(with_categories=True),
+        'critical_css': Markup(frontend_assets.critical_css(request.endpoint) or ''),
+        'font_face_css': Markup(frontend_assets.font_face_css() if frontend_assets.fonts else ''),
+    }
+
+def render_page(title, content):
+    """Render a page body in the base template, applying tenant overrides"""
+    tenant = current_tenant()
+    if tenant is not None:
+        content = tenant.template(request.endpoint) or content
+        title = title.replace(DEFAULT_OWNER, tenant.owner)
+        source = tenant.template('base')
+        if source is not None:
+            try:
+                return _tenant_template(source).render(tenant_template_context(tenant, title, content))
+            except TemplateError:
+                app.logger.exception("Tenant %s: templates/base.html failed, using the default", tenant.name)
+    context = {'title': title, 'content': content}
+    app.update_template_context(context)
+    return _page_template(BASE_TEMPLATE).render(context)
+
+# Client-supplied request ids are accepted if they look like ids
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+def request_id_for(supplied):
+    """The supplied X-Request-ID if it looks like an id, otherwise a new one"""
+    return supplied if _REQUEST_ID_RE.match(supplied) else uuid.uuid4().hex
+
+@app.before_request
+def assign_request_id():
+    """Tag log records with X-Request-ID from the proxy, or a new id"""
+    request_id = request_id_for(request.headers.get('X-Request-ID', ''))
+    g.request_id = request_id
+    g.request_id_token = REQUEST_ID.set(request_id)
+
+@app.before_request
+def admit_prefetch():
+    """Mark speculative loads and turn them away once PREFETCH_BUDGET is spent"""
+    if request.method != 'GET' or not is_prefetch(request.headers):
+        return None
+    g.purpose_token = REQUEST_PURPOSE.set('prefetch')
+    budget = app.config['PREFETCH_BUDGET']
+    if budget and write_admission.get_store().take('prefetch', *budget):
+        response = make_response('', 503)
+        response.cache_control.no_store = True
+        return response
+    return None
+
+def prefetch_request():
+    """True while handling a prefetch or prerender; such loads leave flash messages alone"""
+    return REQUEST_PURPOSE.get() == 'prefetch'
+
+@app.context_processor
+def inject_prefetch_helpers():
+    return {'prefetch_request': prefetch_request, 'speculation_markup': speculation_markup}
+
+@app.after_request
+def echo_request_id(response):
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+@app.teardown_request
+def clear_request_id(error=None):
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        REQUEST_ID.reset(token)
+    token = g.pop('purpose_token', None)
+    if token is not None:
+        REQUEST_PURPOSE.reset(token)
+
+def session_active():
+    """True if this request sent a session cookie or has written to the session"""
+    return has_session_cookie(app, request.cookies) or session.modified
+
+@app.context_processor
+def inject_session_active():
+    return {'session_active': session_active}
+
+@app.context_processor
+def inject_site_owner():
+    tenant = current_tenant()
+    return {'site_owner': tenant.owner if tenant is not None else DEFAULT_OWNER}
+
+@app.context_processor
+def inject_frontend_assets():
+    return {'frontend_assets': frontend_assets}
+
+@app.after_request
+def early_hints_link_header(response):
+    """Preload hints for style.css and the fonts on every HTML page"""
+    if app.config['EARLY_HINTS'] and response.mimetype == 'text/html':
+        response.headers.add('Link', frontend_assets.link_header())
+    return response
+
+@app.after_request
+def anonymous_cache_headers(response):
+    """Let shared caches keep pages that never touched the session
+
+    Only HTML pages get the shared policy; API responses such as the change
+    feed or search set their own caching, or none.
+    """
+    if (request.method == 'GET' and response.status_code == 200
+            and not session.accessed and not session_active()):
+        if not response.cache_control and response.mimetype == 'text/html':
+            response.cache_control.public = True
+            response.cache_control.max_age = app.config['ANONYMOUS_CACHE_MAX_AGE']
+    else:
+        response.headers.pop(STORE_MARKER, None)
+        if session.accessed and not response.cache_control:
+            response.cache_control.private = True
+    return response
+
+# Root-relative links in page markup, except shared static files
+_ROOT_LINK_RE = re.compile(r'\b(href|action|src)="/(?!static/)')
+
+@app.after_request
+def prefix_root_links(response):
+    """Keep the hard-coded root links of a page inside the /t/<tenant> prefix"""
+    if request.script_root and response.mimetype == 'text/html' and not response.direct_passthrough:
+        prefix = request.script_root
+        response.set_data(_ROOT_LINK_RE.sub(lambda m: f'{m.group(1)}="{prefix}/', response.get_data(as_text=True)))
+    return response
+
+def image_url(image_filename):
+    """URL of a project image: uploaded assets live under static/assets, older images under static/images"""
+    if image_filename.startswith('assets/'):
+        return f"/static/{image_filename}"
+    return f"/static/images/{image_filename}"
+
+def image_metadata_for(filenames):
+    """(width, height, placeholder) of each image filename, queueing unmeasured images"""
+    project_dal = current_dal()
+    rows = project_dal.get_image_metadata(filenames)
+    missing = [(row[0], filename) for filename, row in rows.items() if not row[1]]
+    if missing:
+        image_metadata.request(project_dal, missing)
+    return {filename: row[2:] for filename, row in rows.items() if row[1]}
+
 @app.route('/')
+@cacheable
 def index():
     content = """
     <section class="hero">
@@ -155,17 +501,19 @@ def index():
         </div>
     </section>
     """
-    return render_template_string(BASE_TEMPLATE, title="Home - Saad Siddique", content=content)
+    return render_page(title="Home - Saad Siddique", content=content)
 
 @app.route('/about')
+@cacheable
 def about():
-    content = """
+    profile_attributes = img_attributes(image_metadata_for(['profile.jpg']).get('profile.jpg'), eager=True)
+    content = f"""
     <section class="content-section">
         <div class="container">
             <h1>About Me</h1>
             
             <div class="profile-section">
-                <img src="/static/images/profile.jpg" alt="Saad Siddique professional headshot" class="profile-image">
+                <img src="/static/images/profile.jpg" alt="Saad Siddique professional headshot" class="profile-image" {profile_attributes}>
                 
                 <div class="bio-content">
                     <h2>Professional Background</h2>
@@ -222,39 +570,73 @@ def about():
         </div>
     </section>
     """
-    return render_template_string(BASE_TEMPLATE, title="About Me - Saad Siddique", content=content)
+    return render_page(title="About Me - Saad Siddique", content=content)
+
+def tag_link(tags, label, count=None, selected=False):
+    """Link to /projects filtered by tags"""
+    count_html = f' <span class="tag-count">{count}</span>' if count is not None else ""
+    css_class = "tag tag-selected" if selected else "tag"
+    return f'<a href="{escape(url_for("projects", tag=sorted(tags)))}" class="{css_class}" rel="nofollow">{escape(label)}{count_html}</a>'
 
 @app.route('/projects')
 def projects():
-    # Get all projects from database
-    projects_data = dal.get_all_projects()
+    project_dal = current_dal()
+    tenant = current_tenant()
+    index = tenant.tag_index if tenant is not None else tag_index
+    selected_tags = parse_tags(','.join(request.args.getlist('tag')))
+    
+    # Get all projects from database, narrowed to those carrying every selected tag
+    projects_data = project_dal.get_all_projects()
+    selected = index.select(project_dal, selected_tags)
+    if selected is not None:
+        projects_data = [project for project in projects_data if project[0] in selected]
+    images = image_metadata_for(project[3] for project in projects_data)
+    project_tags = project_dal.get_project_tags(project[0] for project in projects_data)
+    
+    # Selected tags link to the filter without them; the rest narrow it further
+    facets_html = "".join(tag_link([t for t in selected_tags if t != tag], tag, selected=True)
+                          for tag in selected_tags)
+    facets_html += "".join(tag_link(selected_tags + [tag], tag, count)
+                           for tag, count in index.facets(project_dal, selected) if tag not in selected_tags)
+    if selected_tags:
+        facets_html += f'<a href="{url_for("projects")}" class="tag-clear">Clear filters</a>'
+    if facets_html:
+        facets_html = f'<div class="tag-facets">{facets_html}</div>'
     
     # Build projects HTML
     projects_html = ""
-    for project in projects_data:
+    for position, project in enumerate(projects_data):
         project_id, title, description, image_filename, created_date, updated_date = project
+        attributes = img_attributes(images.get(image_filename),
+                                    eager=position < app.config['EAGER_PROJECT_IMAGES'])
+        tags_html = "".join(tag_link([tag], tag) for tag in project_tags.get(project_id, []))
         
         projects_html += f"""
         <div class="project-card">
             <div class="project-image">
-                <img src="/static/images/{image_filename}" alt="{title}" class="project-img">
+                <img src="{image_url(image_filename)}" alt="{title}" class="project-img" {attributes}>
             </div>
             <div class="project-content">
-                <h3>{title}</h3>
+                <h3><a href="/projects/{project_id}">{title}</a></h3>
                 <p class="project-description">{description}</p>
+                <div class="project-tags">{tags_html}</div>
                 <div class="project-meta">
                     <small>Created: {created_date}</small>
                 </div>
             </div>
         </div>
         """
+    empty_html = ""
+    if selected_tags and not projects_data:
+        empty_html = '<p class="no-results">No projects carry all of the selected tags.</p>'
     
     content = f"""
     <section class="content-section">
         <div class="container">
             <h1>Projects & Portfolio</h1>
             <p>Here are some of the key projects I've worked on, showcasing my technical skills and problem-solving abilities.</p>
-            
+            {facets_html}
+            {empty_html}
             <div class="projects-grid">
                 {projects_html}
             </div>
@@ -266,9 +648,56 @@ def projects():
         </div>
     </section>
     """
-    return render_template_string(BASE_TEMPLATE, title="Projects - Saad Siddique", content=content)
+    return render_page(title="Projects - Saad Siddique", content=content)
+
+@app.route('/projects/<int:project_id>')
+def project_detail(project_id):
+    tenant = current_tenant()
+    cache = tenant.project_cache if tenant is not None else project_cache
+    entry = cache.get(current_dal(), project_id)
+    if entry is None:
+        abort(404)
+    
+    _, title, description, image_filename, created_date, updated_date = entry.project
+    metadata = entry.image_metadata
+    if metadata is None:
+        metadata = image_metadata_for([image_filename]).get(image_filename)
+    attributes = img_attributes(metadata, eager=True)
+    tags_html = "".join(tag_link([tag], tag) for tag in entry.tags)
+    pager = ""
+    if entry.newer_id is not None:
+        pager += f'<a href="/projects/{entry.newer_id}" class="btn btn-secondary" rel="prev">&larr; Newer Project</a>\n'
+    if entry.older_id is not None:
+        pager += f'<a href="/projects/{entry.older_id}" class="btn btn-secondary" rel="next">Older Project &rarr;</a>\n'
+    
+    content = f"""
+    <section class="content-section">
+        <div class="container">
+            <div class="project-detail">
+                <div class="project-image">
+                    <img src="{escape(image_url(image_filename))}" alt="{escape(title)}" class="project-img" {attributes}>
+                </div>
+                <div class="project-content">
+                    <h1>{escape(title)}</h1>
+                    <p class="project-description">{escape(description)}</p>
+                    <div class="project-tags">{tags_html}</div>
+                    <div class="project-meta">
+                        <small>Created: {created_date} &middot; Updated: {updated_date}</small>
+                    </div>
+                </div>
+            </div>
+            
+            <div class="project-pager">
+                {pager}
+                <a href="/projects" class="btn">All Projects</a>
+            </div>
+        </div>
+    </section>
+    """
+    return render_page(title=f"{title} - Saad Siddique", content=content)
 
 @app.route('/resume')
+@cacheable
 def resume():
     content = """
     <section class="content-section">
@@ -302,26 +731,11 @@ def resume():
         </div>
     </section>
     """
-    return render_template_string(BASE_TEMPLATE, title="Resume - Saad Siddique", content=content)
+    return render_page(title="Resume - Saad Siddique", content=content)
 
-@app.route('/add-project', methods=['GET', 'POST'])
-def add_project():
-    form = ProjectForm()
-    if form.validate_on_submit():
-        # Add project to database
-        project_id = dal.add_project(
-            form.title.data,
-            form.description.data,
-            form.image_filename.data
-        )
-        
-        if project_id:
-            flash('Project added successfully!', 'success')
-            return redirect(url_for('projects'))
-        else:
-            flash('Error adding project. Please try again.', 'error')
-    
-    content = f"""
+def _add_project_content(form, hidden_tag):
+    """Build the add-project page body around the given hidden tag markup"""
+    return f"""
     <section class="content-section">
         <div class="container">
             <h1>Add New Project</h1>
@@ -329,7 +743,7 @@ def add_project():
             
             <div class="project-form-section">
                 <form method="POST" class="project-form" novalidate>
-                    {form.hidden_tag()}
+                    {hidden_tag}
                     
                     <div class="form-group">
                         {form.title.label(class_="form-label")}
@@ -351,7 +765,15 @@ def add_project():
                         {form.image_filename.label(class_="form-label")}
                         {form.image_filename(class_="form-control")}
                         <div class="form-help">
-                            <p>Select an image from your static/images folder. To add new images, simply drag and drop them into the static/images folder and refresh this page.</p>
+                            <p>Select an image from the asset library. To add new images, upload them with a multipart POST to /assets and refresh this page.</p>
+                        </div>
+                    </div>
+
+                    <div class="form-group">
+                        {form.tags.label(class_="form-label")}
+                        {form.tags(class_="form-control", placeholder="e.g. python, flask, sqlite")}
+                        <div class="form-help">
+                            <p>Optional. Separate tags with commas.</p>
                         </div>
                     </div>
 
@@ -364,18 +786,10 @@ def add_project():
         </div>
     </section>
     """
-    return render_template_string(BASE_TEMPLATE, title="Add Project - Saad Siddique", content=content)
 
-@app.route('/contact', methods=['GET', 'POST'])
-def contact():
-    form = ContactForm()
-    if form.validate_on_submit():
-        # Here you would typically save the form data to a database
-        # For now, we'll just flash a success message
-        flash('Thank you for your message! I will get back to you as soon as possible.', 'success')
-        return redirect(url_for('thank_you'))
-    
-    content = f"""
+def _contact_content(form, hidden_tag):
+    """Build the contact page body around the given hidden tag markup"""
+    return f"""
     <section class="content-section">
         <div class="container">
             <h1>Get In Touch</h1>
@@ -406,7 +820,7 @@ def contact():
                 <p>Use the form below to send me a direct message. All fields are required.</p>
                 
                 <form method="POST" class="contact-form" novalidate>
-                    {form.hidden_tag()}
+                    {hidden_tag}
                     
                     <div class="form-group">
                         {form.first_name.label(class_="form-label")}
@@ -463,7 +877,58 @@ def contact():
         </div>
     </section>
     """
-    return render_template_string(BASE_TEMPLATE, title="Contact - Saad Siddique", content=content)
+
+@app.route('/add-project', methods=['GET', 'POST'])
+@write_admission.limit('add_project')
+def add_project():
+    form = ProjectForm()
+    if form.validate_on_submit():
+        # Add project to database
+        try:
+            with write_admission.track_write():
+                project_id = current_dal().add_project(
+                    form.title.data,
+                    form.description.data,
+                    form.image_filename.data
+                )
+                tags = parse_tags(form.tags.data)
+                if project_id and tags:
+                    current_dal().set_project_tags(project_id, tags)
+        except DatabaseUnavailable:
+            raise
+        except DALError:
+            project_id = None
+        
+        if project_id:
+            flash('Project added successfully!', 'success')
+            return redirect(url_for('projects'))
+        else:
+            flash('Error adding project. Please try again.', 'error')
+    
+    content = form_cache.render('add_project', form, _add_project_content,
+                                key=tuple(form.image_filename.choices))
+    return render_page(title="Add Project - Saad Siddique", content=content)
+
+@app.route('/contact', methods=['GET', 'POST'])
+@write_admission.limit('contact')
+def contact():
+    form = ContactForm()
+    if form.validate_on_submit():
+        action = app.config['CONTACT_DEDUP']
+        if action != 'off' and contact_filter.seen(fingerprint(form.email.data, form.message.data)):
+            app.logger.info("Duplicate contact submission %s", 'dropped' if action == 'drop' else 'flagged')
+            if action == 'drop':
+                # Same answer as a first submission, so resending tells a bot nothing
+                flash('Thank you for your message! I will get back to you as soon as possible.', 'success')
+                return redirect(url_for('thank_you'))
+        
+        # Here you would typically save the form data to a database
+        # For now, we'll just flash a success message
+        flash('Thank you for your message! I will get back to you as soon as possible.', 'success')
+        return redirect(url_for('thank_you'))
+    
+    content = form_cache.render('contact', form, _contact_content)
+    return render_page(title="Contact - Saad Siddique", content=content)
 
 @app.route('/thank-you')
 def thank_you():
@@ -481,7 +946,271 @@ def thank_you():
         </div>
     </section>
     """
-    return render_template_string(BASE_TEMPLATE, title="Thank You - Saad Siddique", content=content)
+    return render_page(title="Thank You - Saad Siddique", content=content)
+
+def _feed_response(kind, mimetype):
+    """Serve a cached feed document, gzipped if accepted, honouring conditional GETs"""
+    tenant = current_tenant()
+    cache = tenant.feed_cache if tenant is not None else feed_cache
+    document = cache.get(current_dal(), kind, request.url_root)
+    
+    gzipped = request.accept_encodings['gzip'] > 0
+    response = make_response(document.gzipped if gzipped else document.body)
+    response.mimetype = mimetype
+    response.vary.add('Accept-Encoding')
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(f"{kind}-{document.version}" + ("-gzip" if gzipped else ""))
+    if document.last_modified:
+        response.last_modified = datetime.strptime(document.last_modified, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['ANONYMOUS_CACHE_MAX_AGE']
+    return response.make_conditional(request)
+
+@app.route('/sitemap.xml')
+def sitemap():
+    return _feed_response(SITEMAP, 'application/xml')
+
+@app.route('/projects.atom')
+def projects_atom():
+    return _feed_response(ATOM, 'application/atom+xml')
+
+@app.route('/sw.js')
+def service_worker_script():
+    """The service worker; browsers re-check it on navigation and install it when the bytes change"""
+    if not app.config['SERVICE_WORKER']:
+        abort(404)
+    script, version = service_worker.script(page_urls(app), request.script_root)
+    response = make_response(script)
+    response.mimetype = 'text/javascript'
+    response.set_etag(version)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/manifest.webmanifest')
+def web_manifest_file():
+    """Web app manifest, with the profile photo as icon"""
+    icon = None
+    size = read_dimensions(os.path.join('static', 'images', 'profile.jpg'))
+    if size:
+        icon = ('/static/images/profile.jpg', size[0], size[1], 'image/jpeg')
+    tenant = current_tenant()
+    owner = tenant.owner if tenant is not None else DEFAULT_OWNER
+    response = jsonify(web_manifest(owner, request.script_root, icon))
+    response.mimetype = 'application/manifest+json'
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['ANONYMOUS_CACHE_MAX_AGE']
+    return response
+
+@app.route('/search')
+def search_documents():
+    """Full-text search over the PDF pages; hits deep-link to the page in the viewer"""
+    query = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    return jsonify(query=query, hits=pdf_index.search(query, limit=limit))
+
+@app.route('/api/projects/changes')
+def project_changes():
+    """Changes after ?since=<seq>, oldest first, for mirrors that sync incrementally
+
+    With ?wait=<seconds> the request is held open until a change arrives.
+    since=0 replays the latest change of every project as a full snapshot; a
+    since inside the compacted part of the log may have missed deletes, so it
+    gets 410 and the client starts over from 0.
+    """
+    since = max(request.args.get('since', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    wait = request.args.get('wait', 0, type=float)
+    
+    tenant = current_tenant()
+    project_dal = current_dal()
+    if wait > 0:
+        notifier = tenant.change_notifier if tenant is not None else change_notifier
+        notifier.wait_for_changes(project_dal, since, wait)
+    changes, compacted_through = project_dal.get_changes(since, limit=limit + 1)
+    if 0 < since < compacted_through:
+        return jsonify(error='resync', compacted_through=compacted_through), 410
+    
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    next_since = changes[-1][0] if changes else max(since, project_dal.get_latest_change_seq())
+    response = jsonify(changes=[change_to_dict(change) for change in changes],
+                       next_since=next_since, has_more=has_more)
+    # A cached copy would answer a long-poll with changes it has already seen
+    response.cache_control.no_store = True
+    return response
+
+@app.route('/api/projects/export')
+def export_projects_file():
+    """Every project as ?format=csv (default) or jsonl, gzipped with ?gzip=1, streamed in chunks"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        abort(400)
+    compress = request.args.get('gzip', '0') not in ('0', '', 'false')
+    filename = f"projects-{datetime.now(timezone.utc):%Y%m%d}.{fmt}" + ('.gz' if compress else '')
+    response = app.response_class(export_projects(current_dal(), fmt, compress),
+                                  mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.cache_control.no_store = True
+    return response
+
+@app.route('/stats')
+def portfolio_stats():
+    """Project count, projects per month and image usage from the maintained aggregates"""
+    stats = current_dal().get_stats()
+    return jsonify(
+        projects=stats['projects'],
+        per_month=[{'month': month, 'projects': count} for month, count in stats['per_month']],
+        image_usage=[{'image_filename': image_filename, 'projects': count}
+                     for image_filename, count in stats['image_usage']],
+    )
+
+def admin_token_supplied():
+    """True if the request carries ADMIN_TOKEN as a bearer token"""
+    token = app.config['ADMIN_TOKEN']
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    return bool(token) and hmac.compare_digest(supplied.encode(), token.encode())
+
+@app.route('/admin/query-stats')
+def query_stats():
+    """This worker's per-statement DAL statistics and recent slow queries"""
+    if not app.config['ADMIN_TOKEN']:
+        abort(404)
+    if not admin_token_supplied():
+        abort(403)
+    response = jsonify(query_stats_report(current_dal().query_stats))
+    response.cache_control.no_store = True
+    return response
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    response = jsonify(status='ok')
+    response.cache_control.no_store = True
+    return response
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: warm-up has succeeded and the database answers within READY_DB_LATENCY_MS"""
+    status, latency_ms = 'ready', None
+    if not readiness.ready:
+        # cold (not warmed yet), warming, or failed
+        status = readiness.state
+    else:
+        try:
+            latency_ms = round(current_dal().ping() * 1000, 2)
+            if latency_ms > app.config['READY_DB_LATENCY_MS']:
+                status = 'database-slow'
+        except DALError:
+            status = 'database-unavailable'
+    warmup_ms = round(readiness.seconds * 1000) if readiness.seconds is not None else None
+    response = jsonify(status=status, warmup=readiness.state, warmup_ms=warmup_ms,
+                       db_latency_ms=latency_ms)
+    response.status_code = 200 if status == 'ready' else 503
+    response.cache_control.no_store = True
+    return response
+
+@app.route('/assets', methods=['POST'])
+@write_admission.limit('upload_assets')
+def upload_assets():
+    """Store uploaded files from a multipart body, streaming each one to disk
+
+    Like the site's forms, an upload needs the CSRF token of the visitor's
+    session (X-CSRFToken), unless it carries ADMIN_TOKEN as a bearer token.
+    """
+    if not admin_token_supplied() and app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.headers.get('X-CSRFToken'))
+        except ValidationError:
+            abort(403)
+    if request.content_length is not None and request.content_length > app.config['MAX_UPLOAD_BYTES']:
+        abort(413)
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        abort(400)
+    
+    stored_assets = asset_store.save_multipart(request.stream, boundary.encode('latin-1'))
+    try:
+        assets = current_dal().add_assets([(stored.sha256, stored.filename, stored.original_name,
+                                            stored.content_type, stored.size) for stored in stored_assets])
+    except DALError:
+        # Unregistered files would never be cleaned up
+        asset_store.discard(stored_assets)
+        raise
+    
+    uploaded = []
+    for stored, asset in zip(stored_assets, assets):
+        if stored.content_type.startswith('image/'):
+            image_metadata.request(current_dal(), [(stored.sha256, asset[2])])
+        uploaded.append({
+            'id': asset[0],
+            'sha256': stored.sha256,
+            'filename': asset[2],
+            'url': f"/static/{asset[2]}",
+            'content_type': stored.content_type,
+            'size': stored.size,
+            'deduplicated': stored.deduplicated,
+        })
+    return jsonify(assets=uploaded), 201
+
+def reset_process_state():
+    """Drop per-process caches and limiter state, e.g. in a freshly forked worker"""
+    form_cache.clear()
+    page_cache.clear()
+    project_cache.clear()
+    tag_index.clear()
+    feed_cache.clear()
+    image_metadata.reset()
+    dal.flights.reset()
+    dal.query_stats.reset()
+    readiness.reset()
+    maintenance.reset()
+    tenant_registry.clear()
+    write_admission.reset_after_fork()
+    log_pipeline.reset_after_fork()
+
+def warm_up_process():
+    """Warm this process's database pages and caches; gunicorn runs it in each new worker"""
+    return warm_up(app, dal, readiness, host=app.config['WARMUP_HOST'],
+                   project_limit=app.config['WARMUP_PROJECTS'], image_metadata=image_metadata)
+
+def start_maintenance():
+    """Start this worker's maintenance thread; gunicorn runs it in each new worker"""
+    if app.config['MAINTENANCE_IN_PROCESS']:
+        maintenance.start(dal)
+
+@app.errorhandler(429)
+@app.errorhandler(503)
+def over_capacity(error):
+    """Explain a rejected write while keeping the Retry-After header"""
+    content = f"""
+    <section class="content-section">
+        <div class="container">
+            <h1>Please Try Again Shortly</h1>
+            <p>We are receiving more submissions than we can handle right now. Please wait {error.retry_after or 1} seconds and try again.</p>
+        </div>
+    </section>
+    """
+    response = make_response(render_page(title="Try Again - Saad Siddique", content=content), error.code)
+    if error.retry_after:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@app.errorhandler(DatabaseUnavailable)
+def database_unavailable(error):
+    """Ask the client to retry when the database is busy or locked"""
+    retry_after = app.config['DB_UNAVAILABLE_RETRY_AFTER']
+    content = f"""
+    <section class="content-section">
+        <div class="container">
+            <h1>Please Try Again Shortly</h1>
+            <p>The site is busy right now. Please wait {retry_after} seconds and try again.</p>
+        </div>
+    </section>
+    """
+    response = make_response(render_page(title="Try Again - Saad Siddique", content=content), 503)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
 
 # Route to serve static files (PDFs, images, etc.)
 @app.route('/static/<path:filename>')
@@ -0,0 +1,210 @@
+"""
+Content-addressed asset storage
+Streams uploads to disk in chunks while hashing them, and stores each distinct
+file once under static/assets/<first two hex digits>/<sha256><extension>
+"""
+
+import hashlib
+import os
+import tempfile
+
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+CHUNK_SIZE = 64 * 1024
+
+# Allowed extensions with their content type and leading magic bytes
+ALLOWED_TYPES = {
+    '.jpg': ('image/jpeg', b'\xff\xd8\xff'),
+    '.jpeg': ('image/jpeg', b'\xff\xd8\xff'),
+    '.png': ('image/png', b'\x89PNG\r\n\x1a\n'),
+    '.gif': ('image/gif', b'GIF8'),
+    '.webp': ('image/webp', b'RIFF'),
+    '.pdf': ('application/pdf', b'%PDF-'),
+}
+
+# Bytes needed to recognise every type in ALLOWED_TYPES
+SNIFF_LENGTH = 12
+
+
+def content_type_for(filename):
+    """Return the content type for an allowed filename, or None"""
+    entry = ALLOWED_TYPES.get(os.path.splitext(filename)[1].lower())
+    return entry[0] if entry else None
+
+
+def hash_file(path):
+    """SHA-256 of a file on disk, read in chunks"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class StoredAsset:
+    """Result of storing one upload"""
+
+    def __init__(self, sha256, filename, original_name, content_type, size, deduplicated):
+        self.sha256 = sha256
+        # Path relative to static/, e.g. assets/ab/ab12....png
+        self.filename = filename
+        self.original_name = original_name
+        self.content_type = content_type
+        self.size = size
+        self.deduplicated = deduplicated
+
+
+class _PendingUpload:
+    """One file being written to a temporary file while it is hashed"""
+
+    def __init__(self, store, original_name):
+        extension = os.path.splitext(original_name)[1].lower()
+        if extension not in ALLOWED_TYPES:
+            raise UnsupportedMediaType(f"File type not allowed: {original_name}")
+
+        self.store = store
+        self.original_name = original_name
+        self.extension = '.jpg' if extension == '.jpeg' else extension
+        self.content_type, self.magic = ALLOWED_TYPES[extension]
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+        self.sniffed = False
+        os.makedirs(store.root, exist_ok=True)
+        self.tmp = tempfile.NamedTemporaryFile(dir=store.root, prefix='.upload-', delete=False)
+
+    def _sniff(self):
+        if not self.head.startswith(self.magic) or (
+                self.extension == '.webp' and self.head[8:12] != b'WEBP'):
+            raise UnsupportedMediaType(f"Content does not match file type: {self.original_name}")
+        self.sniffed = True
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.store.max_bytes:
+            raise RequestEntityTooLarge(f"File exceeds {self.store.max_bytes} bytes")
+        if not self.sniffed:
+            self.head += data[:SNIFF_LENGTH]
+            if len(self.head) >= SNIFF_LENGTH:
+                self._sniff()
+        self.hasher.update(data)
+        self.tmp.write(data)
+
+    def finish(self):
+        """Check the complete file; it stays staged until commit()"""
+        self.tmp.close()
+        if not self.size:
+            raise BadRequest(f"Empty file: {self.original_name}")
+        if not self.sniffed:
+            self._sniff()
+        return self
+
+    def commit(self):
+        """Move the finished file into place, or drop it if the content exists"""
+        sha256 = self.hasher.hexdigest()
+        filename = self.store.filename_for(sha256, self.extension)
+        final_path = self.store.path_for(filename)
+        deduplicated = os.path.exists(final_path)
+        if deduplicated:
+            os.unlink(self.tmp.name)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(self.tmp.name, final_path)
+        return StoredAsset(sha256, filename, self.original_name, self.content_type,
+                           self.size, deduplicated)
+
+    def abort(self):
+        self.tmp.close()
+        if os.path.exists(self.tmp.name):
+            os.unlink(self.tmp.name)
+
+
+class AssetStore:
+    """Content-addressed file store below a static directory"""
+
+    def __init__(self, root="static/assets", max_bytes=20 * 1024 * 1024, max_files=10):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+
+    def filename_for(self, sha256, extension):
+        """Path of a stored file relative to static/"""
+        return f"{os.path.basename(self.root)}/{sha256[:2]}/{sha256}{extension}"
+
+    def path_for(self, filename):
+        """Absolute location of a filename returned by filename_for"""
+        return os.path.join(os.path.dirname(self.root), filename)
+
+    def save_stream(self, chunks, original_name):
+        """Store a file given as an iterable of byte chunks"""
+        upload = _PendingUpload(self, original_name)
+        try:
+            for chunk in chunks:
+                upload.write(chunk)
+            return upload.finish().commit()
+        except Exception:
+            upload.abort()
+            raise
+
+    def save_multipart(self, stream, boundary):
+        """Store every file part of a multipart/form-data body read from stream
+
+        The body is decoded incrementally; only one chunk is held in memory.
+        Parts are staged until the whole body has been checked, so a rejected
+        part leaves none of the others in place either.
+        """
+        decoder = MultipartDecoder(boundary, max_form_memory_size=CHUNK_SIZE * 2,
+                                   max_parts=self.max_files * 2)
+        staged = []
+        # Holds the file currently being written so it can be cleaned up on errors
+        pending = {'upload': None}
+        try:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                decoder.receive_data(chunk)
+                self._drain(decoder, pending, staged)
+            decoder.receive_data(None)
+            self._drain(decoder, pending, staged)
+            if pending['upload'] is not None:
+                raise BadRequest("Incomplete multipart body")
+            if not staged:
+                raise BadRequest("No file in upload")
+        except Exception:
+            for upload in staged + [pending['upload']]:
+                if upload is not None:
+                    upload.abort()
+            raise
+
+        stored = []
+        try:
+            for upload in staged:
+                stored.append(upload.commit())
+        except Exception:
+            self.discard(stored)
+            for upload in staged[len(stored):]:
+                upload.abort()
+            raise
+        return stored
+
+    def discard(self, stored):
+        """Remove the files a failed upload put in place (not the ones it deduplicated against)"""
+        for asset in stored:
+            if not asset.deduplicated:
+                try:
+                    os.unlink(self.path_for(asset.filename))
+                except OSError:
+                    pass
+
+    def _drain(self, decoder, pending, staged):
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, File):
+                if len(staged) >= self.max_files:
+                    raise RequestEntityTooLarge(f"At most {self.max_files} files per upload")
+                pending['upload'] = _PendingUpload(self, event.filename)
+            elif isinstance(event, Data) and pending['upload'] is not None:
+                pending['upload'].write(event.data)
+                if not event.more_data:
+                    staged.append(pending['upload'].finish())
+                    pending['upload'] = None
+            event = decoder.next_event()
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Online backups of projects.db
+Copies the live database with the SQLite backup API a few pages at a time, so
+writers only wait for one short step, and keeps point-in-time snapshots with a
+retention policy. Each snapshot is a whole-file copy; one whose hash matches
+the previous snapshot is not stored.
+
+    python backup.py snapshot [--gzip]          # snapshot projects.db into backups/
+    python backup.py list
+    python backup.py prune --keep-last 7 --keep-daily 7 --keep-weekly 4
+    python backup.py verify [SNAPSHOT]          # integrity check (default: newest)
+    python backup.py restore SNAPSHOT           # copy a snapshot back into projects.db
+                                                # (caches and change-feed clients resync)
+    python backup.py bench --rows 50000         # measure throughput and writer stalls
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+DEFAULT_DB = os.environ.get('DATABASE_PATH', 'projects.db')
+DEFAULT_DIR = 'backups'
+MANIFEST = 'manifest.json'
+# Pages copied per step and pause between steps; writers can get in between steps
+DEFAULT_PAGES = 256
+DEFAULT_SLEEP = 0.002
+# A write by another connection restarts a stepped backup. After this many
+# restarts the rest is copied in one step, which holds a read lock for the
+# copy (writers still proceed in WAL mode)
+MAX_RESTARTS = 5
+
+
+def file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def online_backup(source_path, target_path, pages=DEFAULT_PAGES, sleep=DEFAULT_SLEEP,
+                  max_restarts=MAX_RESTARTS):
+    """Copy a live database to target_path; returns a dict of copy statistics"""
+    stats = {'steps': 0, 'restarts': 0, 'pages': 0, 'longest_step': 0.0}
+    state = {'remaining': None, 'last': time.perf_counter()}
+
+    def progress(status, remaining, total):
+        now = time.perf_counter()
+        stats['steps'] += 1
+        stats['pages'] = total
+        # Sleep between steps is included, so subtract it from the step time
+        stats['longest_step'] = max(stats['longest_step'], now - state['last'] - sleep)
+        if state['remaining'] is not None and remaining > state['remaining']:
+            stats['restarts'] += 1
+            if stats['restarts'] > max_restarts:
+                raise _TooManyRestarts()
+        state['remaining'] = remaining
+        state['last'] = now
+
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    start = time.perf_counter()
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress, sleep=sleep)
+        except _TooManyRestarts:
+            # Writers keep restarting the stepped copy; take it in one step instead
+            step_start = time.perf_counter()
+            source.backup(target, pages=-1)
+            stats['longest_step'] = max(stats['longest_step'], time.perf_counter() - step_start)
+    finally:
+        source.close()
+        target.close()
+    stats['seconds'] = time.perf_counter() - start
+    stats['bytes'] = os.path.getsize(target_path)
+    stats['longest_step'] = max(stats['longest_step'], 0.0)
+    return stats
+
+
+def integrity_check(db_path):
+    """Return 'ok' or the first problem PRAGMA integrity_check reports"""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return conn.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _change_log_state(conn):
+    """(newest change sequence number, tags version) of a database, or None without a change log"""
+    try:
+        seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'project_changes'").fetchone()
+        tags_version = conn.execute("SELECT value FROM change_feed_state WHERE key = 'tags_version'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return (seq[0] if seq else 0), (tags_version[0] if tags_version else 0)
+
+
+def change_log_state(db_path):
+    """_change_log_state of the database at db_path; (0, 0) if it can't be read"""
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return 0, 0
+    try:
+        return _change_log_state(conn) or (0, 0)
+    except sqlite3.DatabaseError:
+        return 0, 0
+    finally:
+        conn.close()
+
+
+def advance_change_log(db_path, previous):
+    """Move a restored database's change log past previous, the state it replaced
+
+    Caches and change-feed clients remember the last change sequence number
+    and tags version they saw, which the restored snapshot may be behind.
+    The sequence number and tags version are set past both, and every change
+    up to the new sequence number is marked compacted, so all of them resync.
+    Returns the new sequence number, or None if the database has no change log.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        restored = _change_log_state(conn)
+        if restored is None:
+            return None
+        seq = max(restored[0], previous[0]) + 1
+        tags_version = max(restored[1], previous[1]) + 1
+        with conn:
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = 'project_changes'")
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('project_changes', ?)", (seq,))
+            conn.executemany('''
+                INSERT INTO change_feed_state (key, value) VALUES (?, ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value
+            ''', [('compacted_through', seq), ('tags_version', tags_version)])
+        return seq
+    finally:
+        conn.close()
+
+
+def select_retained(snapshots, keep_last=7, keep_daily=7, keep_weekly=4):
+    """Names of the snapshots a last/daily/weekly retention policy keeps
+
+    snapshots are dicts with 'file' and an ISO 'created' timestamp. The newest
+    keep_last are kept, plus the newest snapshot of each of the last
+    keep_daily days and keep_weekly ISO weeks that have one.
+    """
+    ordered = sorted(snapshots, key=lambda snapshot: snapshot['created'], reverse=True)
+    keep = {snapshot['file'] for snapshot in ordered[:keep_last]}
+    for limit, bucket in ((keep_daily, lambda created: created.date()),
+                          (keep_weekly, lambda created: created.isocalendar()[:2])):
+        seen = []
+        for snapshot in ordered:
+            key = bucket(datetime.fromisoformat(snapshot['created']))
+            if key not in seen:
+                if len(seen) == limit:
+                    break
+                seen.append(key)
+                keep.add(snapshot['file'])
+    return keep
+
+
+class SnapshotStore:
+    """Directory of database snapshots described by a manifest
+
+    Each snapshot records the sha256 of the uncompressed database. A snapshot
+    identical to the newest one is not stored again, so frequent snapshots of
+    a quiet database cost nothing.
+    """
+
+    def __init__(self, directory=DEFAULT_DIR):
+        self.directory = directory
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, MANIFEST)
+
+    def snapshots(self):
+        """Snapshot dicts, oldest first"""
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _write_manifest(self, snapshots):
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(snapshots, f, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+    def find(self, name=None):
+        """The snapshot with file name (default: the newest), or None"""
+        snapshots = self.snapshots()
+        if name is None:
+            return snapshots[-1] if snapshots else None
+        name = os.path.basename(name)
+        return next((snapshot for snapshot in snapshots if snapshot['file'] == name), None)
+
+    def create(self, db_path=DEFAULT_DB, compress=False, **backup_options):
+        """Snapshot db_path; returns (snapshot, stats), snapshot None if unchanged"""
+        os.makedirs(self.directory, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(suffix='.db', dir=self.directory)
+        os.close(handle)
+        try:
+            stats = online_backup(db_path, temp_path, **backup_options)
+            sha256 = file_sha256(temp_path)
+            snapshots = self.snapshots()
+            if snapshots and snapshots[-1]['sha256'] == sha256:
+                return None, stats
+
+            created = datetime.now(timezone.utc)
+            name = f"projects-{created.strftime('%Y%m%dT%H%M%S%fZ')}.db"
+            if compress:
+                name += '.gz'
+                with open(temp_path, 'rb') as src, gzip.open(os.path.join(self.directory, name), 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+            else:
+                os.replace(temp_path, os.path.join(self.directory, name))
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+        snapshot = {
+            'file': name,
+            'created': created.isoformat(),
+            'sha256': sha256,
+            'size': stats['bytes'],
+            'stored_size': os.path.getsize(os.path.join(self.directory, name)),
+        }
+        self._write_manifest(snapshots + [snapshot])
+        return snapshot, stats
+
+    def prune(self, keep_last=7, keep_daily=7, keep_weekly=4):
+        """Delete the snapshots the retention policy doesn't keep; returns their names"""
+        snapshots = self.snapshots()
+        keep = select_retained(snapshots, keep_last, keep_daily, keep_weekly)
+        removed = [snapshot['file'] for snapshot in snapshots if snapshot['file'] not in keep]
+        self._write_manifest([snapshot for snapshot in snapshots if snapshot['file'] in keep])
+        for name in removed:
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                os.unlink(path)
+        return removed
+
+    def _extract(self, snapshot):
+        """Path of an uncompressed temporary copy of a snapshot (caller deletes it)
+
+        The copy is removed again if the snapshot can't be read.
+        """
+        handle, temp_path = tempfile.mkstemp(suffix='.db', dir=self.directory)
+        path = os.path.join(self.directory, snapshot['file'])
+        opener = gzip.open if snapshot['file'].endswith('.gz') else open
+        try:
+            with os.fdopen(handle, 'wb') as dst, opener(path, 'rb') as src:
+                shutil.copyfileobj(src, dst)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return temp_path
+
+    def verify(self, snapshot):
+        """Return (ok, message) after checking the hash and SQLite integrity"""
+        try:
+            temp_path = self._extract(snapshot)
+        except (OSError, EOFError, zlib.error) as e:
+            return False, f"unreadable: {e}"
+        try:
+            if file_sha256(temp_path) != snapshot['sha256']:
+                return False, "checksum mismatch"
+            result = integrity_check(temp_path)
+            return result == 'ok', result
+        except sqlite3.DatabaseError as e:
+            return False, str(e)
+        finally:
+            os.unlink(temp_path)
+
+    def restore(self, snapshot, db_path=DEFAULT_DB, **backup_options):
+        """Verify a snapshot and copy it into db_path while the site keeps running
+
+        The restored change log is moved past the replaced one (see
+        advance_change_log); the returned statistics include its 'change_seq'.
+        """
+        ok, message = self.verify(snapshot)
+        if not ok:
+            raise ValueError(f"Snapshot {snapshot['file']} failed verification: {message}")
+        temp_path = self._extract(snapshot)
+        try:
+            previous = change_log_state(db_path)
+            stats = online_backup(temp_path, db_path, **backup_options)
+        finally:
+            os.unlink(temp_path)
+        stats['change_seq'] = advance_change_log(db_path, previous)
+        return stats
+
+
+def bench(rows=50000, write_interval=0.001, wal=True, **backup_options):
+    """Back up a padded scratch copy of projects.db while a writer keeps adding projects
+
+    Returns backup statistics plus the writer's latencies before and during
+    the backup, the largest of which is the stall the backup caused.
+    """
+    from DAL import DatabaseAccessLayer
+
+    workdir = tempfile.mkdtemp(prefix='backup-bench-')
+    try:
+        db_path = os.path.join(workdir, 'projects.db')
+        if os.path.exists(DEFAULT_DB):
+            online_backup(DEFAULT_DB, db_path, pages=-1)
+        dal = DatabaseAccessLayer(db_path)
+        if wal:
+            # As in production (wsgi.py)
+            dal.enable_wal()
+        conn = dal.get_connection()
+        conn.executemany(
+            'INSERT INTO projects (title, description, image_filename) VALUES (?, ?, ?)',
+            ((f"Bench project {i}", "Padding row for the backup benchmark " * 8, "bench.jpg")
+             for i in range(rows))
+        )
+        conn.commit()
+        conn.close()
+
+        latencies = {'before': [], 'during': []}
+        phase = {'name': 'before'}
+        stop = threading.Event()
+
+        def writer():
+            while not stop.is_set():
+                start = time.perf_counter()
+                dal.add_project("Bench write", "Written during the backup benchmark", "bench.jpg")
+                latencies[phase['name']].append(time.perf_counter() - start)
+                time.sleep(write_interval)
+
+        thread = threading.Thread(target=writer, daemon=True)
+        thread.start()
+        time.sleep(0.5)
+        phase['name'] = 'during'
+        stats = online_backup(db_path, os.path.join(workdir, 'copy.db'), **backup_options)
+        stop.set()
+        thread.join()
+
+        stats['throughput_mb_s'] = stats['bytes'] / 1e6 / stats['seconds'] if stats['seconds'] else 0.0
+        for name, values in latencies.items():
+            values.sort()
+            stats[f'writes_{name}'] = len(values)
+            stats[f'write_p50_{name}'] = values[len(values) // 2] if values else 0.0
+            stats[f'write_max_{name}'] = values[-1] if values else 0.0
+        return stats
+    finally:
+        shutil.rmtree(workdir)
+
+
+def _print_stats(stats):
+    print(f"  {stats['bytes'] / 1e6:.2f} MB in {stats['seconds']:.3f}s, "
+          f"{stats['steps']} steps, {stats['restarts']} restarts, "
+          f"longest step {stats['longest_step'] * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Back up and restore the projects database")
+    parser.add_argument('--db', default=DEFAULT_DB, help="database path")
+    parser.add_argument('--dir', default=DEFAULT_DIR, help="snapshot directory")
+    parser.add_argument('--pages', type=int, default=DEFAULT_PAGES, help="pages copied per step")
+    parser.add_argument('--sleep', type=float, default=DEFAULT_SLEEP, help="seconds between steps")
+    commands = parser.add_subparsers(dest='command', required=True)
+    snapshot_parser = commands.add_parser('snapshot', help="take a snapshot")
+    snapshot_parser.add_argument('--gzip', action='store_true', help="compress the snapshot file")
+    commands.add_parser('list', help="list snapshots")
+    prune_parser = commands.add_parser('prune', help="apply the retention policy")
+    prune_parser.add_argument('--keep-last', type=int, default=7)
+    prune_parser.add_argument('--keep-daily', type=int, default=7)
+    prune_parser.add_argument('--keep-weekly', type=int, default=4)
+    verify_parser = commands.add_parser('verify', help="check snapshot integrity")
+    verify_parser.add_argument('snapshot', nargs='?', help="snapshot file (default: newest)")
+    restore_parser = commands.add_parser('restore', help="restore a snapshot into the database")
+    restore_parser.add_argument('snapshot')
+    bench_parser = commands.add_parser('bench', help="measure throughput and writer stalls")
+    bench_parser.add_argument('--rows', type=int, default=50000, help="padding rows in the scratch copy")
+    bench_parser.add_argument('--no-wal', action='store_true', help="keep the rollback journal")
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.dir)
+    backup_options = {'pages': args.pages, 'sleep': args.sleep}
+
+    if args.command == 'snapshot':
+        snapshot, stats = store.create(args.db, compress=args.gzip, **backup_options)
+        if snapshot is None:
+            print("Database unchanged since the last snapshot, nothing stored")
+        else:
+            print(f"Stored {snapshot['file']} ({snapshot['stored_size']} bytes)")
+        _print_stats(stats)
+    elif args.command == 'list':
+        for snapshot in store.snapshots():
+            print(f"{snapshot['file']:<42} {snapshot['created']}  {snapshot['stored_size']:>10} bytes")
+    elif args.command == 'prune':
+        for name in store.prune(args.keep_last, args.keep_daily, args.keep_weekly):
+            print(f"Removed {name}")
+    elif args.command == 'verify':
+        snapshot = store.find(args.snapshot)
+        if snapshot is None:
+            print("Error: no such snapshot")
+            return 1
+        ok, message = store.verify(snapshot)
+        print(f"{snapshot['file']}: {message}")
+        return 0 if ok else 1
+    elif args.command == 'restore':
+        snapshot = store.find(args.snapshot)
+        if snapshot is None:
+            print("Error: no such snapshot")
+            return 1
+        # Keep the state being replaced so a restore can be undone
+        safety, _ = store.create(args.db, **backup_options)
+        if safety is not None:
+            print(f"Saved current database as {safety['file']}")
+        try:
+            stats = store.restore(snapshot, args.db, **backup_options)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return 1
+        print(f"Restored {snapshot['file']} into {args.db}")
+        if stats['change_seq'] is not None:
+            print(f"  change log advanced to {stats['change_seq']}; caches and change-feed clients resync")
+        _print_stats(stats)
+    elif args.command == 'bench':
+        stats = bench(args.rows, wal=not args.no_wal, **backup_options)
+        print(f"Backup of {stats['pages']} pages while writing:")
+        _print_stats(stats)
+        print(f"  throughput {stats['throughput_mb_s']:.1f} MB/s")
+        print(f"  writes before: {stats['writes_before']}, p50 {stats['write_p50_before'] * 1000:.2f} ms, "
+              f"max {stats['write_max_before'] * 1000:.2f} ms")
+        print(f"  writes during: {stats['writes_during']}, p50 {stats['write_p50_during'] * 1000:.2f} ms, "
+              f"max {stats['write_max_during'] * 1000:.2f} ms (largest stall)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
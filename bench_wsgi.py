@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Local throughput benchmark for the production server
+Starts gunicorn with gunicorn.conf.py for each worker count and drives it
+with concurrent HTTP clients
+
+    python bench_wsgi.py --workers 1 2 4 --clients 8 --duration 10
+"""
+
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+PATHS = ['/', '/about', '/projects', '/contact']
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def run_load(base_url, clients, duration):
+    """Hit PATHS round-robin from several threads; return (requests, errors, latencies)"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def client(offset):
+        i = offset
+        local = []
+        failed = 0
+        while time.time() < stop_at:
+            path = PATHS[i % len(PATHS)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(base_url + path, timeout=10) as response:
+                    response.read()
+                local.append(time.perf_counter() - start)
+            except OSError:
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies), errors[0], sorted(latencies)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench(workers, clients, duration, port):
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), BIND=f"127.0.0.1:{port}",
+               GUNICORN_PIDFILE=f"bench-{port}.pid")
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:application'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        if not wait_for_port('127.0.0.1', port):
+            raise RuntimeError("gunicorn did not start")
+        # Warm every worker before measuring
+        run_load(f"http://127.0.0.1:{port}", clients, 1)
+        count, errors, latencies = run_load(f"http://127.0.0.1:{port}", clients, duration)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+    return {
+        'workers': workers,
+        'rps': count / duration,
+        'errors': errors,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark gunicorn throughput per worker count")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--port', type=int, default=5099)
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for workers in args.workers:
+        result = bench(workers, args.clients, args.duration, args.port)
+        print(f"{result['workers']:>7} {result['rps']:>8.1f} {result['p50_ms']:>8.1f} "
+              f"{result['p99_ms']:>8.1f} {result['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
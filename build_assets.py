@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Front-end build step
+Writes per-page critical CSS to static/css/critical/ and, with --fonts,
+downloads the latin WOFF2 subsets of the site fonts into static/fonts/
+
+    python build_assets.py            # critical CSS only
+    python build_assets.py --fonts    # also self-host the Google Fonts
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import urllib.request
+
+from critical_css import extract_critical_css, file_sha256
+
+GOOGLE_FONTS_CSS = ("https://fonts.googleapis.com/css2?family=Libre+Baskerville:wght@400;700"
+                    "&family=Source+Sans+Pro:wght@300;400;600;700&display=swap")
+# Google serves WOFF2 only to browsers that announce support for it
+WOFF2_USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                    "(KHTML, like Gecko) Chrome/120.0 Safari/537.36")
+FONT_SUBSETS = ('latin',)
+
+
+def page_urls(app):
+    """(endpoint, url) for every GET route that takes no arguments"""
+    pages = []
+    for rule in app.url_map.iter_rules():
+        if 'GET' in rule.methods and not rule.arguments and rule.endpoint != 'static':
+            pages.append((rule.endpoint, rule.rule))
+    return sorted(pages)
+
+
+def build_critical_css(static_dir="static"):
+    """Render each page and write the CSS needed above its fold"""
+    from app import app
+
+    stylesheet = os.path.join(static_dir, 'css', 'style.css')
+    with open(stylesheet) as f:
+        css = f.read()
+
+    out_dir = os.path.join(static_dir, 'css', 'critical')
+    os.makedirs(out_dir, exist_ok=True)
+    client = app.test_client()
+    pages = {}
+    for endpoint, url in page_urls(app):
+        response = client.get(url)
+        if response.status_code != 200 or not response.mimetype == 'text/html':
+            continue
+        critical = extract_critical_css(css, response.get_data(as_text=True))
+        filename = f"{endpoint}.css"
+        with open(os.path.join(out_dir, filename), 'w') as f:
+            f.write(critical)
+        pages[endpoint] = filename
+        print(f"  {url:<14} {len(critical):>6} bytes critical CSS ({len(css)} full)")
+
+    manifest = {'style_sha256': file_sha256(stylesheet), 'pages': pages}
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return pages
+
+
+def _fetch(url, user_agent=WOFF2_USER_AGENT):
+    request = urllib.request.Request(url, headers={'User-Agent': user_agent})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.read()
+
+
+def build_fonts(static_dir="static"):
+    """Download the latin WOFF2 subsets and write static/fonts/fonts.json"""
+    css = _fetch(GOOGLE_FONTS_CSS).decode('utf-8')
+    out_dir = os.path.join(static_dir, 'fonts')
+    os.makedirs(out_dir, exist_ok=True)
+
+    fonts = []
+    for subset, body in re.findall(r'/\*\s*([\w-]+)\s*\*/\s*@font-face\s*\{([^}]*)\}', css):
+        if subset not in FONT_SUBSETS:
+            continue
+        family = re.search(r"font-family:\s*'([^']+)'", body).group(1)
+        style = re.search(r'font-style:\s*(\w+)', body).group(1)
+        weight = re.search(r'font-weight:\s*(\d+)', body).group(1)
+        url = re.search(r'src:\s*url\(([^)]+)\)', body).group(1)
+        unicode_range = re.search(r'unicode-range:\s*([^;]+);', body)
+
+        filename = f"{family.lower().replace(' ', '-')}-{weight}-{style}-{subset}.woff2"
+        with open(os.path.join(out_dir, filename), 'wb') as f:
+            f.write(_fetch(url))
+        fonts.append({
+            'family': family,
+            'style': style,
+            'weight': weight,
+            'file': filename,
+            'unicode_range': unicode_range.group(1).strip() if unicode_range else None,
+        })
+        print(f"  {filename}")
+
+    with open(os.path.join(out_dir, 'fonts.json'), 'w') as f:
+        json.dump(fonts, f, indent=2)
+    return fonts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build critical CSS and self-hosted fonts")
+    parser.add_argument('--fonts', action='store_true', help="download the site fonts (needs network)")
+    parser.add_argument('--static-dir', default='static')
+    args = parser.parse_args()
+
+    if args.fonts:
+        print("Downloading fonts...")
+        build_fonts(args.static_dir)
+    print("Extracting critical CSS...")
+    build_critical_css(args.static_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
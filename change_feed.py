@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Project change feed
+Long-poll support for /api/projects/changes and a compaction command for the
+project_changes log kept by the DAL
+
+    python change_feed.py compact                    # drop superseded changes
+    python change_feed.py compact --tombstones 30    # also forget deletes older than 30 days
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+# Longest a client may hold a request open waiting for changes; kept well under
+# gunicorn's 30 s worker timeout so a long-poll never gets its worker killed
+MAX_WAIT_SECONDS = 20
+# Writes made by other processes aren't announced, so waiters also re-check this often
+POLL_INTERVAL = 1.0
+
+
+class ChangeNotifier:
+    """Wakes long-poll requests when the DAL records a change"""
+
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._condition = threading.Condition()
+        self._dal = None
+
+    def _bind(self, dal):
+        """Follow the DAL in use so its writes wake waiters"""
+        with self._condition:
+            if dal is self._dal:
+                return
+            if self._dal is not None:
+                self._dal.remove_write_listener(self.on_write)
+            self._dal = dal
+            dal.add_write_listener(self.on_write)
+
+    def on_write(self, action, project_id):
+        """DAL write listener"""
+        with self._condition:
+            self._condition.notify_all()
+
+    def wait_for_changes(self, dal, since, timeout):
+        """Block until the log has changes after since or timeout expires
+
+        Returns the latest sequence number, which is still <= since on timeout.
+        """
+        self._bind(dal)
+        deadline = time.monotonic() + max(0, min(timeout, MAX_WAIT_SECONDS))
+        while True:
+            latest = dal.get_latest_change_seq()
+            remaining = deadline - time.monotonic()
+            if latest > since or remaining <= 0:
+                return latest
+            with self._condition:
+                self._condition.wait(min(remaining, self.poll_interval))
+
+
+def change_to_dict(change):
+    """JSON form of a DAL change row"""
+    seq, project_id, action, changed_date, project = change
+    item = {'seq': seq, 'project_id': project_id, 'action': action, 'changed_date': changed_date}
+    if project is not None:
+        item['project'] = {
+            'id': project[0],
+            'title': project[1],
+            'description': project[2],
+            'image_filename': project[3],
+            'created_date': project[4],
+            'updated_date': project[5],
+        }
+    else:
+        item['project'] = None
+    return item
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the project change log")
+    parser.add_argument('command', choices=['compact'])
+    parser.add_argument('--tombstones', type=float, default=None, metavar='DAYS',
+                        help="also drop delete entries older than DAYS")
+    args = parser.parse_args()
+
+    from DAL import dal
+
+    before = dal.get_latest_change_seq()
+    removed = dal.compact_changes(tombstone_max_age_days=args.tombstones)
+    print(f"Removed {removed} change entries (latest seq {before})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
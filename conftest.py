@@ -0,0 +1,19 @@
+"""
+Shared test setup
+Keeps files the app opens at import time out of the working tree; the test
+databases themselves come from testdb.py
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+
+_scratch = tempfile.mkdtemp(prefix='portfolio-tests-')
+atexit.register(shutil.rmtree, _scratch, ignore_errors=True)
+
+# Importing the app opens (and migrates) its database, so point it at a scratch
+# file instead of the committed projects.db
+os.environ.setdefault('DATABASE_PATH', os.path.join(_scratch, 'projects.db'))
+# Keep the app's contact duplicate filter out of the working tree
+os.environ.setdefault('CONTACT_DEDUP_PATH', os.path.join(_scratch, 'contact_dedup.bloom'))
@@ -0,0 +1,235 @@
+"""
+Critical CSS and self-hosted fonts
+Extracts the rules a page needs for its first paint from style.css and loads
+the build output (see build_assets.py) for inlining into BASE_TEMPLATE
+"""
+
+import hashlib
+import json
+import os
+import re
+from html.parser import HTMLParser
+
+# Pseudo-classes that only apply after user interaction, not on first paint
+_STATE_PSEUDO_RE = re.compile(r':(hover|focus|focus-within|focus-visible|active|visited)\b')
+_PSEUDO_RE = re.compile(r'::?[\w-]+(\([^)]*\))?')
+_ATTRIBUTE_RE = re.compile(r'\[[^\]]*\]')
+_COMPOUND_RE = re.compile(r'([#.]?)([\w-]+|\*)')
+
+
+class Rule:
+    """A style rule, or an at-rule such as @media holding nested rules"""
+
+    def __init__(self, prelude, body=None, children=None):
+        self.prelude = prelude
+        self.body = body
+        self.children = children
+
+    def to_css(self):
+        if self.children is not None:
+            inner = ''.join(child.to_css() for child in self.children)
+            return f"{self.prelude}{{{inner}}}" if inner else ''
+        return f"{self.prelude}{{{self.body}}}"
+
+
+def _minify(text):
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def parse_css(css):
+    """Parse a stylesheet into a list of Rule objects"""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    rules, _ = _parse_block(css, 0)
+    return rules
+
+
+def _parse_block(css, pos):
+    rules = []
+    while pos < len(css):
+        close = css.find('}', pos)
+        open_ = css.find('{', pos)
+        if open_ == -1 or (close != -1 and close < open_):
+            return rules, (close + 1 if close != -1 else len(css))
+        prelude = _minify(css[pos:open_])
+        if prelude.startswith('@media') or prelude.startswith('@supports'):
+            children, pos = _parse_block(css, open_ + 1)
+            rules.append(Rule(prelude, children=children))
+            continue
+        end = css.find('}', open_)
+        if end == -1:
+            end = len(css)
+        rules.append(Rule(prelude, body=_minify(css[open_ + 1:end])))
+        pos = end + 1
+    return rules, pos
+
+
+class _FoldCollector(HTMLParser):
+    """Collects tags, classes and ids above the fold
+
+    The fold is approximated as the header plus the first section of <main>.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.tags = {'html', 'body'}
+        self.classes = set()
+        self.ids = set()
+        self.in_main = False
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == 'main':
+            self.in_main = True
+        self.tags.add(tag)
+        for name, value in attrs:
+            if name == 'class' and value:
+                self.classes.update(value.split())
+            elif name == 'id' and value:
+                self.ids.add(value)
+
+    def handle_endtag(self, tag):
+        if self.in_main and tag == 'section':
+            self.done = True
+
+
+def _selector_matches(selector, tags, classes, ids):
+    if _STATE_PSEUDO_RE.search(selector):
+        return False
+    selector = _ATTRIBUTE_RE.sub('', _PSEUDO_RE.sub('', selector))
+    for compound in re.split(r'\s*[>+~]\s*|\s+', selector.strip()):
+        if not compound:
+            continue
+        for prefix, name in _COMPOUND_RE.findall(compound):
+            if prefix == '.' and name not in classes:
+                return False
+            if prefix == '#' and name not in ids:
+                return False
+            if not prefix and name != '*' and name not in tags:
+                return False
+    return True
+
+
+def _filter(rules, tags, classes, ids):
+    kept = []
+    for rule in rules:
+        if rule.children is not None:
+            if 'print' in rule.prelude:
+                continue
+            children = _filter(rule.children, tags, classes, ids)
+            if children:
+                kept.append(Rule(rule.prelude, children=children))
+        elif rule.prelude.startswith('@'):
+            continue
+        else:
+            selectors = [s for s in rule.prelude.split(',')
+                         if _selector_matches(s, tags, classes, ids)]
+            if selectors:
+                kept.append(Rule(','.join(s.strip() for s in selectors), body=rule.body))
+    return kept
+
+
+def extract_critical_css(css, html):
+    """Return the minified subset of css needed to paint the top of html"""
+    collector = _FoldCollector()
+    collector.feed(html)
+    rules = _filter(parse_css(css), collector.tags, collector.classes, collector.ids)
+    return ''.join(rule.to_css() for rule in rules)
+
+
+def file_sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class FrontendAssets:
+    """Build output for BASE_TEMPLATE: per-page critical CSS and self-hosted fonts
+
+    Critical CSS is ignored once style.css no longer matches the hash it was
+    built from, so a stale build never hides new styles.
+    """
+
+    def __init__(self, static_dir="static"):
+        self.static_dir = static_dir
+        self._critical = None
+        self._fonts = None
+
+    @property
+    def stylesheet_path(self):
+        return os.path.join(self.static_dir, 'css', 'style.css')
+
+    @property
+    def critical_manifest_path(self):
+        return os.path.join(self.static_dir, 'css', 'critical', 'manifest.json')
+
+    @property
+    def fonts_manifest_path(self):
+        return os.path.join(self.static_dir, 'fonts', 'fonts.json')
+
+    def _load_critical(self):
+        try:
+            with open(self.critical_manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('style_sha256') != file_sha256(self.stylesheet_path):
+                return {}
+            critical = {}
+            directory = os.path.dirname(self.critical_manifest_path)
+            for endpoint, filename in manifest.get('pages', {}).items():
+                with open(os.path.join(directory, filename)) as f:
+                    critical[endpoint] = f.read()
+            return critical
+        except (OSError, ValueError):
+            return {}
+
+    def critical_css(self, endpoint):
+        """Inline CSS for an endpoint, or None to fall back to the full stylesheet"""
+        if self._critical is None:
+            self._critical = self._load_critical()
+        return self._critical.get(endpoint)
+
+    @property
+    def fonts(self):
+        """Self-hosted font files as dicts (family, weight, style, file, unicode_range)"""
+        if self._fonts is None:
+            try:
+                with open(self.fonts_manifest_path) as f:
+                    self._fonts = json.load(f)
+            except (OSError, ValueError):
+                self._fonts = []
+        return self._fonts
+
+    def font_face_css(self):
+        """@font-face rules for the self-hosted fonts, with font-display: swap"""
+        rules = []
+        for font in self.fonts:
+            rules.append(
+                "@font-face{"
+                f"font-family:'{font['family']}';font-style:{font['style']};"
+                f"font-weight:{font['weight']};font-display:swap;"
+                f"src:url(/static/fonts/{font['file']}) format('woff2');"
+                + (f"unicode-range:{font['unicode_range']};" if font.get('unicode_range') else '')
+                + "}"
+            )
+        return ''.join(rules)
+
+    def preload_links(self):
+        """(href, as, type) for the assets every page needs first"""
+        links = [('/static/css/style.css', 'style', None)]
+        links += [(f"/static/fonts/{font['file']}", 'font', 'font/woff2') for font in self.fonts]
+        return links
+
+    def link_header(self):
+        """Value for a Link header announcing the preloads (relayed as 103 Early Hints)"""
+        parts = []
+        for href, kind, mimetype in self.preload_links():
+            part = f"<{href}>; rel=preload; as={kind}"
+            if kind == 'font':
+                part += f"; type=\"{mimetype}\"; crossorigin"
+            parts.append(part)
+        return ', '.join(parts)
+
+    def reload(self):
+        """Forget loaded build output so it is read again on next use"""
+        self._critical = None
+        self._fonts = None
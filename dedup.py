@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Duplicate suppression
+A time-windowed Bloom filter over contact-form fingerprints, kept in a
+memory-mapped file so every worker on the host sees the same filter. A check
+hashes the submission once and tests k bits per slice: no database access, and
+the same cost however many submissions the window holds.
+
+The window is split into slices, each with its own bit array; the slice that
+falls out of the window is cleared and reused, so a fingerprint is remembered
+for at least window seconds and at most one slice longer.
+
+    python dedup.py                      # sizing for the configured filter
+    python dedup.py --path contact_dedup.bloom   # ... and how full it is
+"""
+
+import argparse
+import hashlib
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import unicodedata
+
+try:
+    import fcntl
+except ImportError:  # Windows: threads are still serialized, processes aren't
+    fcntl = None
+
+MAGIC = b'PFBLOOM1'
+# magic, bits per slice, hash count, slice count, slice seconds
+HEADER = struct.Struct('<8sQQQd')
+EPOCH = struct.Struct('<q')
+
+
+def fingerprint(email, message):
+    """sha256 of the normalized email and message
+
+    Case, Unicode form, punctuation and whitespace are ignored, as is a
+    +suffix on the email's local part, so trivial variations still match.
+    """
+    local, _, domain = (email or '').strip().lower().partition('@')
+    email = f"{local.split('+')[0]}@{domain}"
+    text = unicodedata.normalize('NFKC', message or '').casefold()
+    text = ' '.join(re.sub(r'[\W_]+', ' ', text).split())
+    return hashlib.sha256(f"{email}\n{text}".encode('utf-8')).digest()
+
+
+def bloom_size(capacity, fp_rate):
+    """(bits, hashes) for capacity items at false-positive rate fp_rate"""
+    bits = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+    bits = max(64, (bits + 63) // 64 * 64)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+class DuplicateFilter:
+    """Windowed Bloom filter shared through a memory-mapped file
+
+    Each slice is sized for the full capacity at fp_rate / (slices + 1), so
+    checking every live slice stays within fp_rate even if a whole window's
+    submissions arrive in one slice.
+    """
+
+    def __init__(self, path, window=86400, capacity=10000, fp_rate=0.001, slices=4):
+        self.path = path
+        self.window = window
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.slices = slices
+        self.slice_seconds = window / slices
+        # One slot more than the window needs, for the slice being filled
+        self.slots = slices + 1
+        self.bits, self.hashes = bloom_size(capacity, fp_rate / self.slots)
+        self.slot_bytes = EPOCH.size + self.bits // 8
+        self.size = HEADER.size + self.slots * self.slot_bytes
+        # Checks and duplicates seen by this process
+        self.checks = 0
+        self.duplicates = 0
+        self._file = None
+        self._map = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def header(self):
+        """The file header this configuration writes"""
+        return HEADER.pack(MAGIC, self.bits, self.hashes, self.slots, self.slice_seconds)
+
+    def _open(self):
+        """Map the file, (re)initializing it if it was made for another configuration
+
+        Reopened after a fork, since a flock is only exclusive between
+        separately opened files.
+        """
+        if self._pid == os.getpid():
+            return
+        self.close()
+        self._file = open(self.path, 'a+b')
+        self._pid = os.getpid()
+        with self._exclusive():
+            header = self.header()
+            self._file.seek(0)
+            if self._file.read(HEADER.size) != header or os.fstat(self._file.fileno()).st_size != self.size:
+                self._file.truncate(0)
+                self._file.write(header + bytes(self.size - HEADER.size))
+                self._file.flush()
+            self._map = mmap.mmap(self._file.fileno(), self.size)
+
+    def _exclusive(self):
+        return _FileLock(self._file)
+
+    def _positions(self, digest):
+        # Double hashing: k positions from two 64-bit halves of the digest
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:16], 'little') | 1
+        return [(first + i * step) % self.bits for i in range(self.hashes)]
+
+    def _slot_offset(self, slot):
+        return HEADER.size + slot * self.slot_bytes
+
+    def _live_slots(self, current):
+        """Offsets of the slots holding slices still inside the window"""
+        offsets = []
+        for slot in range(self.slots):
+            offset = self._slot_offset(slot)
+            epoch, = EPOCH.unpack_from(self._map, offset)
+            if current - self.slots < epoch <= current:
+                offsets.append(offset + EPOCH.size)
+        return offsets
+
+    def seen(self, digest, now=None):
+        """Record digest; True if it was already recorded within the window"""
+        current = int((now if now is not None else time.time()) // self.slice_seconds)
+        positions = self._positions(digest)
+        with self._lock:
+            self._open()
+            with self._exclusive():
+                offset = self._slot_offset(current % self.slots)
+                if EPOCH.unpack_from(self._map, offset)[0] != current:
+                    # The slice that used this slot has left the window
+                    self._map[offset:offset + self.slot_bytes] = EPOCH.pack(current) + bytes(self.bits // 8)
+                duplicate = any(
+                    all(self._map[bits + (position >> 3)] & (1 << (position & 7)) for position in positions)
+                    for bits in self._live_slots(current))
+                bits = offset + EPOCH.size
+                for position in positions:
+                    self._map[bits + (position >> 3)] |= 1 << (position & 7)
+            self.checks += 1
+            if duplicate:
+                self.duplicates += 1
+        return duplicate
+
+    def info(self, now=None):
+        """Sizing, fill and estimated false-positive rate of the filter"""
+        current = int((now if now is not None else time.time()) // self.slice_seconds)
+        with self._lock:
+            self._open()
+            fills = []
+            for bits in self._live_slots(current):
+                # bin().count rather than int.bit_count, which needs Python 3.10
+                ones = bin(int.from_bytes(self._map[bits:bits + self.bits // 8], 'little')).count('1')
+                fills.append(ones / self.bits)
+        miss = 1.0
+        for fill in fills:
+            miss *= 1 - fill ** self.hashes
+        return {
+            'window_seconds': self.window,
+            'capacity': self.capacity,
+            'target_fp_rate': self.fp_rate,
+            'estimated_fp_rate': 1 - miss,
+            'slices': self.slices,
+            'bits_per_slice': self.bits,
+            'hashes': self.hashes,
+            'bytes': self.size,
+            'fill': [round(fill, 4) for fill in fills],
+            'checks': self.checks,
+            'duplicates': self.duplicates,
+        }
+
+    def clear(self):
+        """Forget every fingerprint"""
+        with self._lock:
+            self._open()
+            with self._exclusive():
+                self._map[HEADER.size:] = bytes(self.size - HEADER.size)
+            self.checks = 0
+            self.duplicates = 0
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._pid = None
+
+
+class _FileLock:
+    def __init__(self, file):
+        self.file = file
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Size and inspect the contact duplicate filter")
+    parser.add_argument('--path', help="filter file to inspect")
+    parser.add_argument('--window', type=float, default=float(os.environ.get('CONTACT_DEDUP_WINDOW', 86400)))
+    parser.add_argument('--capacity', type=int, default=int(os.environ.get('CONTACT_DEDUP_CAPACITY', 10000)))
+    parser.add_argument('--fp-rate', type=float, default=float(os.environ.get('CONTACT_DEDUP_FP_RATE', 0.001)))
+    args = parser.parse_args()
+
+    duplicate_filter = DuplicateFilter(args.path, args.window, args.capacity, args.fp_rate)
+    if args.path:
+        try:
+            with open(args.path, 'rb') as f:
+                header = f.read(HEADER.size)
+        except OSError as e:
+            parser.error(f"can't read {args.path}: {e}")
+        if header != duplicate_filter.header():
+            # Opening it would reset it for this configuration
+            parser.error(f"{args.path} was built with a different window, capacity or rate")
+        info = duplicate_filter.info()
+        duplicate_filter.close()
+    else:
+        info = {'window_seconds': args.window, 'capacity': args.capacity, 'target_fp_rate': args.fp_rate,
+                'slices': duplicate_filter.slices, 'bits_per_slice': duplicate_filter.bits,
+                'hashes': duplicate_filter.hashes, 'bytes': duplicate_filter.size}
+    for name, value in info.items():
+        print(f"{name:<18} {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Project export
+Streams every project as CSV or JSON Lines, optionally gzipped on the fly.
+Rows are read in keyset-paginated chunks and encoded a chunk at a time, so
+memory stays flat whatever the row count.
+
+    python export.py > projects.csv
+    python export.py --format jsonl --gzip -o projects.jsonl.gz
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import zlib
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+FIELDS = ('id', 'title', 'description', 'image_filename', 'created_date', 'updated_date')
+DEFAULT_CHUNK_SIZE = 500
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def encode_rows(rows, fmt='csv', chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the rows as bytes in fmt ('csv' with a header row, or 'jsonl'), one piece per chunk"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt!r}")
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(FIELDS)
+        for chunk in _chunks(rows, chunk_size):
+            writer.writerows(chunk)
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')
+    else:
+        for chunk in _chunks(rows, chunk_size):
+            lines = [json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) for row in chunk]
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def gzip_stream(pieces, level=6):
+    """Gzip a stream of bytes pieces as it goes"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for piece in pieces:
+        compressed = compressor.compress(piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_projects(dal, fmt='csv', compress=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Generator of the export's bytes for every project in dal"""
+    pieces = encode_rows(dal.iter_projects(chunk_size), fmt, chunk_size)
+    return gzip_stream(pieces) if compress else pieces
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export projects as CSV or JSON Lines")
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--gzip', action='store_true', help="gzip the output")
+    parser.add_argument('-o', '--output', help="file to write (default: stdout)")
+    parser.add_argument('--db', default='projects.db')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    from DAL import DatabaseAccessLayer
+    dal = DatabaseAccessLayer(args.db)
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for piece in export_projects(dal, args.format, args.gzip, args.chunk_size):
+            out.write(piece)
+    finally:
+        if args.output:
+            out.close()
+        else:
+            out.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
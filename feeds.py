@@ -0,0 +1,145 @@
+"""
+Sitemap and Atom feed
+Builds /sitemap.xml and /projects.atom from per-project fragments. Only the
+projects in the change log since the last build are re-rendered, and finished
+documents are kept (plain and gzipped) until the change sequence moves on.
+"""
+
+import gzip
+import threading
+from collections import OrderedDict, namedtuple
+from xml.sax.saxutils import escape, quoteattr
+
+SITEMAP = 'sitemap'
+ATOM = 'atom'
+# Pages listed in the sitemap ahead of the projects
+STATIC_PATHS = ('/', '/about', '/resume', '/projects', '/contact')
+# Newest projects included in the Atom feed
+ATOM_ENTRIES = 50
+# Past this many changes a full re-read is cheaper than applying them one by one
+MAX_INCREMENTAL_CHANGES = 500
+# Stands in for the site's absolute URL root inside cached fragments
+_BASE = '\x00base\x00'
+
+# body and gzipped are bytes; version is the change sequence the document reflects
+FeedDocument = namedtuple('FeedDocument', ['body', 'gzipped', 'version', 'last_modified'])
+
+
+def w3c_datetime(timestamp):
+    """SQLite CURRENT_TIMESTAMP text (UTC) as an RFC 3339 timestamp"""
+    return timestamp.replace(' ', 'T') + 'Z' if timestamp else None
+
+
+def _sitemap_fragment(project):
+    project_id, _, _, _, _, updated_date = project
+    return (f"<url><loc>{_BASE}projects/{project_id}</loc>"
+            f"<lastmod>{w3c_datetime(updated_date)}</lastmod></url>")
+
+
+def _atom_fragment(project):
+    project_id, title, description, _, created_date, updated_date = project
+    link = f"{_BASE}projects/{project_id}"
+    return (f"<entry><id>{link}</id><title>{escape(title)}</title>"
+            f"<link href={quoteattr(link)}/>"
+            f"<published>{w3c_datetime(created_date)}</published>"
+            f"<updated>{w3c_datetime(updated_date)}</updated>"
+            f"<summary>{escape(description)}</summary></entry>")
+
+
+class FeedCache:
+    """Project fragments and finished feed documents for one database
+
+    Versions come from the DAL change log, so writes made by other worker
+    processes are picked up too.
+    """
+
+    def __init__(self, static_paths=STATIC_PATHS, title="Projects", max_documents=8):
+        self.static_paths = tuple(static_paths)
+        self.title = title
+        self.max_documents = max_documents
+        # project id -> (project row, sitemap fragment, atom fragment)
+        self._projects = {}
+        self._version = None
+        self._dal = None
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+        self.rendered = 0
+
+    def _sync(self, dal):
+        """Bring the fragments up to date with the change log"""
+        latest = dal.get_latest_change_seq()
+        if dal is self._dal and latest == self._version:
+            return
+        if dal is self._dal and self._version is not None:
+            changes, compacted_through = dal.get_changes(self._version, limit=MAX_INCREMENTAL_CHANGES + 1)
+            if self._version >= compacted_through and len(changes) <= MAX_INCREMENTAL_CHANGES:
+                for _, project_id, _, _, project in changes:
+                    if project is None:
+                        self._projects.pop(project_id, None)
+                    else:
+                        self._store(project)
+                self._version = changes[-1][0] if changes else latest
+                self._documents.clear()
+                return
+
+        # First build, another database or too far behind: start over
+        self._dal = dal
+        self._projects = {}
+        for project in dal.get_all_projects():
+            self._store(project)
+        self._version = latest
+        self._documents.clear()
+
+    def _store(self, project):
+        current = self._projects.get(project[0])
+        if current is not None and current[0] == project:
+            return
+        self._projects[project[0]] = (project, _sitemap_fragment(project), _atom_fragment(project))
+        self.rendered += 1
+
+    def _newest_first(self):
+        return sorted(self._projects.values(), key=lambda item: (item[0][4], item[0][0]), reverse=True)
+
+    def _build(self, kind, base_url):
+        items = self._newest_first()
+        last_modified = max((item[0][5] for item in items), default=None)
+        if kind == SITEMAP:
+            parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+                     '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">']
+            parts += [f"<url><loc>{_BASE}{path.lstrip('/')}</loc></url>" for path in self.static_paths]
+            parts += [item[1] for item in items]
+            parts.append('</urlset>\n')
+        else:
+            updated = w3c_datetime(last_modified) or '1970-01-01T00:00:00Z'
+            parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+                     '<feed xmlns="http://www.w3.org/2005/Atom">'
+                     f"<id>{_BASE}projects.atom</id><title>{escape(self.title)}</title>"
+                     f"<updated>{updated}</updated>"
+                     f"<link rel=\"self\" href=\"{_BASE}projects.atom\"/>"
+                     f"<link href=\"{_BASE}projects\"/>"]
+            parts += [item[2] for item in items[:ATOM_ENTRIES]]
+            parts.append('</feed>\n')
+        body = ''.join(parts).replace(_BASE, escape(base_url)).encode('utf-8')
+        return FeedDocument(body, gzip.compress(body, compresslevel=6, mtime=0), self._version, last_modified)
+
+    def get(self, dal, kind, base_url):
+        """The current FeedDocument of kind (SITEMAP or ATOM) for URLs under base_url"""
+        with self._lock:
+            self._sync(dal)
+            key = (kind, base_url)
+            document = self._documents.get(key)
+            if document is None:
+                document = self._build(kind, base_url)
+                self._documents[key] = document
+                while len(self._documents) > self.max_documents:
+                    self._documents.popitem(last=False)
+            else:
+                self._documents.move_to_end(key)
+            return document
+
+    def clear(self):
+        with self._lock:
+            self._projects = {}
+            self._version = None
+            self._dal = None
+            self._documents.clear()
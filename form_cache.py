@@ -0,0 +1,45 @@
+"""
+Form markup cache
+Builds the static markup of a form page once and splices in per-request state
+"""
+
+import threading
+
+# Stands in for the hidden tag markup while the static page is being built
+CSRF_PLACEHOLDER = "\x00csrf-token\x00"
+
+
+class FormMarkupCache:
+    """Cache of rendered form pages, one entry per form name"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def render(self, name, form, builder, key=()):
+        """Render a form page, reusing the static markup of pristine forms
+
+        builder(form, hidden_tag) returns the page markup. Submitted forms carry
+        user values and errors, so they are always rendered in full.
+        """
+        if form.is_submitted():
+            return builder(form, form.hidden_tag())
+
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == key:
+            markup = entry[1]
+        else:
+            # A new key (e.g. changed select choices) replaces the old markup
+            markup = builder(form, CSRF_PLACEHOLDER)
+            with self._lock:
+                self._entries[name] = (key, markup)
+
+        return markup.replace(CSRF_PLACEHOLDER, str(form.hidden_tag()), 1)
+
+    def clear(self):
+        """Drop all cached markup"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,66 @@
+"""
+Gunicorn configuration for production
+Start, reload and stop the server with serve.py
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Threaded workers, so a long-poll on /api/projects/changes holds one thread
+# rather than the whole worker, and the worker keeps heartbeating while it waits
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+pidfile = os.environ.get('GUNICORN_PIDFILE', 'gunicorn.pid')
+
+# Rate-limit buckets shared by every worker, instead of one budget per worker
+os.environ.setdefault('RATELIMIT_STORAGE', 'ratelimit.db')
+
+# Import the app once in the master so workers share its memory copy-on-write
+preload_app = True
+
+# Recycle workers after a number of requests (jittered so they don't all restart
+# together) or when their resident memory grows past MAX_WORKER_MEMORY_MB
+max_requests = int(os.environ.get('MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER', '200'))
+max_worker_memory_mb = int(os.environ.get('MAX_WORKER_MEMORY_MB', '256'))
+memory_check_interval = 50
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB"""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def post_fork(server, worker):
+    """Start each worker without any state inherited from the master, then warm it
+    up; the worker only accepts connections once this returns"""
+    from app import reset_process_state, start_maintenance, warm_up_process
+    reset_process_state()
+    warm_up_process()
+    start_maintenance()
+    worker.requests_since_memory_check = 0
+
+
+def post_request(worker, req, environ, resp):
+    """Ask the worker to exit gracefully once it uses too much memory"""
+    worker.requests_since_memory_check += 1
+    if worker.requests_since_memory_check < memory_check_interval:
+        return
+    worker.requests_since_memory_check = 0
+
+    rss = current_rss_mb()
+    if rss > max_worker_memory_mb:
+        worker.log.info("Recycling worker %s: %.0f MB resident", worker.pid, rss)
+        worker.alive = False
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Image metadata
+Intrinsic dimensions (read from the file header, no dependencies) and a tiny
+blurred preview (with Pillow, if installed) for every image asset, stored once
+per content hash so cards can reserve their space and show a placeholder
+
+    python image_meta.py           # measure every image asset that isn't yet
+"""
+
+import base64
+import io
+import logging
+import os
+import queue
+import struct
+import sys
+import threading
+
+try:
+    from PIL import Image, ImageFilter, ImageOps
+except ImportError:  # optional dependency, only needed for placeholders
+    Image = None
+
+logger = logging.getLogger('portfolio.images')
+
+# Longest side of the preview, in pixels; browsers scale it up smoothly
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 50
+
+
+def static_path_for(filename, static_dir="static"):
+    """File path of an image filename as stored in projects/assets"""
+    if filename.startswith('assets/'):
+        return os.path.join(static_dir, filename)
+    return os.path.join(static_dir, 'images', filename)
+
+
+def _jpeg_dimensions(f):
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code == 0xFF:
+            f.seek(-1, os.SEEK_CUR)
+            continue
+        if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+            continue
+        length = struct.unpack('>H', f.read(2))[0]
+        if length < 2:
+            return None
+        # Start-of-frame markers carry the size (but not DHT, JPG and DAC)
+        if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>xHH', f.read(5))
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _webp_dimensions(header):
+    chunk = header[12:16]
+    if chunk == b'VP8 ' and len(header) >= 30:
+        width, height = struct.unpack('<HH', header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and len(header) >= 25:
+        bits = int.from_bytes(header[21:25], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X' and len(header) >= 30:
+        return int.from_bytes(header[24:27], 'little') + 1, int.from_bytes(header[27:30], 'little') + 1
+    return None
+
+
+def read_dimensions(path):
+    """(width, height) of a JPEG, PNG, GIF or WebP file from its header, or None"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(32)
+            if header.startswith(b'\x89PNG\r\n\x1a\n') and header[12:16] == b'IHDR':
+                return struct.unpack('>II', header[16:24])
+            if header[:6] in (b'GIF87a', b'GIF89a'):
+                return struct.unpack('<HH', header[6:10])
+            if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+                return _webp_dimensions(header)
+            if header.startswith(b'\xff\xd8'):
+                return _jpeg_dimensions(f)
+    except (OSError, struct.error):
+        pass
+    return None
+
+
+def make_placeholder(path):
+    """A blurred, PLACEHOLDER_SIZE-pixel JPEG of the image as a data URI (needs Pillow)
+
+    None if Pillow can't decode the file, so a truncated, malformed or
+    oversized upload still gets its dimensions stored.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as image:
+            # Lets the JPEG decoder skip most of the work at this size
+            image.draft('RGB', (PLACEHOLDER_SIZE * 4, PLACEHOLDER_SIZE * 4))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+            image = image.filter(ImageFilter.GaussianBlur(0.6))
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=PLACEHOLDER_QUALITY, optimize=True)
+    except (OSError, SyntaxError, ValueError, EOFError, struct.error, Image.DecompressionBombError) as error:
+        logger.warning("No placeholder for %s: %s", path, error)
+        return None
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def compute_metadata(path):
+    """(width, height, placeholder) for an image file; width/height None if unknown"""
+    dimensions = read_dimensions(path)
+    width, height = dimensions if dimensions else (None, None)
+    return width, height, make_placeholder(path)
+
+
+def img_attributes(metadata, eager=False):
+    """Extra <img> attributes: intrinsic size, loading hints and the inline placeholder
+
+    metadata is (width, height, placeholder) or None. Images above the fold
+    are eager; the rest load lazily.
+    """
+    attributes = ['loading="eager" fetchpriority="high"' if eager else 'loading="lazy"', 'decoding="async"']
+    if metadata:
+        width, height, placeholder = metadata
+        if width and height:
+            attributes.append(f'width="{width}" height="{height}"')
+        if placeholder:
+            attributes.append(f'style="background:url({placeholder}) center/cover no-repeat"')
+    return ' '.join(attributes)
+
+
+class ImageMetadataWorker:
+    """Background thread that measures images queued by hash, once each"""
+
+    def __init__(self, static_dir="static", on_update=None):
+        self.static_dir = static_dir
+        self.on_update = on_update
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def request(self, dal, images):
+        """Queue (sha256, filename) pairs of images without metadata"""
+        with self._lock:
+            for sha256, filename in images:
+                if sha256 not in self._pending:
+                    self._pending.add(sha256)
+                    self._queue.put((dal, sha256, filename))
+            if self._pending and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name='image-metadata', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                dal, sha256, filename = self._queue.get(timeout=5)
+            except queue.Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._thread = None
+                        return
+                continue
+            try:
+                self.measure(dal, sha256, filename)
+                if self.on_update is not None:
+                    self.on_update()
+            except Exception:
+                logger.exception("Measuring %s failed", filename)
+            finally:
+                with self._lock:
+                    self._pending.discard(sha256)
+                self._queue.task_done()
+
+    def measure(self, dal, sha256, filename):
+        """Compute and store the metadata of one image"""
+        width, height, placeholder = compute_metadata(static_path_for(filename, self.static_dir))
+        dal.save_image_metadata(sha256, width, height, placeholder)
+
+    def run_pending(self, dal):
+        """Measure every image asset without metadata in this thread; returns how many"""
+        missing = dal.get_images_missing_metadata()
+        for sha256, filename in missing:
+            self.measure(dal, sha256, filename)
+        return len(missing)
+
+    def wait(self):
+        """Block until the queue is drained"""
+        self._queue.join()
+
+    def reset(self):
+        """Forget queued work, e.g. in a forked worker where the thread is gone"""
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+
+def main():
+    from DAL import dal
+
+    dal.get_image_assets()
+    count = ImageMetadataWorker().run_pending(dal)
+    print(f"Measured {count} images" + ("" if Image else " (install Pillow for placeholders)"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -19,6 +19,10 @@ def init_sample_data():
     available_images = dal.get_available_images()
     print(f"Available images: {available_images}")
     
+    # Register them in the asset catalog used by the project form
+    registered = dal.import_image_directory()
+    print(f"Registered {registered} images as assets")
+    
     # Sample projects data
     sample_projects = [
         {
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Database maintenance
+SQLite housekeeping for projects.db, run in an off-peak window either by a
+background thread in the app (one worker at a time, chosen by a lease in the
+database) or from the command line:
+
+- checkpoint: copy the WAL back into the database and truncate it
+- analyze: refresh planner statistics (bounded ANALYZE, then PRAGMA optimize)
+- vacuum: give freed pages back to the filesystem with incremental_vacuum
+
+Every job stops once it has run for its time budget, and each run is recorded
+in maintenance_runs with its duration and the bytes it reclaimed.
+
+    python maintenance.py run [JOB ...] [--force] [--full-vacuum]
+    python maintenance.py history
+"""
+
+import argparse
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger('portfolio.maintenance')
+
+LEASE_NAME = 'maintenance'
+# How often each job is due and how long it may block the database, in seconds
+DEFAULT_SCHEDULE = {
+    'checkpoint': {'interval': 3600, 'budget': 1.0},
+    'analyze': {'interval': 86400, 'budget': 5.0},
+    'vacuum': {'interval': 86400, 'budget': 5.0},
+}
+# Pages freed per incremental_vacuum step; the budget is checked between steps
+VACUUM_STEP_PAGES = 256
+# Rows ANALYZE samples per index, which keeps it fast on big tables
+ANALYSIS_LIMIT = 1000
+
+
+class JobTimeout(Exception):
+    """A job used up its time budget"""
+
+
+def parse_window(window):
+    """'HH:MM-HH:MM' as (start, end) minutes after midnight; None means any time"""
+    if not window:
+        return None
+    start, end = window.split('-')
+    to_minutes = lambda text: int(text.split(':')[0]) * 60 + int(text.split(':')[1])
+    return to_minutes(start), to_minutes(end)
+
+
+def in_window(window, now=None):
+    """True if now (local time) falls in window, which may wrap past midnight"""
+    bounds = parse_window(window)
+    if bounds is None:
+        return True
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    start, end = bounds
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _pragma(conn, name):
+    return conn.execute(f'PRAGMA {name}').fetchone()[0]
+
+
+class Maintenance:
+    """Runs due housekeeping jobs against a DAL's database"""
+
+    def __init__(self, window=None, schedule=None, lease_ttl=600, tick=60, allow_full_vacuum=False):
+        self.window = window
+        self.schedule = schedule or DEFAULT_SCHEDULE
+        self.lease_ttl = lease_ttl
+        self.tick = tick
+        self.allow_full_vacuum = allow_full_vacuum
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self._thread = None
+        self._stop = threading.Event()
+
+    # Jobs return (bytes reclaimed, detail) and raise JobTimeout past the deadline
+
+    def _checkpoint(self, conn, dal, deadline):
+        wal_path = None if dal._uri else dal.db_name + '-wal'
+        before = _file_size(wal_path) if wal_path else 0
+        busy, log_pages, checkpointed = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        if log_pages < 0:
+            return 0, "not in WAL mode"
+        if busy:
+            # Readers kept it from finishing; copy what it could without waiting
+            busy, log_pages, checkpointed = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+        after = _file_size(wal_path) if wal_path else 0
+        return before - after, f"{checkpointed}/{log_pages} WAL pages" + (" (readers active)" if busy else "")
+
+    def _analyze(self, conn, dal, deadline):
+        conn.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+        conn.execute('ANALYZE')
+        conn.execute('PRAGMA optimize')
+        return 0, None
+
+    def _vacuum(self, conn, dal, deadline):
+        page_size = _pragma(conn, 'page_size')
+        pages_before = _pragma(conn, 'page_count')
+        free = _pragma(conn, 'freelist_count')
+        if not free:
+            return 0, "no free pages"
+        if _pragma(conn, 'auto_vacuum') != 2:
+            if not self.allow_full_vacuum:
+                return 0, f"{free} free pages; auto_vacuum is off, run with --full-vacuum once"
+            # Rewrites the whole file, so it only runs when asked for
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+        else:
+            while _pragma(conn, 'freelist_count'):
+                if time.monotonic() > deadline:
+                    raise JobTimeout()
+                conn.execute(f'PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})').fetchall()
+        return (pages_before - _pragma(conn, 'page_count')) * page_size, f"{free} free pages"
+
+    def run_job(self, dal, job):
+        """Run one job within its budget and record it; returns (status, bytes reclaimed, detail)"""
+        budget = self.schedule[job]['budget']
+        started = time.time()
+        start = time.monotonic()
+        deadline = start + budget
+        status, reclaimed, detail = 'ok', 0, None
+        conn = dal.get_connection()
+        conn.isolation_level = None
+        # Waiting for locks and long statements both count against the budget
+        conn.execute(f'PRAGMA busy_timeout = {int(budget * 1000)}')
+        conn.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+        try:
+            reclaimed, detail = getattr(self, '_' + job)(conn, dal, deadline)
+        except JobTimeout:
+            status = 'timeout'
+        except sqlite3.OperationalError as e:
+            status = 'timeout' if time.monotonic() > deadline else 'error'
+            detail = str(e)
+        except sqlite3.Error as e:
+            status, detail = 'error', str(e)
+        finally:
+            conn.close()
+        duration_ms = (time.monotonic() - start) * 1000
+        dal.record_maintenance_run(job, started, duration_ms, status, reclaimed, detail)
+        logger.info("Maintenance job %s: %s", job, status,
+                    extra={'duration_ms': round(duration_ms, 1), 'error': detail if status == 'error' else None})
+        return status, reclaimed, detail
+
+    def due_jobs(self, dal, now=None):
+        """Jobs whose last successful run is older than their interval
+
+        A job that timed out is due again, so an interrupted vacuum carries on
+        at the next pass.
+        """
+        now = now or time.time()
+        due = []
+        for job, settings in self.schedule.items():
+            last = dal.get_maintenance_runs(job, status='ok', limit=1)
+            if not last or now - last[0][2] >= settings['interval']:
+                due.append(job)
+        return due
+
+    def run_due(self, dal, force=False, jobs=None, keep_lease=False):
+        """Run due jobs if this process gets the lease (and, unless forced, in the window)
+
+        The background thread keeps the lease between passes so the same
+        worker stays in charge; one-off runs give it back. Returns
+        {job: (status, bytes reclaimed, detail)} for the jobs that ran.
+        """
+        if not force and not in_window(self.window):
+            return {}
+        if not dal.acquire_lease(LEASE_NAME, self.holder, self.lease_ttl):
+            return {}
+        try:
+            to_run = jobs or (list(self.schedule) if force else self.due_jobs(dal))
+            return {job: self.run_job(dal, job) for job in to_run}
+        finally:
+            if not keep_lease:
+                dal.release_lease(LEASE_NAME, self.holder)
+
+    def _loop(self, dal):
+        while not self._stop.wait(self.tick):
+            try:
+                self.run_due(dal, keep_lease=True)
+            except Exception:
+                logger.exception("Maintenance pass failed")
+
+    def start(self, dal):
+        """Check for due jobs every tick seconds in a background thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, args=(dal,), name='maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        """Forget the thread, e.g. in a forked worker where it doesn't exist"""
+        self._thread = None
+        self._stop = threading.Event()
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite housekeeping for projects.db")
+    parser.add_argument('--db', default='projects.db')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help="run due jobs (or the named ones)")
+    run_parser.add_argument('jobs', nargs='*', metavar='JOB', help=', '.join(DEFAULT_SCHEDULE))
+    run_parser.add_argument('--force', action='store_true', help="ignore the window and intervals")
+    run_parser.add_argument('--window', default=os.environ.get('MAINTENANCE_WINDOW'))
+    run_parser.add_argument('--full-vacuum', action='store_true',
+                            help="allow a full VACUUM to switch on incremental vacuuming")
+    commands.add_parser('history', help="show recent runs")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        unknown = [job for job in args.jobs if job not in DEFAULT_SCHEDULE]
+        if unknown:
+            parser.error(f"unknown job: {', '.join(unknown)}")
+
+    from DAL import DatabaseAccessLayer
+    dal = DatabaseAccessLayer(args.db)
+    if args.command == 'history':
+        for _, job, started, duration_ms, status, reclaimed, detail in dal.get_maintenance_runs(limit=50):
+            when = datetime.fromtimestamp(started).strftime('%Y-%m-%d %H:%M:%S')
+            print(f"{when}  {job:<10} {status:<8} {duration_ms:8.1f} ms  {reclaimed:>10} bytes  {detail or ''}")
+        return 0
+
+    maintenance = Maintenance(window=args.window, allow_full_vacuum=args.full_vacuum)
+    results = maintenance.run_due(dal, force=args.force or bool(args.jobs), jobs=args.jobs or None)
+    if not results:
+        print("Nothing to do (outside the window, nothing due, or another process holds the lease)")
+    for job, (status, reclaimed, detail) in results.items():
+        print(f"{job:<10} {status:<8} {reclaimed:>10} bytes reclaimed  {detail or ''}")
+    return 0 if all(status != 'error' for status, _, _ in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
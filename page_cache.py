@@ -0,0 +1,104 @@
+"""
+Anonymous page cache
+WSGI middleware that answers repeat GETs from visitors without a session
+cookie straight from memory, before Flask opens a request context or session
+"""
+
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import make_response
+from werkzeug.http import parse_cookie
+
+# Internal response header set by cacheable views, never sent to clients
+STORE_MARKER = 'X-Page-Cache-Store'
+# Headers that belong to one request and are never replayed from the cache
+PER_REQUEST_HEADERS = {'x-request-id'}
+
+
+def cacheable(view):
+    """Mark a view's response as safe to share between anonymous visitors"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        response = make_response(view(*args, **kwargs))
+        response.headers[STORE_MARKER] = '1'
+        return response
+    return wrapper
+
+
+class AnonymousPageCache:
+    """LRU of complete responses to cookie-less GET requests"""
+
+    def __init__(self, app, max_entries=128, request_headers=None):
+        """request_headers(environ), if given, returns the per-request headers
+        (e.g. X-Request-ID) added to each response served from the cache"""
+        self.app = app
+        self.request_headers = request_headers
+        self.wsgi_app = app.wsgi_app
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cache_key(self, environ):
+        if environ.get('REQUEST_METHOD') != 'GET':
+            return None
+        cookies = parse_cookie(environ.get('HTTP_COOKIE', ''))
+        if self.app.config['SESSION_COOKIE_NAME'] in cookies:
+            return None
+        return (
+            environ.get('HTTP_HOST', ''),
+            environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', ''),
+            environ.get('QUERY_STRING', ''),
+        )
+
+    def __call__(self, environ, start_response):
+        key = self._cache_key(environ)
+        if key is not None:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+            if entry is not None:
+                status, headers, body = entry
+                headers = list(headers)
+                if self.request_headers is not None:
+                    headers += self.request_headers(environ)
+                start_response(status, headers)
+                return [body]
+
+        state = {}
+
+        def capture(status, headers, exc_info=None):
+            marked = any(name == STORE_MARKER for name, _ in headers)
+            headers = [(name, value) for name, value in headers if name != STORE_MARKER]
+            state['store'] = key is not None and marked and status.startswith('200')
+            state['status'] = status
+            state['headers'] = [(name, value) for name, value in headers
+                                if name.lower() not in PER_REQUEST_HEADERS]
+            return start_response(status, headers, exc_info)
+
+        app_iter = self.wsgi_app(environ, capture)
+        if not state.get('store'):
+            return app_iter
+
+        try:
+            body = b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+        with self._lock:
+            self._entries[key] = (state['status'], tuple(state['headers']), body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return [body]
+
+    def clear(self):
+        """Drop every cached page"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Full-text index over the portfolio PDFs
+Extracts text page by page into an SQLite FTS5 index stored next to projects.db.
+Only files whose content hash changed are re-extracted, in a process pool.
+
+    python pdf_index.py                  # index static/*.pdf once
+    python pdf_index.py --watch 300      # keep re-indexing every 5 minutes
+"""
+
+import argparse
+import glob
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from markupsafe import escape
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # optional dependency, only needed to build the index
+    PdfReader = None
+
+DEFAULT_PATTERN = "static/*.pdf"
+
+# Control characters that mark snippet highlights before the text is HTML-escaped
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+
+def file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def extract_pages(path):
+    """Return the text of each page of a PDF (runs in worker processes)"""
+    if PdfReader is None:
+        raise RuntimeError("pypdf is required to extract PDF text: pip install pypdf")
+    reader = PdfReader(path)
+    return [page.extract_text() or '' for page in reader.pages]
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query that matches all words, ignoring FTS syntax"""
+    terms = [term.replace('"', '""') for term in text.split()]
+    return ' '.join(f'"{term}"' for term in terms if term)
+
+
+class PdfIndex:
+    """Page-level FTS5 index of PDF documents"""
+
+    def __init__(self, db_name="pdf_index.db"):
+        self.db_name = db_name
+        self.init_database()
+
+    def init_database(self):
+        """Create the index tables if they don't exist"""
+        conn = sqlite3.connect(self.db_name)
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS pdf_documents (
+                    path TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL,
+                    page_count INTEGER NOT NULL,
+                    indexed_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS pdf_pages USING fts5(
+                    path UNINDEXED,
+                    page UNINDEXED,
+                    body,
+                    tokenize = 'porter unicode61'
+                )
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_connection(self):
+        return sqlite3.connect(self.db_name)
+
+    def indexed_hashes(self):
+        """Map of path -> content hash for every indexed document"""
+        conn = self.get_connection()
+        try:
+            return dict(conn.execute('SELECT path, sha256 FROM pdf_documents'))
+        finally:
+            conn.close()
+
+    def build(self, paths, workers=None):
+        """Bring the index up to date with paths; returns the re-indexed paths
+
+        Unchanged files are skipped by hash, changed ones are extracted in a
+        process pool and documents no longer in paths are removed.
+        """
+        known = self.indexed_hashes()
+        current = {path: file_sha256(path) for path in paths}
+        changed = [path for path, sha256 in current.items() if known.get(path) != sha256]
+        removed = [path for path in known if path not in current]
+
+        if changed:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for path, pages in zip(changed, pool.map(extract_pages, changed)):
+                    self._store(path, current[path], pages)
+
+        if removed:
+            conn = self.get_connection()
+            try:
+                for path in removed:
+                    conn.execute('DELETE FROM pdf_pages WHERE path = ?', (path,))
+                    conn.execute('DELETE FROM pdf_documents WHERE path = ?', (path,))
+                conn.commit()
+            finally:
+                conn.close()
+
+        return changed
+
+    def _store(self, path, sha256, pages):
+        """Replace the pages of one document in a single transaction"""
+        conn = self.get_connection()
+        try:
+            conn.execute('DELETE FROM pdf_pages WHERE path = ?', (path,))
+            conn.executemany(
+                'INSERT INTO pdf_pages (path, page, body) VALUES (?, ?, ?)',
+                [(path, number, text) for number, text in enumerate(pages, start=1)]
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO pdf_documents (path, sha256, page_count) VALUES (?, ?, ?)',
+                (path, sha256, len(pages))
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def search(self, text, limit=20):
+        """Return page hits as dicts with document, page, snippet (HTML) and url"""
+        query = fts_query(text)
+        if not query:
+            return []
+
+        conn = self.get_connection()
+        try:
+            rows = conn.execute('''
+                SELECT path, page, snippet(pdf_pages, 2, ?, ?, '…', 16)
+                FROM pdf_pages
+                WHERE pdf_pages MATCH ?
+                ORDER BY rank
+                LIMIT ?
+            ''', (_MARK_START, _MARK_END, query, limit)).fetchall()
+        finally:
+            conn.close()
+
+        hits = []
+        for path, page, snippet in rows:
+            url_path = '/' + path.replace(os.sep, '/').lstrip('/')
+            hits.append({
+                'document': os.path.basename(path),
+                'page': page,
+                'snippet': str(escape(snippet)).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>'),
+                'url': f"{url_path}#page={page}",
+            })
+        return hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the portfolio PDFs for full-text search")
+    parser.add_argument('paths', nargs='*', help=f"PDF files (default: {DEFAULT_PATTERN})")
+    parser.add_argument('--db', default='pdf_index.db', help="index database path")
+    parser.add_argument('--workers', type=int, default=None, help="extraction processes")
+    parser.add_argument('--watch', type=float, default=None, metavar='SECONDS',
+                        help="keep running and re-index every SECONDS")
+    args = parser.parse_args()
+
+    index = PdfIndex(args.db)
+    while True:
+        paths = args.paths or sorted(glob.glob(DEFAULT_PATTERN))
+        start = time.perf_counter()
+        changed = index.build(paths, workers=args.workers)
+        elapsed = time.perf_counter() - start
+        print(f"Indexed {len(changed)} of {len(paths)} documents in {elapsed:.2f}s")
+        for path in changed:
+            print(f"  {path}")
+        if args.watch is None:
+            return 0
+        time.sleep(args.watch)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
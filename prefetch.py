@@ -0,0 +1,83 @@
+"""
+Navigation prefetching
+Speculation rules that have the browser prefetch internal links on hover and
+prerender nav links on pointer down, a hover prefetch fallback for browsers
+without speculation rules, and recognition of the resulting prefetch requests
+"""
+
+import json
+from functools import lru_cache
+
+# Request headers browsers use to mark speculative loads
+PURPOSE_HEADERS = ('Sec-Purpose', 'Purpose', 'X-Moz')
+
+FALLBACK_SCRIPT = """\
+(function () {
+  if (!window.HTMLScriptElement || (HTMLScriptElement.supports && HTMLScriptElement.supports('speculationrules'))) return;
+  var scope = %(scope)s, exclude = %(exclude)s, seen = {}, timer = null;
+  function target(event) {
+    var a = event.target.closest && event.target.closest('a[href]');
+    if (!a || a.origin !== location.origin || a.pathname.indexOf(scope) !== 0) return null;
+    if (/^\\/(static|api)\\//.test(a.pathname) || exclude.indexOf(a.pathname) !== -1) return null;
+    if (a.relList.contains('nofollow') || a.pathname === location.pathname || seen[a.href]) return null;
+    return a;
+  }
+  function prefetch(a) {
+    seen[a.href] = true;
+    var link = document.createElement('link');
+    link.rel = 'prefetch';
+    link.href = a.href;
+    document.head.appendChild(link);
+  }
+  document.addEventListener('mouseover', function (event) {
+    var a = target(event);
+    clearTimeout(timer);
+    if (a) timer = setTimeout(function () { prefetch(a); }, 80);
+  });
+  document.addEventListener('touchstart', function (event) {
+    var a = target(event);
+    if (a) prefetch(a);
+  }, {passive: true});
+})();"""
+
+
+def is_prefetch(headers):
+    """True if the request is a prefetch or prerender rather than a navigation"""
+    return any('prefetch' in headers.get(name, '').lower() for name in PURPOSE_HEADERS)
+
+
+def speculation_rules(script_root='', exclude=()):
+    """Speculation rules for the internal links under script_root, minus the paths in exclude"""
+    conditions = [
+        {'href_matches': f"{script_root}/*"},
+        {'not': {'href_matches': '/static/*'}},
+        {'not': {'href_matches': f"{script_root}/api/*"}},
+        {'not': {'selector_matches': '[rel~=nofollow]'}},
+    ]
+    conditions += [{'not': {'href_matches': script_root + path}} for path in exclude]
+    return {
+        'prerender': [{'source': 'document', 'eagerness': 'conservative',
+                       'where': {'and': [{'selector_matches': '.nav-link'}] + conditions}}],
+        'prefetch': [{'source': 'document', 'eagerness': 'moderate', 'where': {'and': conditions}}],
+    }
+
+
+def _script_json(value):
+    # Keeps "</script>" and friends from ending the inline script early
+    return (json.dumps(value, separators=(',', ':'))
+            .replace('<', '\\u003c').replace('>', '\\u003e').replace('&', '\\u0026'))
+
+
+def speculation_markup(script_root='', exclude=()):
+    """<script> tags with the speculation rules and the fallback, for BASE_TEMPLATE"""
+    return _speculation_markup(script_root, tuple(exclude))
+
+
+@lru_cache(maxsize=64)
+def _speculation_markup(script_root, exclude):
+    rules = _script_json(speculation_rules(script_root, exclude))
+    fallback = FALLBACK_SCRIPT % {
+        'scope': _script_json(script_root + '/'),
+        'exclude': _script_json([script_root + path for path in exclude]),
+    }
+    return f'<script type="speculationrules">{rules}</script>\n    <script>{fallback}</script>'
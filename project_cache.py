@@ -0,0 +1,194 @@
+"""
+Project detail cache
+Per-project LRU for the detail pages that also prefetches the newer and older
+neighbours, so pager navigation is answered from memory
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# project is the DAL row; newer_id/older_id are the pager neighbours (None at the ends);
+# tags are its tag names and image_metadata the (width, height, placeholder) of its
+# image: None until the image has been measured, () if it isn't a known asset
+ProjectEntry = namedtuple('ProjectEntry', ['project', 'newer_id', 'older_id', 'tags', 'image_metadata'])
+
+# Neighbour that lies outside the fetched window and therefore isn't known
+_UNKNOWN = object()
+
+# Changes from other workers replayed one by one; further behind than this, start over
+MAX_SYNC_CHANGES = 500
+
+# Seconds between checks of the change log for other workers' writes
+SYNC_INTERVAL = 1.0
+
+
+class ProjectDetailCache:
+    """LRU of ProjectEntry keyed by project id, invalidated by DAL writes
+
+    Entries remember the project's updated_date, so (id, updated_date) identifies
+    the cached version; update/delete listeners on the DAL drop stale entries.
+    At most every sync_interval seconds, a lookup also replays the DAL change
+    log since the last one, so writes made by other worker processes drop
+    entries too. A change of the tags version drops them all.
+    """
+
+    def __init__(self, max_entries=256, prefetch_radius=2, sync_interval=SYNC_INTERVAL):
+        self.max_entries = max_entries
+        self.prefetch_radius = prefetch_radius
+        self.sync_interval = sync_interval
+        self._entries = OrderedDict()
+        # (change sequence number, tags version) the entries are valid for
+        self._version = None
+        self._synced_at = None
+        self._dal = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _bind(self, dal):
+        """Follow the DAL in use, dropping entries that belong to another database"""
+        if dal is self._dal:
+            return
+        if self._dal is not None:
+            self._dal.remove_write_listener(self.on_write)
+        self._entries.clear()
+        self._version = None
+        self._synced_at = None
+        self._dal = dal
+        dal.add_write_listener(self.on_write)
+
+    def _sync(self, dal):
+        """Drop entries changed since the last lookup, by this or any other process
+
+        Returns the version the entries are now valid for.
+        """
+        with self._lock:
+            self._bind(dal)
+            if self._synced_at is not None and time.monotonic() - self._synced_at < self.sync_interval:
+                return self._version
+        synced_at = time.monotonic()
+        latest = dal.get_cache_versions()
+        with self._lock:
+            version = self._version
+        if version == latest:
+            with self._lock:
+                if dal is self._dal and self._version == version:
+                    self._synced_at = synced_at
+            return latest
+
+        changes = None
+        if version is not None and version[1] == latest[1]:
+            since = version[0]
+            changes, compacted_through = dal.get_changes(since, limit=MAX_SYNC_CHANGES + 1)
+            if since < compacted_through or len(changes) > MAX_SYNC_CHANGES:
+                changes = None
+        with self._lock:
+            if dal is not self._dal or self._version != version:
+                # Someone else synced meanwhile
+                return self._version
+            if changes is None:
+                self._entries.clear()
+            else:
+                for _, changed_id, action, _, project in changes:
+                    if action == 'update' and project is not None and changed_id in self._entries:
+                        self._entries.pop(changed_id)
+                    else:
+                        # Compaction may have folded an add into a later change
+                        self._drop(changed_id, 'delete')
+                        self._drop(changed_id, 'add')
+            self._version = latest
+            self._synced_at = synced_at
+            return latest
+
+    def get(self, dal, project_id):
+        """Return the ProjectEntry for project_id, or None if it doesn't exist"""
+        version = self._sync(dal)
+        with self._lock:
+            entry = self._entries.get(project_id)
+            if entry is not None:
+                self._entries.move_to_end(project_id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        window = dal.get_project_window(project_id, radius=self.prefetch_radius)
+        if window is None:
+            return None
+
+        newer, project, older = window
+        # Listing order: newest first
+        rows = list(reversed(newer)) + [project] + older
+        starts_at_newest = len(newer) < self.prefetch_radius
+        ends_at_oldest = len(older) < self.prefetch_radius
+        # Tags and image metadata of the whole window, fetched once for every entry
+        tags = dal.get_project_tags([row[0] for row in rows])
+        images = {filename: row[2:] if row[1] else None
+                  for filename, row in dal.get_image_metadata([row[3] for row in rows]).items()}
+
+        with self._lock:
+            if dal is not self._dal or self._version != version:
+                return self._entry_for(rows, rows.index(project), True, True, tags, images)
+            for index, row in enumerate(rows):
+                entry = self._entry_for(rows, index, starts_at_newest, ends_at_oldest, tags, images)
+                if entry is not None and (row is project or row[0] not in self._entries):
+                    self._store(row[0], entry)
+            return (self._entries.get(project_id)
+                    or self._entry_for(rows, rows.index(project), True, True, tags, images))
+
+    @staticmethod
+    def _entry_for(rows, index, starts_at_newest, ends_at_oldest, tags, images):
+        """Build the entry for rows[index] if both of its neighbours are known"""
+        if index > 0:
+            newer_id = rows[index - 1][0]
+        else:
+            newer_id = None if starts_at_newest else _UNKNOWN
+        if index < len(rows) - 1:
+            older_id = rows[index + 1][0]
+        else:
+            older_id = None if ends_at_oldest else _UNKNOWN
+        if newer_id is _UNKNOWN or older_id is _UNKNOWN:
+            return None
+        row = rows[index]
+        return ProjectEntry(row, newer_id, older_id, tags.get(row[0], []), images.get(row[3], ()))
+
+    def _store(self, project_id, entry):
+        self._entries[project_id] = entry
+        self._entries.move_to_end(project_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def on_write(self, action, project_id):
+        """DAL write listener: drop every entry the write may have made stale"""
+        with self._lock:
+            self._drop(project_id, action)
+            # A lookup that read the database before this write may store an
+            # entry after it; check the change log on the next lookup
+            self._synced_at = None
+
+    def _drop(self, project_id, action):
+        if action in ('update', 'tags'):
+            self._entries.pop(project_id, None)
+        elif action == 'delete':
+            stale = [key for key, entry in self._entries.items()
+                     if key == project_id or project_id in (entry.newer_id, entry.older_id)]
+            for key in stale:
+                del self._entries[key]
+        elif action == 'add':
+            # New projects are the newest, so only the current newest gains a neighbour
+            stale = [key for key, entry in self._entries.items() if entry.newer_id is None]
+            for key in stale:
+                del self._entries[key]
+        else:
+            self._entries.clear()
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, project_id):
+        return project_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
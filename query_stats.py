@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Query statistics
+Call counts, latency percentiles and rows returned for each statement the DAL
+runs, a slow-query log that keeps each slow statement's EXPLAIN QUERY PLAN,
+and a warning for frequently run statements whose plan scans a whole table.
+
+Statistics are kept per process. /admin/query-stats returns those of the
+worker that answers it.
+
+    python query_stats.py --url http://localhost:5000 --token $ADMIN_TOKEN
+    python query_stats.py --local      # warm up in-process, then print
+"""
+
+import argparse
+import json
+import logging
+import math
+import re
+import sqlite3
+import sys
+import threading
+import time
+import urllib.request
+from collections import deque
+from functools import lru_cache
+
+logger = logging.getLogger('portfolio.dal.queries')
+
+# Latencies kept per statement for the percentiles
+SAMPLES = 512
+# Calls after which a statement counts as a hot path
+HOT_CALLS = 100
+# Statements EXPLAIN QUERY PLAN accepts
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """sql on one line, with IN lists of any length written as IN (?, ...)"""
+    return re.sub(r'\bIN \(\s*\?(?:\s*,\s*\?)*\s*\)', 'IN (?, ...)', ' '.join(sql.split()), flags=re.IGNORECASE)
+
+
+def full_scans(plan):
+    """Tables plan reads in full, without an index"""
+    tables = []
+    for detail in plan or ():
+        match = re.match(r'SCAN (?:TABLE )?(\S+)(.*)', detail)
+        # Index scans say USING; subqueries and SCAN CONSTANT ROW read no table
+        if match and 'USING' not in match.group(2) and not match.group(1).startswith(('(', 'CONSTANT')):
+            tables.append(match.group(1))
+    return tables
+
+
+def explain(conn, sql, parameters):
+    """EXPLAIN QUERY PLAN details of sql, or None if it can't be explained"""
+    if parameters is None or not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    try:
+        # A plain cursor, so explaining isn't itself recorded
+        rows = conn.cursor(sqlite3.Cursor).execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+    except sqlite3.Error:
+        return None
+    return [row[-1] for row in rows]
+
+
+def _percentile(ordered, fraction):
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class _Statement:
+    __slots__ = ('calls', 'seconds', 'max_seconds', 'rows', 'samples', 'slow', 'plan', 'flagged')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.samples = deque(maxlen=SAMPLES)
+        self.slow = 0
+        self.plan = None
+        self.flagged = False
+
+
+class QueryStats:
+    """Per-statement statistics and the slow-query log of one DAL"""
+
+    def __init__(self, slow_ms=100, hot_calls=HOT_CALLS, slow_log_size=50):
+        self.slow_ms = slow_ms
+        self.hot_calls = hot_calls
+        self._statements = {}
+        self._slow_log = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+
+    def record(self, conn, sql, parameters, seconds, rows):
+        """Count one finished statement; conn is still open, for EXPLAIN
+
+        Each statement is explained the first time it's seen and again
+        whenever it runs slow, so plans that change as data grows show up.
+        """
+        key = normalize_sql(sql)
+        slow = seconds * 1000 >= self.slow_ms
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is None:
+                entry = self._statements[key] = _Statement()
+            entry.calls += 1
+            entry.seconds += seconds
+            entry.max_seconds = max(entry.max_seconds, seconds)
+            entry.rows += rows
+            entry.samples.append(seconds)
+            if slow:
+                entry.slow += 1
+            needs_plan = entry.plan is None or slow
+
+        if needs_plan:
+            plan = explain(conn, sql, parameters) or []
+            with self._lock:
+                changed = entry.plan is not None and entry.plan != plan
+                entry.plan = plan
+            if changed:
+                logger.info("Query plan changed", extra={'sql': key, 'plan': plan})
+        if slow:
+            with self._lock:
+                self._slow_log.append({'ts': time.time(), 'sql': key, 'duration_ms': round(seconds * 1000, 3),
+                                       'rows': rows, 'plan': entry.plan})
+            logger.warning("Slow query", extra={'sql': key, 'duration_ms': round(seconds * 1000, 3),
+                                                'rows': rows, 'plan': entry.plan})
+        if entry.calls >= self.hot_calls and not entry.flagged and full_scans(entry.plan):
+            with self._lock:
+                entry.flagged = True
+            logger.warning("Full table scan on a hot query", extra={'sql': key, 'plan': entry.plan})
+
+    def snapshot(self):
+        """One dict per statement, most total time first"""
+        with self._lock:
+            items = [(key, entry, sorted(entry.samples)) for key, entry in self._statements.items()]
+            statements = []
+            for key, entry, ordered in items:
+                statements.append({
+                    'sql': key,
+                    'calls': entry.calls,
+                    'total_ms': round(entry.seconds * 1000, 3),
+                    'mean_ms': round(entry.seconds * 1000 / entry.calls, 3),
+                    'p50_ms': round(_percentile(ordered, 0.50) * 1000, 3),
+                    'p95_ms': round(_percentile(ordered, 0.95) * 1000, 3),
+                    'p99_ms': round(_percentile(ordered, 0.99) * 1000, 3),
+                    'max_ms': round(entry.max_seconds * 1000, 3),
+                    'rows': entry.rows,
+                    'slow': entry.slow,
+                    'hot': entry.calls >= self.hot_calls,
+                    'full_scan': full_scans(entry.plan),
+                    'plan': entry.plan,
+                })
+        statements.sort(key=lambda statement: -statement['total_ms'])
+        return statements
+
+    def slow_queries(self):
+        """The most recent slow statements, oldest first"""
+        with self._lock:
+            return list(self._slow_log)
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._slow_log.clear()
+
+
+def print_stats(body, out=sys.stdout):
+    """Print a /admin/query-stats body as a table"""
+    print(f"{'calls':>7} {'total ms':>10} {'p50':>8} {'p95':>8} {'p99':>8} {'rows':>8}  statement", file=out)
+    for statement in body['statements']:
+        flags = ' [FULL SCAN: ' + ', '.join(statement['full_scan']) + ']' if statement['full_scan'] else ''
+        print(f"{statement['calls']:>7} {statement['total_ms']:>10.1f} {statement['p50_ms']:>8.2f} "
+              f"{statement['p95_ms']:>8.2f} {statement['p99_ms']:>8.2f} {statement['rows']:>8}  "
+              f"{statement['sql'][:100]}{flags}", file=out)
+    if body['slow']:
+        print(f"\nSlow queries (>= {body['slow_ms']} ms):", file=out)
+        for entry in body['slow']:
+            print(f"  {entry['duration_ms']:8.1f} ms  {entry['sql'][:100]}", file=out)
+            for detail in entry['plan'] or ():
+                print(f"      {detail}", file=out)
+
+
+def report(stats):
+    """The /admin/query-stats body for stats"""
+    return {'slow_ms': stats.slow_ms, 'hot_calls': stats.hot_calls,
+            'statements': stats.snapshot(), 'slow': stats.slow_queries()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the DAL's per-statement query statistics")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--url', help="base URL of a running server")
+    source.add_argument('--local', action='store_true', help="warm up the app in this process and report on that")
+    parser.add_argument('--token', help="ADMIN_TOKEN of the server")
+    parser.add_argument('--json', action='store_true', help="print the raw JSON")
+    args = parser.parse_args()
+
+    if args.url:
+        request = urllib.request.Request(args.url.rstrip('/') + '/admin/query-stats',
+                                         headers={'Authorization': f"Bearer {args.token or ''}"})
+        with urllib.request.urlopen(request) as response:
+            body = json.load(response)
+    else:
+        from app import app, dal, readiness
+        from warmup import warm_up
+        app.config['RATELIMIT_ENABLED'] = False
+        warm_up(app, dal, readiness)
+        body = report(dal.query_stats)
+
+    if args.json:
+        print(json.dumps(body, indent=2))
+    else:
+        print_stats(body)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,81 +2,123 @@
 """
 Test runner script for the Flask portfolio website
 Run this script to execute all tests locally
+
+All suites run in a single pytest pass, spread over every core with
+pytest-xdist and measured with pytest-cov in the same pass when those plugins
+are installed (see test_requirements.txt). Wall-clock time, time per suite and
+the slowest tests are reported.
+
+    python run_tests.py              # parallel run with coverage
+    python run_tests.py --workers 1  # run in this process only
+    python run_tests.py --no-cov     # skip coverage
 """
 
+import argparse
+import importlib.util
+import os
 import subprocess
 import sys
-import os
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from collections import defaultdict
 
+TEST_SUITES = [
+    ("test_database.py", "Database Tests"),
+    ("test_app.py", "Application Tests"),
+    ("test_integration.py", "Integration Tests"),
+]
 
-def run_command(command, description):
-    """Run a command and return success status"""
-    print(f"\n{'='*60}")
-    print(f"Running: {description}")
-    print(f"Command: {command}")
-    print(f"{'='*60}")
-    
+
+def has_plugin(module):
+    """Whether a pytest plugin module can be imported"""
+    return importlib.util.find_spec(module) is not None
+
+
+def build_command(workers, coverage, junit_path, durations):
+    """pytest command line for a single pass over all suites"""
+    command = [sys.executable, '-m', 'pytest', '-q', '-p', 'no:cacheprovider',
+               f'--durations={durations}', f'--junitxml={junit_path}']
+    if workers != '1':
+        command += ['-n', workers]
+    if coverage:
+        command += ['--cov=.', '--cov-report=term-missing']
+    command += [path for path, _ in TEST_SUITES]
+    return command
+
+
+def suite_timings(junit_path):
+    """Map of test file -> (tests, failures, summed test seconds) from a JUnit report"""
+    timings = defaultdict(lambda: [0, 0, 0.0])
     try:
-        result = subprocess.run(command, shell=True, check=True, capture_output=True, text=True)
-        print("SUCCESS")
-        if result.stdout:
-            print("Output:")
-            print(result.stdout)
-        return True
-    except subprocess.CalledProcessError as e:
-        print("FAILED")
-        print(f"Error: {e}")
-        if e.stdout:
-            print("Output:")
-            print(e.stdout)
-        if e.stderr:
-            print("Error output:")
-            print(e.stderr)
-        return False
+        root = ET.parse(junit_path).getroot()
+    except (OSError, ET.ParseError):
+        return {}
+    for case in root.iter('testcase'):
+        module = case.get('classname', '').split('.')[0]
+        entry = timings[f"{module}.py"]
+        entry[0] += 1
+        entry[1] += any(child.tag in ('failure', 'error') for child in case)
+        entry[2] += float(case.get('time') or 0)
+    return timings
 
 
 def main():
     """Main test runner function"""
+    parser = argparse.ArgumentParser(description="Run the test suites")
+    parser.add_argument('--workers', default='auto',
+                        help="pytest-xdist workers, or 1 to run in-process (default: auto)")
+    parser.add_argument('--no-cov', action='store_true', help="don't collect coverage")
+    parser.add_argument('--durations', type=int, default=15, help="slowest tests to list")
+    args = parser.parse_args()
+
     print("Flask Portfolio Website - Test Runner")
     print("=" * 60)
-    
+
     # Check if we're in the right directory
     if not os.path.exists('app.py'):
         print("Error: app.py not found. Please run this script from the project root directory.")
         sys.exit(1)
-    
+
     # Check if pytest is installed
-    try:
-        subprocess.run(['python', '-m', 'pytest', '--version'], 
-                      check=True, capture_output=True)
-    except subprocess.CalledProcessError:
+    if not has_plugin('pytest'):
         print("Error: pytest not installed. Please install test requirements:")
         print("pip install -r test_requirements.txt")
         sys.exit(1)
-    
-    # Run tests
-    tests_passed = 0
-    total_tests = 0
-    
-    test_commands = [
-        ("python -m pytest test_database.py -v", "Database Tests"),
-        ("python -m pytest test_app.py -v", "Application Tests"),
-        ("python -m pytest test_integration.py -v", "Integration Tests"),
-        ("python -m pytest --cov=. --cov-report=term-missing", "Coverage Report"),
-    ]
-    
-    for command, description in test_commands:
-        total_tests += 1
-        if run_command(command, description):
-            tests_passed += 1
-    
+
+    workers = args.workers
+    if workers != '1' and not has_plugin('xdist'):
+        print("pytest-xdist not installed, running tests in a single process")
+        workers = '1'
+    coverage = not args.no_cov
+    if coverage and not has_plugin('pytest_cov'):
+        print("pytest-cov not installed, skipping coverage")
+        coverage = False
+
+    handle, junit_path = tempfile.mkstemp(suffix='.xml', prefix='junit-')
+    os.close(handle)
+    try:
+        command = build_command(workers, coverage, junit_path, args.durations)
+        print(f"Command: {' '.join(command)}")
+        print("=" * 60)
+        start = time.perf_counter()
+        returncode = subprocess.run(command).returncode
+        elapsed = time.perf_counter() - start
+        timings = suite_timings(junit_path)
+    finally:
+        os.unlink(junit_path)
+
     # Summary
     print(f"\n{'='*60}")
     print("TEST SUMMARY")
     print(f"{'='*60}")
-    print(f"Tests passed: {tests_passed}/{total_tests}")
-    
-    if tests_passed == total_tests:
+    for path, description in TEST_SUITES:
+        tests, failures, seconds = timings.get(path, (0, 0, 0.0))
+        status = "FAILED" if failures else "passed"
+        print(f"{description:<20} {tests:>4} tests  {seconds:>7.2f}s  {status}")
+    print(f"Wall-clock time: {elapsed:.2f}s (workers: {workers}, coverage: {'on' if coverage else 'off'})")
+
+    if returncode == 0:
         print("All tests passed!")
         return 0
     else:
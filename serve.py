@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Production launcher
+Starts gunicorn with gunicorn.conf.py and performs zero-downtime reloads
+
+    python serve.py start [--daemon]
+    python serve.py reload
+    python serve.py stop
+"""
+
+import argparse
+import os
+import signal
+import sys
+import time
+
+CONFIG_FILE = 'gunicorn.conf.py'
+PIDFILE = os.environ.get('GUNICORN_PIDFILE', 'gunicorn.pid')
+
+
+def read_pid(path):
+    """Return the pid stored in path, or None"""
+    try:
+        with open(path) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+def start(daemon=False):
+    """Replace this process with the gunicorn master"""
+    command = ['gunicorn', '-c', CONFIG_FILE]
+    if daemon:
+        command.append('--daemon')
+    command.append('wsgi:application')
+    os.execvp(command[0], command)
+
+
+def reload(timeout=60):
+    """Swap in a new master running the current code without dropping requests
+
+    HUP alone is not enough with preload_app because the master keeps the
+    already imported app. USR2 re-executes the master with fresh code next to
+    the old one; once it has written its pidfile the old master is sent TERM
+    and finishes its in-flight requests before exiting.
+    """
+    old_pid = read_pid(PIDFILE)
+    if old_pid is None or not is_running(old_pid):
+        print("Error: gunicorn is not running")
+        return 1
+
+    os.kill(old_pid, signal.SIGUSR2)
+
+    # The new master writes <pidfile>.2 and takes over the pidfile once the old
+    # master has exited
+    deadline = time.time() + timeout
+    new_pid = None
+    while time.time() < deadline:
+        new_pid = read_pid(PIDFILE + '.2') or read_pid(PIDFILE)
+        if new_pid and new_pid != old_pid and is_running(new_pid):
+            break
+        time.sleep(0.2)
+    else:
+        print("Error: new master did not start, keeping the old one")
+        return 1
+
+    # Give the new workers a moment to boot before the old ones stop accepting
+    time.sleep(2)
+    os.kill(old_pid, signal.SIGTERM)
+    print(f"Reloaded: master {old_pid} -> {new_pid}")
+    return 0
+
+
+def stop():
+    """Gracefully stop the server"""
+    pid = read_pid(PIDFILE)
+    if pid is None or not is_running(pid):
+        print("gunicorn is not running")
+        return 0
+    os.kill(pid, signal.SIGTERM)
+    print(f"Stopping master {pid}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the portfolio site under gunicorn")
+    parser.add_argument('command', choices=['start', 'reload', 'stop'])
+    parser.add_argument('--daemon', action='store_true', help="detach from the terminal on start")
+    args = parser.parse_args()
+
+    if args.command == 'start':
+        start(args.daemon)
+    elif args.command == 'reload':
+        return reload()
+    return stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
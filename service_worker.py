@@ -0,0 +1,279 @@
+"""
+Service worker and web manifest
+Generates /sw.js from the app's page routes and the static files, so repeat
+visits and offline visits are served from the browser's cache:
+
+- pages: network-first, with the cached copy as the offline fallback (only
+  responses that are neither private nor no-store are kept, so pages with a
+  session or CSRF token are not), so a redirect after a form post always
+  lands on the current page and its flash message
+- style.css, images and fonts: precached, each under its content hash, so a
+  deploy refetches only the files that changed
+- PDFs: cached under their content hash the first time they are downloaded in
+  full; range requests are then answered from the cached copy
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+# Argument-less GET routes that don't render pages
+NON_PAGE_ENDPOINTS = {'static', 'static_files', 'healthz', 'readyz', 'search_documents', 'project_changes',
+                      'sitemap', 'projects_atom', 'service_worker_script', 'web_manifest_file',
+                      'export_projects_file', 'portfolio_stats', 'query_stats'}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg')
+
+SCRIPT_TEMPLATE = """\
+// Generated by service_worker.py; version __VERSION__
+const SCOPE = __SCOPE__;
+const PAGES = __PAGES__;
+const PRECACHE = __PRECACHE__;
+const PDFS = __PDFS__;
+const PRECACHE_CACHE = 'portfolio-precache';
+const PAGE_CACHE = 'portfolio-pages';
+const STATIC_CACHE = 'portfolio-static';
+const PDF_CACHE = 'portfolio-pdfs';
+
+function precacheKey(path) {
+  return path + '?rev=' + PRECACHE[path];
+}
+
+function pdfKey(path) {
+  return path + '?rev=' + (PDFS[path] || '');
+}
+
+function cacheKey(request) {
+  const url = new URL(request.url);
+  return url.pathname + url.search;
+}
+
+async function dropUnlisted(cacheName, wanted) {
+  const cache = await caches.open(cacheName);
+  for (const request of await cache.keys()) {
+    if (!wanted.has(cacheKey(request))) await cache.delete(request);
+  }
+}
+
+function storable(response) {
+  const cacheControl = response.headers.get('Cache-Control') || '';
+  return response.ok && response.type === 'basic' && !/no-store|private/.test(cacheControl);
+}
+
+self.addEventListener('install', event => {
+  event.waitUntil((async () => {
+    const precache = await caches.open(PRECACHE_CACHE);
+    const present = new Set((await precache.keys()).map(cacheKey));
+    await Promise.all(Object.keys(PRECACHE).filter(path => !present.has(precacheKey(path))).map(async path => {
+      const response = await fetch(path, {cache: 'reload'});
+      if (response.ok) await precache.put(precacheKey(path), response);
+    }));
+    const pages = await caches.open(PAGE_CACHE);
+    await Promise.all(PAGES.map(async path => {
+      try {
+        const response = await fetch(path, {cache: 'reload', credentials: 'same-origin'});
+        if (storable(response)) await pages.put(path, response);
+      } catch (error) {}
+    }));
+    await self.skipWaiting();
+  })());
+});
+
+self.addEventListener('activate', event => {
+  event.waitUntil((async () => {
+    // Drop cached files whose revision is no longer listed
+    await dropUnlisted(PRECACHE_CACHE, new Set(Object.keys(PRECACHE).map(precacheKey)));
+    await dropUnlisted(PDF_CACHE, new Set(Object.keys(PDFS).map(pdfKey)));
+    await self.clients.claim();
+  })());
+});
+
+async function revalidate(cacheName, request) {
+  const response = await fetch(request);
+  if (storable(response)) {
+    const cache = await caches.open(cacheName);
+    await cache.put(request, response.clone());
+  }
+  return response;
+}
+
+async function networkFirst(event, cacheName) {
+  try {
+    return await revalidate(cacheName, event.request);
+  } catch (error) {
+    const cached = await caches.match(event.request, {cacheName: cacheName, ignoreVary: true})
+      || await caches.match(SCOPE, {cacheName: cacheName});
+    if (cached) return cached;
+    throw error;
+  }
+}
+
+async function staleWhileRevalidate(event, cacheName) {
+  const cached = await caches.match(event.request, {cacheName: cacheName, ignoreVary: true});
+  const fresh = revalidate(cacheName, event.request);
+  if (cached) {
+    event.waitUntil(fresh.catch(() => {}));
+    return cached;
+  }
+  return fresh;
+}
+
+async function pdfResponse(request, path) {
+  const cache = await caches.open(PDF_CACHE);
+  const range = request.headers.get('Range');
+  const cached = await cache.match(pdfKey(path));
+  if (!cached) {
+    const response = await fetch(request);
+    if (!range && response.status === 200) await cache.put(pdfKey(path), response.clone());
+    return response;
+  }
+  if (!range) return cached;
+
+  const body = await cached.blob();
+  const match = /^bytes=(\\d*)-(\\d*)$/.exec(range.trim());
+  let start = match && match[1] !== '' ? Number(match[1]) : NaN;
+  let end = match && match[2] !== '' ? Number(match[2]) : body.size - 1;
+  if (match && match[1] === '' && match[2] !== '') {
+    start = Math.max(body.size - Number(match[2]), 0);
+    end = body.size - 1;
+  }
+  end = Math.min(end, body.size - 1);
+  if (!(start >= 0) || start > end) {
+    return new Response(null, {status: 416, headers: {'Content-Range': 'bytes */' + body.size}});
+  }
+  return new Response(body.slice(start, end + 1), {
+    status: 206,
+    headers: {
+      'Content-Type': cached.headers.get('Content-Type') || 'application/pdf',
+      'Content-Length': String(end - start + 1),
+      'Content-Range': 'bytes ' + start + '-' + end + '/' + body.size,
+      'Accept-Ranges': 'bytes',
+    },
+  });
+}
+
+self.addEventListener('fetch', event => {
+  const request = event.request;
+  if (request.method !== 'GET') return;
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin) return;
+
+  if (request.mode === 'navigate') {
+    if (url.pathname.startsWith(SCOPE)) event.respondWith(networkFirst(event, PAGE_CACHE));
+  } else if (url.pathname in PRECACHE && !url.search) {
+    event.respondWith(caches.match(precacheKey(url.pathname), {cacheName: PRECACHE_CACHE})
+      .then(cached => cached || fetch(request)));
+  } else if (url.pathname in PDFS && !url.search) {
+    event.respondWith(pdfResponse(request, url.pathname));
+  } else if (url.pathname.startsWith('/static/')) {
+    event.respondWith(staleWhileRevalidate(event, STATIC_CACHE));
+  }
+});
+"""
+
+
+def page_urls(app):
+    """Paths of the argument-less GET routes that render pages"""
+    urls = []
+    for rule in app.url_map.iter_rules():
+        if 'GET' in rule.methods and not rule.arguments and rule.endpoint not in NON_PAGE_ENDPOINTS:
+            urls.append(rule.rule)
+    return sorted(urls)
+
+
+class ServiceWorker:
+    """Builds the service worker script, versioned by the content of what it precaches"""
+
+    def __init__(self, static_dir="static", frontend_assets=None):
+        self.static_dir = static_dir
+        self.frontend_assets = frontend_assets
+        # path -> ((mtime, size), short sha256), so unchanged files aren't re-hashed
+        self._hashes = {}
+        self._scripts = {}
+        self._lock = threading.Lock()
+
+    def _revision(self, path):
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._hashes.get(path)
+        if cached is None or cached[0] != key:
+            hasher = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    hasher.update(chunk)
+            cached = self._hashes[path] = (key, hasher.hexdigest()[:16])
+        return cached[1]
+
+    def precache_files(self):
+        """Static files precached on install: the stylesheet, site images and fonts"""
+        files = [os.path.join('css', 'style.css')]
+        images_dir = os.path.join(self.static_dir, 'images')
+        if os.path.isdir(images_dir):
+            files += [os.path.join('images', name) for name in sorted(os.listdir(images_dir))
+                      if name.lower().endswith(IMAGE_EXTENSIONS)]
+        if self.frontend_assets is not None:
+            files += [os.path.join('fonts', font['file']) for font in self.frontend_assets.fonts]
+        return files
+
+    def pdf_files(self):
+        """The PDF documents in the static directory, cached on demand"""
+        try:
+            return sorted(name for name in os.listdir(self.static_dir) if name.lower().endswith('.pdf'))
+        except OSError:
+            return []
+
+    def revisions(self, files):
+        """URL -> content revision of each of files (relative to static_dir) that exists"""
+        manifest = {}
+        with self._lock:
+            for relative in files:
+                path = os.path.join(self.static_dir, relative)
+                try:
+                    manifest['/static/' + relative.replace(os.sep, '/')] = self._revision(path)
+                except OSError:
+                    continue
+        return manifest
+
+    def script(self, pages, script_root=''):
+        """(JavaScript source, version) of the service worker for pages under script_root"""
+        precache = self.revisions(self.precache_files())
+        pdfs = self.revisions(self.pdf_files())
+        pages = [script_root + page for page in pages]
+        scope = script_root + '/'
+        version = hashlib.sha256(json.dumps([scope, pages, precache, pdfs], sort_keys=True).encode()).hexdigest()[:16]
+        key = (scope, version)
+        script = self._scripts.get(key)
+        if script is None:
+            script = (SCRIPT_TEMPLATE
+                      .replace('__VERSION__', version)
+                      .replace('__SCOPE__', json.dumps(scope))
+                      .replace('__PAGES__', json.dumps(pages))
+                      .replace('__PRECACHE__', json.dumps(precache, sort_keys=True))
+                      .replace('__PDFS__', json.dumps(pdfs, sort_keys=True)))
+            with self._lock:
+                if len(self._scripts) > 64:
+                    self._scripts.clear()
+                self._scripts[key] = script
+        return script, version
+
+    def clear(self):
+        with self._lock:
+            self._hashes.clear()
+            self._scripts.clear()
+
+
+def web_manifest(name, script_root='', icon=None):
+    """Web app manifest as a dict; icon is (url, width, height, mimetype) or None"""
+    manifest = {
+        'name': name,
+        'short_name': name.split(' ')[0],
+        'start_url': script_root + '/',
+        'scope': script_root + '/',
+        'display': 'standalone',
+        'background_color': '#ffffff',
+        'theme_color': '#000000',
+    }
+    if icon is not None:
+        url, width, height, mimetype = icon
+        manifest['icons'] = [{'src': url, 'sizes': f"{width}x{height}", 'type': mimetype}]
+    return manifest
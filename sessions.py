@@ -0,0 +1,174 @@
+"""
+Session handling
+Cookie sessions that stay untouched for anonymous visitors, plus an optional
+server-side SQLite store that keeps the cookie to a fixed-size signed id
+"""
+
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface, SessionInterface
+from itsdangerous import BadSignature, Signer
+
+
+def has_session_cookie(app, cookies):
+    """Return True if the request cookies carry a session cookie for app"""
+    return app.config['SESSION_COOKIE_NAME'] in cookies
+
+
+class LazyCookieSessionInterface(SecureCookieSessionInterface):
+    """Signed cookie sessions that skip the serializer when no cookie was sent"""
+
+    def open_session(self, app, request):
+        if not has_session_cookie(app, request.cookies):
+            return self.session_class()
+        return super().open_session(app, request)
+
+
+class ServerSideSession(SecureCookieSession):
+    """Session data kept in the server-side store, addressed by a random id"""
+
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid
+
+
+class SqliteSessionInterface(SessionInterface):
+    """Server-side session store backed by a local SQLite database
+
+    The cookie only holds a signed random session id, so its size and the
+    signing cost stay constant however much is stored in the session.
+    """
+
+    session_class = ServerSideSession
+    serializer = TaggedJSONSerializer()
+    salt = 'server-side-session'
+    # Expired rows are purged on every Nth save
+    purge_interval = 500
+
+    def __init__(self, db_name="sessions.db"):
+        self.db_name = db_name
+        self._saves = 0
+        self._lock = threading.Lock()
+        self.init_database()
+
+    def init_database(self):
+        """Create the sessions table if it doesn't exist"""
+        conn = sqlite3.connect(self.db_name)
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    sid TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    expires REAL NOT NULL
+                )
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return self.session_class()
+
+        try:
+            sid = self.get_signer(app).unsign(cookie).decode('ascii')
+        except BadSignature:
+            return self.session_class()
+
+        conn = sqlite3.connect(self.db_name)
+        try:
+            row = conn.execute(
+                'SELECT data FROM sessions WHERE sid = ? AND expires > ?',
+                (sid, time.time())
+            ).fetchone()
+        finally:
+            conn.close()
+
+        if row is None:
+            return self.session_class(sid=sid)
+        return self.session_class(self.serializer.loads(row[0]), sid=sid)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified and session.sid:
+                self._delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+                response.vary.add('Cookie')
+            return
+
+        if not self.should_set_cookie(app, session):
+            return
+
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+
+        expires_at = time.time() + app.permanent_session_lifetime.total_seconds()
+        self._store(session.sid, self.serializer.dumps(dict(session)), expires_at)
+
+        response.set_cookie(
+            name,
+            self.get_signer(app).sign(session.sid.encode('ascii')).decode('ascii'),
+            expires=self.get_expiration_time(app, session),
+            httponly=httponly,
+            domain=domain,
+            path=path,
+            secure=secure,
+            samesite=samesite,
+        )
+        response.vary.add('Cookie')
+
+    def _store(self, sid, data, expires_at):
+        conn = sqlite3.connect(self.db_name)
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)',
+                (sid, data, expires_at)
+            )
+            with self._lock:
+                self._saves += 1
+                purge = self._saves % self.purge_interval == 0
+            if purge:
+                conn.execute('DELETE FROM sessions WHERE expires <= ?', (time.time(),))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _delete(self, sid):
+        conn = sqlite3.connect(self.db_name)
+        try:
+            conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def make_session_interface(config):
+    """Build the session interface selected by SESSION_BACKEND"""
+    backend = config.get('SESSION_BACKEND', 'cookie')
+    if backend == 'sqlite':
+        return SqliteSessionInterface(config.get('SESSION_SQLITE_PATH', 'sessions.db'))
+    if backend == 'cookie':
+        return LazyCookieSessionInterface()
+    raise ValueError(f"Unknown session backend: {backend}")
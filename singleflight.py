@@ -0,0 +1,86 @@
+"""
+Single-flight calls
+Concurrent calls with the same key share one execution: the first caller runs
+the function and everyone who arrives while it is running waits for that
+result (or that exception) instead of running it again.
+"""
+
+import copy
+import threading
+
+
+class FlightTimeout(Exception):
+    """Waited longer than the timeout for another caller's execution"""
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls per key; nothing is kept once a call finishes"""
+
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        # Calls that ran the function, and calls answered by someone else's run
+        self.executions = 0
+        self.shared = 0
+
+    def do(self, key, function, *args, **kwargs):
+        """Return function(*args, **kwargs), sharing a run already in flight for key
+
+        Waiters get a shallow copy of the result, so a list one caller changes
+        isn't changed for the others, and re-raise the exception the run
+        raised. A waiter gives up with FlightTimeout after timeout seconds.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.executions += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            if not flight.done.wait(self.timeout):
+                raise FlightTimeout(f"No result for {key!r} after {self.timeout}s")
+            if flight.error is not None:
+                raise flight.error
+            return copy.copy(flight.result)
+
+        try:
+            flight.result = function(*args, **kwargs)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    def forget(self):
+        """Make calls from now on start their own runs instead of joining earlier ones
+
+        Runs already in flight still answer the callers waiting for them.
+        """
+        with self._lock:
+            self._flights.clear()
+
+    def reset(self):
+        """Forget in-flight runs and counters, e.g. in a forked worker"""
+        with self._lock:
+            self._flights.clear()
+            self.executions = 0
+            self.shared = 0
+
+    def __len__(self):
+        return len(self._flights)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Portfolio statistics
+The counts behind /stats are kept in aggregate tables that every project
+write updates in its own transaction. If they ever drift (e.g. after editing
+projects.db by hand), rebuild them from the projects table:
+
+    python stats.py              # print the current numbers
+    python stats.py rebuild      # recompute them from projects
+"""
+
+import argparse
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or rebuild the portfolio statistics")
+    parser.add_argument('command', nargs='?', choices=['show', 'rebuild'], default='show')
+    parser.add_argument('--db', default='projects.db')
+    args = parser.parse_args()
+
+    from DAL import DatabaseAccessLayer
+    dal = DatabaseAccessLayer(args.db)
+    if args.command == 'rebuild':
+        drifted = dal.rebuild_stats()
+        print("Rebuilt statistics" + (" (they had drifted)" if drifted else " (no drift)"))
+
+    stats = dal.get_stats()
+    print(f"Projects: {stats['projects']}")
+    for month, count in stats['per_month']:
+        print(f"  {month}  {count}")
+    print("Image usage:")
+    for image_filename, count in stats['image_usage']:
+        print(f"  {count:>4}  {image_filename}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
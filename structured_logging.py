@@ -0,0 +1,163 @@
+"""
+Structured logging
+JSON log lines written by a background thread, so logging never blocks a
+request on I/O, tagged with the request id and rate limited per message so an
+error storm can't flood the output
+"""
+
+import contextvars
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Id of the request being handled in this context (None outside requests)
+REQUEST_ID = contextvars.ContextVar('request_id', default=None)
+# 'prefetch' for speculative loads, so they can be told apart from real views
+REQUEST_PURPOSE = contextvars.ContextVar('request_purpose', default=None)
+
+# Extra record attributes copied into the JSON output when set
+EXTRA_FIELDS = ('request_id', 'purpose', 'dal_method', 'sql', 'duration_ms', 'rows', 'plan', 'error', 'suppressed')
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the current request id and purpose"""
+
+    def filter(self, record):
+        if getattr(record, 'request_id', None) is None:
+            record.request_id = REQUEST_ID.get()
+        if getattr(record, 'purpose', None) is None:
+            record.purpose = REQUEST_PURPOSE.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per message: past the burst only one in sample_every gets through
+
+    A record that gets through after others were dropped carries the number
+    dropped in its suppressed field.
+    """
+
+    def __init__(self, rate=5.0, burst=20, sample_every=100, max_keys=1024):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.sample_every = sample_every
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg, getattr(record, 'dal_method', None))
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._buckets.clear()
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                allow = True
+            else:
+                bucket[0] = tokens
+                bucket[2] += 1
+                allow = bucket[2] % self.sample_every == 0
+            if allow and bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return allow
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Keep the raw fields for the JSON formatter, but resolve everything
+        # that isn't safe to hand to another thread
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogPipeline:
+    """Queue handler for the request path plus the thread that writes JSON lines"""
+
+    def __init__(self, stream=None, level=logging.INFO, queue_size=10000,
+                 rate=5.0, burst=20, sample_every=100):
+        self.queue_size = queue_size
+        self.handler = DroppingQueueHandler(queue.Queue(queue_size))
+        self.handler.setLevel(level)
+        self.handler.addFilter(RateLimitFilter(rate, burst, sample_every))
+        self.handler.addFilter(RequestIdFilter())
+        self.output = logging.StreamHandler(stream or sys.stderr)
+        self.output.setFormatter(JsonFormatter())
+        self.listener = None
+
+    def install(self, *logger_names):
+        """Send the named loggers through the pipeline and start the writer thread"""
+        for name in logger_names:
+            logger = logging.getLogger(name)
+            if self.handler not in logger.handlers:
+                logger.addHandler(self.handler)
+            if logger.level == logging.NOTSET or logger.level > self.handler.level:
+                logger.setLevel(self.handler.level)
+        self.start()
+
+    def start(self):
+        if self.listener is None:
+            self.listener = QueueListener(self.handler.queue, self.output)
+            self.listener.start()
+
+    def stop(self):
+        """Write out queued records and stop the writer thread"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def reset_after_fork(self):
+        """Threads don't survive fork, so a forked worker needs a new queue and writer"""
+        self.listener = None
+        self.handler.queue = queue.Queue(self.queue_size)
+        self.start()
@@ -0,0 +1,116 @@
+"""
+Project tags
+Tag name normalization and an in-memory inverted index (tag -> set of project
+ids) that answers /projects?tag=... filters and facet counts with set
+intersections instead of a query per request
+"""
+
+import re
+import threading
+
+MAX_TAG_LENGTH = 40
+MAX_TAGS_PER_PROJECT = 20
+
+
+def normalize_tag(name):
+    """Lower-case name with runs of whitespace made single spaces; '' if nothing is left"""
+    return ' '.join(str(name).lower().split())[:MAX_TAG_LENGTH].strip()
+
+
+def parse_tags(text):
+    """Distinct normalized tags from comma-separated text, in the order given"""
+    tags = []
+    for name in re.split(r'[,;]', text or ''):
+        tag = normalize_tag(name)
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags[:MAX_TAGS_PER_PROJECT]
+
+
+class TagIndex:
+    """Posting sets per tag, loaded from project_tags and dropped on tag writes
+
+    The whole index is rebuilt from one query the first time it's needed after
+    a project's tags change or a project is deleted. The DAL's tags version is
+    checked on every lookup, so changes made by other worker processes trigger
+    the rebuild too.
+    """
+
+    def __init__(self):
+        self._postings = None
+        # Tags version of the database the postings were loaded at
+        self._version = None
+        # Bumped by every invalidation, so a load that raced a write isn't kept
+        self._generation = 0
+        self._dal = None
+        self._lock = threading.Lock()
+
+    def _bind(self, dal):
+        """Follow the DAL in use, dropping postings that belong to another database"""
+        if dal is self._dal:
+            return
+        if self._dal is not None:
+            self._dal.remove_write_listener(self.on_write)
+        self._postings = None
+        self._generation += 1
+        self._dal = dal
+        dal.add_write_listener(self.on_write)
+
+    def postings(self, dal):
+        """tag -> frozenset of project ids, for every tag in use"""
+        version = dal.get_tags_version()
+        with self._lock:
+            self._bind(dal)
+            if self._version != version:
+                self._postings = None
+                self._generation += 1
+            postings = self._postings
+            generation = self._generation
+        if postings is not None:
+            return postings
+
+        loaded = {}
+        for tag, project_ids in dal.get_tag_postings().items():
+            loaded[tag] = frozenset(project_ids)
+        with self._lock:
+            if self._generation == generation:
+                self._postings = loaded
+                self._version = version
+        return loaded
+
+    def select(self, dal, tags):
+        """Ids of the projects carrying every tag in tags, or None if tags is empty
+
+        Sets are intersected smallest first, so the cost follows the rarest tag.
+        """
+        if not tags:
+            return None
+        postings = self.postings(dal)
+        sets = sorted((postings.get(tag, frozenset()) for tag in tags), key=len)
+        return sets[0].intersection(*sets[1:])
+
+    def facets(self, dal, selected=None):
+        """(tag, count) pairs for every tag, most projects first
+
+        With selected (a set of project ids, as returned by select) each count
+        is the number of selected projects that also carry the tag, i.e. how
+        many projects adding that tag to the filter would leave.
+        """
+        counts = []
+        for tag, project_ids in self.postings(dal).items():
+            # Set intersection walks the smaller of the two sets
+            count = len(project_ids) if selected is None else len(project_ids.intersection(selected))
+            if count:
+                counts.append((tag, count))
+        counts.sort(key=lambda pair: (-pair[1], pair[0]))
+        return counts
+
+    def on_write(self, action, project_id):
+        """DAL write listener: only tag changes and deletions change the postings"""
+        if action in ('tags', 'delete'):
+            self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._postings = None
+            self._generation += 1
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Load test for multi-tenant hosting
+Creates many tenants in a scratch directory, then drives the app in-process
+with concurrent clients that each pick a random tenant per request, and
+reports throughput, latency, open tenants, RSS and open file descriptors
+
+    python tenant_loadtest.py --tenants 10000 --requests 20000 --clients 8
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+PATHS = ['/', '/projects', '/projects/1', '/api/projects/changes']
+
+
+def rss_mb():
+    """Resident set size of this process in MB (Linux)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def open_fds():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return 0
+
+
+def create_tenants(root, count):
+    """Create count tenants from one template database holding a few projects"""
+    from DAL import DatabaseAccessLayer
+    from tenants import TenantRegistry
+
+    template = os.path.join(root, 'template.db')
+    template_dal = DatabaseAccessLayer(template)
+    for n in range(3):
+        template_dal.add_project(f"Project {n + 1}", "Seeded for the tenant load test", "image.jpg")
+
+    registry = TenantRegistry(os.path.join(root, 'tenants'))
+    for n in range(count):
+        registry.create(f"tenant{n}", owner=f"Tenant {n}", template=template)
+    return registry.root
+
+
+def run_load(client, tenants, requests, clients):
+    """Send requests spread over clients threads; return (latencies, errors)"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    per_client = requests // clients
+
+    def worker(seed):
+        rng = random.Random(seed)
+        local = []
+        failed = 0
+        for _ in range(per_client):
+            url = f"/t/tenant{rng.randrange(tenants)}{rng.choice(PATHS)}"
+            start = time.perf_counter()
+            response = client.get(url)
+            local.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test many tenants in one process")
+    parser.add_argument('--tenants', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--max-open', type=int, default=256, help="MAX_OPEN_TENANTS")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='tenant-load-')
+    try:
+        start = time.perf_counter()
+        tenants_root = create_tenants(root, args.tenants)
+        print(f"Created {args.tenants} tenants in {time.perf_counter() - start:.1f}s")
+
+        os.environ['TENANTS_ROOT'] = tenants_root
+        os.environ['MAX_OPEN_TENANTS'] = str(args.max_open)
+        from app import app, tenant_registry
+        app.config['RATELIMIT_ENABLED'] = False
+        client = app.test_client()
+
+        peak = {'rss': rss_mb(), 'fds': open_fds()}
+        baseline = dict(peak)
+        done = threading.Event()
+
+        def monitor():
+            while not done.wait(0.2):
+                peak['rss'] = max(peak['rss'], rss_mb())
+                peak['fds'] = max(peak['fds'], open_fds())
+
+        watcher = threading.Thread(target=monitor, daemon=True)
+        watcher.start()
+        start = time.perf_counter()
+        latencies, errors = run_load(client, args.tenants, args.requests, args.clients)
+        elapsed = time.perf_counter() - start
+        done.set()
+        watcher.join()
+
+        latencies.sort()
+        count = len(latencies)
+        print(f"{count} requests over {args.tenants} tenants in {elapsed:.1f}s "
+              f"({count / elapsed:.0f} req/s, {errors} errors)")
+        print(f"  latency p50 {latencies[count // 2] * 1000:.1f} ms, "
+              f"p99 {latencies[int(count * 0.99)] * 1000:.1f} ms")
+        print(f"  open tenants {len(tenant_registry)} (max {args.max_open}), "
+              f"opened {tenant_registry.opened}, evicted {tenant_registry.evicted}")
+        print(f"  RSS {baseline['rss']:.0f} -> peak {peak['rss']:.0f} MB, "
+              f"open fds {baseline['fds']} -> peak {peak['fds']}")
+        return 1 if errors else 0
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Multi-tenant hosting
+Serves many portfolios from one process. Requests are routed to a tenant by
+Host (<tenant>.<TENANT_BASE_DOMAIN>) or path prefix (/t/<tenant>/...), and each
+tenant has its own directory with a database, settings and content overrides:
+
+    tenants/<name>/projects.db
+    tenants/<name>/tenant.json          {"owner": "Display Name"}
+    tenants/<name>/templates/base.html  replaces BASE_TEMPLATE
+    tenants/<name>/templates/<endpoint>.html  replaces a page's content
+
+    python tenants.py create alice --owner "Alice Example"
+    python tenants.py list
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from DAL import DatabaseAccessLayer
+from change_feed import ChangeNotifier
+from feeds import FeedCache
+from project_cache import ProjectDetailCache
+from tags import TagIndex
+
+# WSGI environ key holding the Tenant of the request
+ENVIRON_KEY = 'portfolio.tenant'
+PATH_PREFIX = '/t/'
+# DNS label rules, which also keeps names safe as directory names
+TENANT_NAME_RE = re.compile(r'^[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?$')
+
+
+class Tenant:
+    """One hosted portfolio: its database, caches and content overrides"""
+
+    def __init__(self, name, directory, project_cache_entries=32):
+        self.name = name
+        self.directory = directory
+        # The main site's static/images aren't the tenant's: its catalog holds only its uploads
+        self.dal = DatabaseAccessLayer(os.path.join(directory, 'projects.db'), images_dir=None)
+        # Small per-tenant caches keep the total bounded by the registry size
+        self.project_cache = ProjectDetailCache(max_entries=project_cache_entries)
+        self.tag_index = TagIndex()
+        self.change_notifier = ChangeNotifier()
+        self.settings = self._load_settings()
+        self.feed_cache = FeedCache(title=f"{self.owner} - Projects")
+        self._templates = {}
+        self.last_used = time.monotonic()
+
+    def _load_settings(self):
+        try:
+            with open(os.path.join(self.directory, 'tenant.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @property
+    def owner(self):
+        return self.settings.get('owner', self.name)
+
+    def template(self, name):
+        """Text of templates/<name>.html, or None if the tenant doesn't override it"""
+        if name not in self._templates:
+            try:
+                with open(os.path.join(self.directory, 'templates', f"{name}.html")) as f:
+                    self._templates[name] = f.read()
+            except OSError:
+                self._templates[name] = None
+        return self._templates[name]
+
+    def close(self):
+        """Release the tenant's database and caches"""
+        self.project_cache.clear()
+        self.tag_index.clear()
+        self.feed_cache.clear()
+        self.dal.close()
+
+
+class TenantRegistry:
+    """LRU of open tenants, bounded in count and evicting tenants left idle
+
+    A tenant is opened on first use, so memory and file descriptors grow with
+    max_open rather than with the number of tenants on disk.
+    """
+
+    def __init__(self, root="tenants", max_open=256, idle_seconds=300):
+        self.root = root
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self.opened = 0
+        self.evicted = 0
+
+    def path_for(self, name):
+        return os.path.join(self.root, name)
+
+    def exists(self, name):
+        return bool(TENANT_NAME_RE.match(name)) and os.path.isdir(self.path_for(name))
+
+    def create(self, name, owner=None, template=None):
+        """Create a tenant directory and database; template is an initialized database to copy"""
+        if not TENANT_NAME_RE.match(name):
+            raise ValueError(f"Invalid tenant name: {name!r}")
+        directory = self.path_for(name)
+        os.makedirs(os.path.join(directory, 'templates'), exist_ok=True)
+        DatabaseAccessLayer(os.path.join(directory, 'projects.db'), template=template)
+        with open(os.path.join(directory, 'tenant.json'), 'w') as f:
+            json.dump({'owner': owner or name}, f, indent=2)
+
+    def names(self):
+        """Names of all tenants on disk"""
+        try:
+            return sorted(name for name in os.listdir(self.root) if self.exists(name))
+        except OSError:
+            return []
+
+    def get(self, name):
+        """The open Tenant called name, opening it if needed; None if it doesn't exist"""
+        now = time.monotonic()
+        with self._lock:
+            tenant = self._open.get(name)
+            if tenant is not None:
+                self._open.move_to_end(name)
+                tenant.last_used = now
+            if now - self._last_sweep > self.idle_seconds / 4:
+                self._last_sweep = now
+                self._evict_idle(now)
+        if tenant is not None:
+            return tenant
+
+        if not self.exists(name):
+            return None
+        tenant = Tenant(name, self.path_for(name))
+        with self._lock:
+            # Another thread may have opened it meanwhile; keep the first one
+            existing = self._open.get(name)
+            if existing is not None:
+                tenant.close()
+                return existing
+            self._open[name] = tenant
+            self.opened += 1
+            while len(self._open) > self.max_open:
+                _, oldest = self._open.popitem(last=False)
+                oldest.close()
+                self.evicted += 1
+        return tenant
+
+    def _evict_idle(self, now):
+        idle = [name for name, tenant in self._open.items()
+                if now - tenant.last_used > self.idle_seconds]
+        for name in idle:
+            self._open.pop(name).close()
+            self.evicted += 1
+
+    def evict_idle(self):
+        """Close tenants unused for idle_seconds"""
+        with self._lock:
+            self._evict_idle(time.monotonic())
+
+    def clear(self):
+        """Close every open tenant"""
+        with self._lock:
+            for tenant in self._open.values():
+                tenant.close()
+            self._open.clear()
+
+    def __contains__(self, name):
+        return name in self._open
+
+    def __len__(self):
+        return len(self._open)
+
+
+class TenantMiddleware:
+    """WSGI middleware that attaches the request's Tenant to the environ
+
+    Requests for the main site pass through untouched. With a path prefix the
+    prefix moves to SCRIPT_NAME, so views and url_for see tenant-relative paths.
+    Unknown tenants get 404 before the app runs.
+    """
+
+    def __init__(self, wsgi_app, registry, base_domain=None):
+        self.wsgi_app = wsgi_app
+        self.registry = registry
+        self.base_domain = base_domain.lower().lstrip('.') if base_domain else None
+
+    def resolve(self, environ):
+        """(tenant name, path prefix) for a request, or (None, '') for the main site"""
+        if self.base_domain:
+            host = environ.get('HTTP_HOST', '').split(':')[0].lower()
+            if host.endswith('.' + self.base_domain):
+                return host[:-len(self.base_domain) - 1], ''
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(PATH_PREFIX):
+            name = path[len(PATH_PREFIX):].split('/', 1)[0]
+            return name, PATH_PREFIX + name
+        return None, ''
+
+    def __call__(self, environ, start_response):
+        name, prefix = self.resolve(environ)
+        if name is None:
+            return self.wsgi_app(environ, start_response)
+
+        tenant = self.registry.get(name) if TENANT_NAME_RE.match(name) else None
+        if tenant is None:
+            body = b'Portfolio not found'
+            start_response('404 NOT FOUND', [('Content-Type', 'text/plain; charset=utf-8'),
+                                             ('Content-Length', str(len(body)))])
+            return [body]
+
+        environ[ENVIRON_KEY] = tenant
+        if prefix:
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + prefix
+            environ['PATH_INFO'] = environ['PATH_INFO'][len(prefix):] or '/'
+        return self.wsgi_app(environ, start_response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage hosted portfolios")
+    parser.add_argument('--root', default=os.environ.get('TENANTS_ROOT', 'tenants'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    create_parser = commands.add_parser('create', help="create a tenant")
+    create_parser.add_argument('name')
+    create_parser.add_argument('--owner', help="name shown on the portfolio")
+    commands.add_parser('list', help="list tenants")
+    args = parser.parse_args()
+
+    registry = TenantRegistry(args.root)
+    if args.command == 'create':
+        try:
+            registry.create(args.name, owner=args.owner)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return 1
+        print(f"Created {registry.path_for(args.name)}")
+    else:
+        for name in registry.names():
+            print(name)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,11 +7,11 @@ import pytest
 import tempfile
 import os
 import sys
-from DAL import DatabaseAccessLayer
+from testdb import make_test_dal
 
 # Import app after setting up the path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from app import app, dal
+from app import app
 
 
 class TestFlaskApp:
@@ -19,12 +19,8 @@ class TestFlaskApp:
     
     def setup_method(self):
         """Set up test client and temporary database"""
-        # Create temporary database
-        self.test_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
-        self.test_db.close()
-        
-        # Create test DAL instance
-        self.test_dal = DatabaseAccessLayer(self.test_db.name)
+        # Create test DAL instance on an in-memory copy of the template database
+        self.test_dal = make_test_dal()
         
         # Configure app for testing
         app.config['TESTING'] = True
@@ -34,12 +30,15 @@ class TestFlaskApp:
         import app as app_module
         app_module.dal = self.test_dal
         
+        # Start every test with fresh rate-limit buckets
+        app_module.write_admission.reset()
+        app_module.contact_filter.clear()
+        
         self.client = app.test_client()
     
     def teardown_method(self):
         """Clean up after each test"""
-        if os.path.exists(self.test_db.name):
-            os.unlink(self.test_db.name)
+        self.test_dal.close()
     
     def test_home_page(self):
         """Test that home page loads successfully"""
@@ -183,6 +182,1010 @@ class TestFlaskApp:
         assert b'href="/projects"' in response.data
         assert b'href="/contact"' in response.data
 
+    def test_form_markup_cached_between_requests(self):
+        """Test that pristine form pages reuse the cached markup"""
+        from app import form_cache
+        form_cache.clear()
+        
+        first = self.client.get('/contact')
+        second = self.client.get('/contact')
+        assert first.data == second.data
+        assert len(form_cache) == 1
+    
+    def test_cached_form_includes_csrf_token(self):
+        """Test that each request gets its own CSRF token spliced in"""
+        from app import form_cache
+        form_cache.clear()
+        app.config['WTF_CSRF_ENABLED'] = True
+        try:
+            first = app.test_client().get('/add-project')
+            second = app.test_client().get('/add-project')
+        finally:
+            app.config['WTF_CSRF_ENABLED'] = False
+        
+        assert b'name="csrf_token"' in first.data
+        assert b'name="csrf_token"' in second.data
+        assert first.data != second.data
+        assert b'test-project.jpg' in first.data
+    
+    def test_submitted_form_keeps_user_values(self):
+        """Test that a failed submission is rendered with the submitted values"""
+        response = self.client.post('/contact', data={
+            'first_name': 'Jane',
+            'last_name': 'Doe',
+            'email': 'invalid-email',
+            'message': 'Short'
+        })
+        assert response.status_code == 200
+        assert b'value="Jane"' in response.data
+        
+        response = self.client.get('/contact')
+        assert b'value="Jane"' not in response.data
+
+    def test_anonymous_get_is_publicly_cacheable(self):
+        """Test that cookie-less GETs skip the session and allow shared caching"""
+        response = self.client.get('/about')
+        assert response.status_code == 200
+        assert 'public' in response.headers['Cache-Control']
+        assert 'Cookie' not in response.headers.get('Vary', '')
+        assert 'Set-Cookie' not in response.headers
+        assert 'X-Page-Cache-Store' not in response.headers
+        
+        # JSON APIs aren't given the shared-cache policy; the change feed is never stored
+        assert 'public' not in self.client.get('/stats').headers.get('Cache-Control', '')
+        assert 'public' not in self.client.get('/search?q=x').headers.get('Cache-Control', '')
+        assert 'no-store' in self.client.get('/api/projects/changes').headers['Cache-Control']
+    
+    def test_anonymous_page_served_from_cache(self):
+        """Test that static pages are answered from the page cache"""
+        from app import page_cache
+        page_cache.clear()
+        
+        first = self.client.get('/resume')
+        assert len(page_cache) == 1
+        second = self.client.get('/resume')
+        assert first.data == second.data
+        assert second.headers['Cache-Control'] == first.headers['Cache-Control']
+    
+    def test_session_cookie_bypasses_page_cache(self):
+        """Test that flashed messages are still shown to visitors with a session"""
+        self.client.get('/')
+        self.client.post('/contact', data={
+            'first_name': 'Cache',
+            'last_name': 'Bypass',
+            'email': 'cache@example.com',
+            'message': 'Checking that flashes survive the page cache.'
+        })
+        response = self.client.get('/')
+        assert b'Thank you for your message!' in response.data
+        assert 'public' not in response.headers.get('Cache-Control', '')
+    
+    def test_server_side_session_store(self):
+        """Test that the SQLite session backend keeps data out of the cookie"""
+        from sessions import SqliteSessionInterface
+        sessions_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
+        sessions_db.close()
+        original = app.session_interface
+        app.session_interface = SqliteSessionInterface(sessions_db.name)
+        try:
+            client = app.test_client()
+            response = client.post('/contact', data={
+                'first_name': 'Server',
+                'last_name': 'Side',
+                'email': 'server@example.com',
+                'message': 'Stored in the server-side session table.'
+            })
+            cookie = response.headers['Set-Cookie']
+            assert 'Stored in' not in cookie
+            assert len(cookie.split(';')[0]) < 120
+            
+            response = client.get('/thank-you')
+            assert b'Thank you for your message!' in response.data
+        finally:
+            app.session_interface = original
+            os.unlink(sessions_db.name)
+
+    def test_write_rate_limit_per_ip(self):
+        """Test that a burst of submissions from one client gets 429 with Retry-After"""
+        from app import write_admission
+        app.config['RATELIMIT_PER_IP'] = (0.01, 2)
+        try:
+            data = {'first_name': 'Rate', 'last_name': 'Limit',
+                    'email': 'rate@example.com', 'message': 'Rate limited message body.'}
+            statuses = [self.client.post('/contact', data=data).status_code for _ in range(3)]
+            assert statuses[:2] == [302, 302]
+            assert statuses[2] == 429
+            
+            response = self.client.post('/contact', data=data)
+            assert int(response.headers['Retry-After']) > 0
+            
+            # Rendering the form is never limited
+            assert self.client.get('/contact').status_code == 200
+        finally:
+            app.config['RATELIMIT_PER_IP'] = (0.2, 20)
+            write_admission.reset()
+    
+    def test_write_rate_limit_shared_store(self):
+        """Test that the SQLite bucket store enforces the global budget"""
+        from app import write_admission
+        store_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
+        store_db.close()
+        app.config['RATELIMIT_STORAGE'] = store_db.name
+        app.config['RATELIMIT_GLOBAL'] = (0.01, 1)
+        try:
+            data = {'title': 'Limited Project', 'description': 'A project behind the global limit.',
+                    'image_filename': 'test-project.jpg'}
+            assert self.client.post('/add-project', data=data).status_code == 302
+            response = self.client.post('/add-project', data=data)
+            assert response.status_code == 503
+            assert 'Retry-After' in response.headers
+        finally:
+            app.config['RATELIMIT_STORAGE'] = None
+            app.config['RATELIMIT_GLOBAL'] = (10.0, 100)
+            write_admission.reset()
+            os.unlink(store_db.name)
+    
+    def test_write_rate_limit_survives_worker_fork(self):
+        """Test that a post-fork reset leaves the shared SQLite buckets alone"""
+        from app import write_admission, reset_process_state
+        store_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
+        store_db.close()
+        app.config['RATELIMIT_STORAGE'] = store_db.name
+        app.config['RATELIMIT_GLOBAL'] = (0.01, 1)
+        try:
+            data = {'title': 'Limited Project', 'description': 'A project behind the global limit.',
+                    'image_filename': 'test-project.jpg'}
+            assert self.client.post('/add-project', data=data).status_code == 302
+            reset_process_state()
+            assert self.client.post('/add-project', data=data).status_code == 503
+        finally:
+            app.config['RATELIMIT_STORAGE'] = None
+            app.config['RATELIMIT_GLOBAL'] = (10.0, 100)
+            write_admission.reset()
+            os.unlink(store_db.name)
+    
+    def test_rate_limit_buckets_expire_and_busy_store_sheds(self):
+        """Test that refilled buckets are dropped and a locked shared store answers 503"""
+        import sqlite3
+        import time
+        from admission import MemoryBucketStore, SqliteBucketStore
+        from werkzeug.exceptions import ServiceUnavailable
+        store_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
+        store_db.close()
+        try:
+            for store in (MemoryBucketStore(sweep_interval=0), SqliteBucketStore(store_db.name, sweep_interval=0)):
+                # Full again after a millisecond, while the other stays drained for hours
+                assert store.take('ip:fast', 1000.0, 5) == 0
+                assert store.take('ip:slow', 0.0001, 1) == 0
+                time.sleep(0.01)
+                store.take('global', 0.0001, 5)
+                assert len(store) == 2
+            
+            conn = sqlite3.connect(store_db.name)
+            conn.execute('BEGIN EXCLUSIVE')
+            try:
+                with pytest.raises(ServiceUnavailable) as info:
+                    store.take('ip:slow', 0.0001, 1)
+                assert info.value.retry_after == 1
+            finally:
+                conn.rollback()
+                conn.close()
+        finally:
+            os.unlink(store_db.name)
+    
+    def test_write_latency_shedding(self):
+        """Test that writes are shed while DB write latency is far over target"""
+        from app import write_admission
+        write_admission.record_write_latency(100.0)
+        try:
+            response = self.client.post('/add-project', data={
+                'title': 'Shed Project',
+                'description': 'Should be shed under high latency.',
+                'image_filename': 'test-project.jpg'
+            })
+            assert response.status_code == 503
+            assert 'Retry-After' in response.headers
+        finally:
+            write_admission.reset()
+
+    def test_project_detail_page(self):
+        """Test the project detail page and its pager links"""
+        older_id = self.test_dal.add_project("Older Project", "The older of the two", "test.jpg")
+        newer_id = self.test_dal.add_project("Newer Project", "The newer of the two", "test.jpg")
+        
+        response = self.client.get(f'/projects/{older_id}')
+        assert response.status_code == 200
+        assert b'Older Project' in response.data
+        assert f'href="/projects/{newer_id}"'.encode() in response.data
+        
+        response = self.client.get('/projects')
+        assert f'href="/projects/{newer_id}"'.encode() in response.data
+    
+    def test_project_detail_not_found(self):
+        """Test that unknown project ids return 404"""
+        response = self.client.get('/projects/9999')
+        assert response.status_code == 404
+    
+    def test_project_detail_prefetches_neighbours(self):
+        """Test that neighbours are cached so pager navigation skips the database"""
+        from app import project_cache
+        ids = [self.test_dal.add_project(f"Pager {i}", f"Pager description {i}", "test.jpg") for i in range(4)]
+        
+        self.client.get(f'/projects/{ids[1]}')
+        assert ids[0] in project_cache
+        assert ids[2] in project_cache
+        
+        misses = project_cache.misses
+        assert self.client.get(f'/projects/{ids[2]}').status_code == 200
+        assert project_cache.misses == misses
+    
+    def test_project_detail_invalidated_by_writes(self):
+        """Test that updates and deletes are visible on the detail page"""
+        project_id = self.test_dal.add_project("Before Update", "Original description", "test.jpg")
+        assert b'Before Update' in self.client.get(f'/projects/{project_id}').data
+        
+        self.test_dal.update_project(project_id, "After Update", "Original description", "test.jpg")
+        assert b'After Update' in self.client.get(f'/projects/{project_id}').data
+        
+        self.test_dal.delete_project(project_id)
+        assert self.client.get(f'/projects/{project_id}').status_code == 404
+    
+    def test_project_detail_sees_other_workers_writes(self):
+        """Test that the detail cache follows the change log, not just local listeners"""
+        from app import project_cache
+        project_id = self.test_dal.add_project("Before Update", "Original description", "test.jpg")
+        assert b'Before Update' in self.client.get(f'/projects/{project_id}').data
+        
+        # Writes from another worker never reach this process's listeners
+        self.test_dal.remove_write_listener(project_cache.on_write)
+        project_cache.sync_interval = 0
+        try:
+            self.test_dal.update_project(project_id, "After Update", "Original description", "test.jpg")
+            assert b'After Update' in self.client.get(f'/projects/{project_id}').data
+            
+            newer_id = self.test_dal.add_project("Newer Project", "Added elsewhere", "test.jpg")
+            assert f'/projects/{newer_id}'.encode() in self.client.get(f'/projects/{project_id}').data
+            
+            self.test_dal.set_project_tags(project_id, ["retagged"])
+            assert b'>retagged</a>' in self.client.get(f'/projects/{project_id}').data
+        finally:
+            project_cache.sync_interval = 1.0
+    
+    def test_project_detail_hits_skip_the_database(self):
+        """Test cached detail pages check the change log at most once per interval and carry their tags"""
+        project_id = self.test_dal.add_project("Tagged", "Project with tags", "test.jpg")
+        self.test_dal.set_project_tags(project_id, ["python"])
+        assert b'>python</a>' in self.client.get(f'/projects/{project_id}').data
+        
+        calls = []
+        for name in ('get_cache_versions', 'get_project_tags', 'get_image_metadata'):
+            method = getattr(self.test_dal, name)
+            setattr(self.test_dal, name, lambda *args, name=name, method=method: calls.append(name) or method(*args))
+        try:
+            for _ in range(3):
+                assert b'>python</a>' in self.client.get(f'/projects/{project_id}').data
+        finally:
+            for name in ('get_cache_versions', 'get_project_tags', 'get_image_metadata'):
+                delattr(self.test_dal, name)
+        assert 'get_project_tags' not in calls and 'get_image_metadata' not in calls
+        assert calls.count('get_cache_versions') <= 1
+        
+        # A local write makes the next lookup check again
+        self.test_dal.set_project_tags(project_id, ["flask"])
+        assert b'>flask</a>' in self.client.get(f'/projects/{project_id}').data
+
+    def _use_temporary_asset_store(self):
+        import app as app_module
+        from assets import AssetStore
+        self.asset_root = tempfile.mkdtemp()
+        original = app_module.asset_store
+        app_module.asset_store = AssetStore(os.path.join(self.asset_root, 'assets'), max_bytes=1024)
+        return original
+    
+    def _restore_asset_store(self, original):
+        import shutil
+        import app as app_module
+        app_module.asset_store = original
+        shutil.rmtree(self.asset_root)
+    
+    def test_upload_asset_deduplicates(self):
+        """Test that identical uploads are stored once and registered as assets"""
+        from io import BytesIO
+        original = self._use_temporary_asset_store()
+        png = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+        try:
+            first = self.client.post('/assets', data={'file': (BytesIO(png), 'diagram.png')},
+                                     content_type='multipart/form-data')
+            assert first.status_code == 201
+            asset = first.get_json()['assets'][0]
+            assert asset['deduplicated'] is False
+            assert asset['filename'].startswith('assets/' + asset['sha256'][:2] + '/')
+            assert os.path.exists(os.path.join(self.asset_root, asset['filename']))
+            
+            second = self.client.post('/assets', data={'file': (BytesIO(png), 'copy.png')},
+                                      content_type='multipart/form-data')
+            assert second.get_json()['assets'][0]['deduplicated'] is True
+            stored = [files for _, _, files in os.walk(self.asset_root) if files]
+            assert stored == [[asset['sha256'] + '.png']]
+            
+            # The upload becomes selectable on the project form
+            response = self.client.get('/add-project')
+            assert asset['filename'].encode() in response.data
+        finally:
+            self._restore_asset_store(original)
+    
+    def test_upload_asset_limits(self):
+        """Test that disallowed, mislabelled and oversized uploads are rejected"""
+        import hashlib
+        from io import BytesIO
+        original = self._use_temporary_asset_store()
+        try:
+            response = self.client.post('/assets', data={'file': (BytesIO(b'hello world!'), 'notes.txt')},
+                                        content_type='multipart/form-data')
+            assert response.status_code == 415
+            
+            response = self.client.post('/assets', data={'file': (BytesIO(b'not really a png'), 'fake.png')},
+                                        content_type='multipart/form-data')
+            assert response.status_code == 415
+            
+            big = b'%PDF-' + b'0' * 2048
+            response = self.client.post('/assets', data={'file': (BytesIO(big), 'big.pdf')},
+                                        content_type='multipart/form-data')
+            assert response.status_code == 413
+            
+            # Rejected uploads leave no files behind
+            assert [files for _, _, files in os.walk(self.asset_root) if files] == []
+            
+            # ... including the valid parts that came before a rejected one
+            png = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+            response = self.client.post('/assets', data={'file': [(BytesIO(png), 'good.png'),
+                                                                  (BytesIO(b'hello world!'), 'bad.txt')]},
+                                        content_type='multipart/form-data')
+            assert response.status_code == 415
+            assert [files for _, _, files in os.walk(self.asset_root) if files] == []
+            assert self.test_dal.get_asset_by_hash(hashlib.sha256(png).hexdigest()) is None
+        finally:
+            self._restore_asset_store(original)
+    
+    def test_upload_asset_needs_session_token_or_admin_token(self):
+        """Test that /assets takes the session's CSRF token or ADMIN_TOKEN, like the other writes"""
+        import re
+        from io import BytesIO
+        original = self._use_temporary_asset_store()
+        png = b'\x89PNG\r\n\x1a\n' + b'\x01' * 64
+        admin_token = app.config['ADMIN_TOKEN']
+        app.config['WTF_CSRF_ENABLED'] = True
+        app.config['ADMIN_TOKEN'] = 'uploader-secret'
+        try:
+            def upload(headers):
+                return self.client.post('/assets', data={'file': (BytesIO(png), 'diagram.png')},
+                                        content_type='multipart/form-data', headers=headers)
+            assert upload({}).status_code == 403
+            assert upload({'Authorization': 'Bearer wrong'}).status_code == 403
+            assert upload({'Authorization': 'Bearer uploader-secret'}).status_code == 201
+            
+            page = self.client.get('/add-project').get_data(as_text=True)
+            token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
+            assert upload({'X-CSRFToken': token}).status_code == 201
+        finally:
+            app.config['WTF_CSRF_ENABLED'] = False
+            app.config['ADMIN_TOKEN'] = admin_token
+            self._restore_asset_store(original)
+
+    def test_search_pdf_pages(self):
+        """Test that indexed PDF pages are searchable and link to the right page"""
+        pytest.importorskip('pypdf')
+        import app as app_module
+        from pdf_index import PdfIndex
+        index_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
+        index_db.close()
+        original = app_module.pdf_index
+        app_module.pdf_index = PdfIndex(index_db.name)
+        try:
+            resume = 'static/Siddique_Saad_Resume.pdf'
+            assert app_module.pdf_index.build([resume], workers=1) == [resume]
+            # Unchanged files are not extracted again
+            assert app_module.pdf_index.build([resume], workers=1) == []
+            
+            response = self.client.get('/search?q=education')
+            hits = response.get_json()['hits']
+            assert hits[0]['document'] == 'Siddique_Saad_Resume.pdf'
+            assert hits[0]['url'] == '/static/Siddique_Saad_Resume.pdf#page=1'
+            assert '<mark>' in hits[0]['snippet'].lower()
+            
+            # FTS syntax in the query is treated as plain text
+            assert self.client.get('/search?q=%22OR(').status_code == 200
+            assert self.client.get('/search?q=').get_json()['hits'] == []
+            
+            # limit is clamped to 1..100; SQLite would read LIMIT -1 as no limit
+            for limit in (-1, 0, 1):
+                assert len(self.client.get(f'/search?q=education&limit={limit}').get_json()['hits']) == 1
+        finally:
+            app_module.pdf_index = original
+            os.unlink(index_db.name)
+
+    def test_critical_css_extraction(self):
+        """Test that only rules used above the fold are kept"""
+        from critical_css import extract_critical_css
+        css = """
+            /* comment */
+            .hero { color: red; }
+            .footer { color: blue; }
+            .hero a:hover { color: green; }
+            h1, h6 { margin: 0; }
+            @media (max-width: 768px) { .hero { padding: 0; } .footer { padding: 0; } }
+            @media print { .hero { display: none; } }
+        """
+        html = '<main><section class="hero"><h1>Hi</h1></section><footer class="footer"></footer></main>'
+        critical = extract_critical_css(css, html)
+        assert '.hero{color: red;}' in critical
+        assert 'h1{margin: 0;}' in critical
+        assert '@media (max-width: 768px){.hero{padding: 0;}}' in critical
+        assert '.footer' not in critical
+        assert 'hover' not in critical
+        assert 'print' not in critical
+    
+    def test_critical_css_inlined(self):
+        """Test that pages inline their critical CSS and load style.css asynchronously"""
+        response = self.client.get('/about')
+        assert b'<style>' in response.data
+        assert b'rel="preload" href="/static/css/style.css" as="style"' in response.data
+        assert b'<noscript><link rel="stylesheet" href="/static/css/style.css"></noscript>' in response.data
+        assert '</static/css/style.css>; rel=preload; as=style' in response.headers['Link']
+    
+    def test_stale_critical_css_ignored(self):
+        """Test that critical CSS built from another style.css is not used"""
+        import shutil
+        from critical_css import FrontendAssets
+        static_dir = tempfile.mkdtemp()
+        try:
+            shutil.copytree('static/css', os.path.join(static_dir, 'css'))
+            assets = FrontendAssets(static_dir)
+            assert assets.critical_css('index')
+            
+            with open(os.path.join(static_dir, 'css', 'style.css'), 'a') as f:
+                f.write('.new-rule { color: red; }')
+            assets.reload()
+            assert assets.critical_css('index') is None
+        finally:
+            shutil.rmtree(static_dir)
+
+    
+    def test_project_changes_feed(self):
+        """Test incremental sync through the change feed"""
+        first = self.test_dal.add_project("Feed One", "First feed project", "image.jpg")
+        response = self.client.get('/api/projects/changes')
+        data = response.get_json()
+        assert [change['action'] for change in data['changes']] == ['add']
+        assert data['changes'][0]['project']['title'] == "Feed One"
+        since = data['next_since']
+        
+        self.test_dal.delete_project(first)
+        data = self.client.get(f'/api/projects/changes?since={since}').get_json()
+        assert [(change['project_id'], change['action'], change['project'])
+                for change in data['changes']] == [(first, 'delete', None)]
+        
+        data = self.client.get(f"/api/projects/changes?since={data['next_since']}").get_json()
+        assert data['changes'] == [] and data['has_more'] is False
+    
+    def test_project_changes_long_poll(self):
+        """Test that a waiting request returns as soon as a project is written"""
+        import threading
+        import time
+        import app as app_module
+        since = self.test_dal.get_latest_change_seq()
+        timer = threading.Timer(0.2, self.test_dal.add_project, ("Polled", "Long poll project", "image.jpg"))
+        timer.start()
+        start = time.monotonic()
+        data = self.client.get(f'/api/projects/changes?since={since}&wait=10').get_json()
+        timer.join()
+        assert time.monotonic() - start < 5
+        assert [change['action'] for change in data['changes']] == ['add']
+        assert app_module.change_notifier is not None
+    
+    def test_project_changes_resync_after_compaction(self):
+        """Test that a consumer behind compacted tombstones is told to resync"""
+        project_id = self.test_dal.add_project("Old", "Soon deleted project", "image.jpg")
+        since = self.test_dal.get_latest_change_seq()
+        self.test_dal.delete_project(project_id)
+        self.test_dal.add_project("New", "Newer feed project", "image.jpg")
+        self.test_dal.compact_changes(tombstone_max_age_days=-1)
+        
+        response = self.client.get(f'/api/projects/changes?since={since}')
+        assert response.status_code == 410
+        assert response.get_json()['error'] == 'resync'
+        data = self.client.get('/api/projects/changes?since=0').get_json()
+        assert [change['project']['title'] for change in data['changes']] == ["New"]
+
+    
+    def _with_tenants(self, test, **registry_options):
+        """Run test(registry) with a temporary tenants root routed by path and Host"""
+        import shutil
+        from tenants import TenantRegistry
+        root = tempfile.mkdtemp()
+        middleware = app.wsgi_app
+        saved = (middleware.registry, middleware.base_domain)
+        registry = TenantRegistry(root, **registry_options)
+        middleware.registry, middleware.base_domain = registry, 'portfolios.test'
+        try:
+            test(registry)
+        finally:
+            middleware.registry, middleware.base_domain = saved
+            registry.clear()
+            shutil.rmtree(root)
+    
+    def test_tenant_path_prefix(self):
+        """Test that /t/<tenant>/ serves the tenant's own projects and keeps links in the prefix"""
+        def test(registry):
+            registry.create('alice', owner="Alice Example")
+            registry.get('alice').dal.add_project("Alice Project", "Only in Alice's portfolio", "image.jpg")
+            self.test_dal.add_project("Main Project", "Only on the main site", "image.jpg")
+            
+            response = self.client.get('/t/alice/projects')
+            assert response.status_code == 200
+            assert b'Alice Project' in response.data
+            assert b'Main Project' not in response.data
+            assert b'<title>Projects - Alice Example</title>' in response.data
+            assert b'href="/t/alice/about"' in response.data
+            assert b'href="/static/css/style.css"' in response.data
+            
+            response = self.client.get('/projects')
+            assert b'Main Project' in response.data and b'Alice Project' not in response.data
+            assert self.client.get('/t/nobody/').status_code == 404
+            assert self.client.get('/t/../').status_code == 404
+        self._with_tenants(test)
+    
+    def test_tenant_host_routing_and_templates(self):
+        """Test Host-based routing and per-tenant content overrides"""
+        def test(registry):
+            registry.create('bob', owner="Bob Builder")
+            with open(os.path.join(registry.path_for('bob'), 'templates', 'about.html'), 'w') as f:
+                f.write('<section><h1>About Bob</h1></section>')
+            
+            response = self.client.get('/about', headers={'Host': 'bob.portfolios.test'})
+            assert b'About Bob' in response.data
+            assert b'Bob Builder' in response.data
+            assert b'About Bob' not in self.client.get('/about').data
+        self._with_tenants(test)
+    
+    def test_tenant_base_template_is_sandboxed(self):
+        """Test that a tenant's base.html sees only its own context, not the app's config"""
+        def test(registry):
+            registry.create('eve', owner="Eve Example")
+            base = os.path.join(registry.path_for('eve'), 'templates', 'base.html')
+            with open(base, 'w') as f:
+                f.write('<title>{{ title }}</title>[{{ config }}]{{ content }}')
+            response = self.client.get('/t/eve/about')
+            assert response.status_code == 200
+            assert b'<title>About Me - Eve Example</title>[]' in response.data
+            assert app.config['SECRET_KEY'].encode() not in response.data
+            
+            # Reaching for Python internals falls back to the default frame
+            with open(base, 'w') as f:
+                f.write("{{ ''.__class__.__mro__[1].__subclasses__() }}")
+            registry.get('eve')._templates.clear()
+            response = self.client.get('/t/eve/about')
+            assert response.status_code == 200
+            assert b'subclasses' not in response.data and b'Eve Example' in response.data
+        self._with_tenants(test)
+    
+    def test_tenant_registry_bounded(self):
+        """Test that open tenants are capped and idle ones are closed"""
+        def test(registry):
+            for name in ('t1', 't2', 't3'):
+                registry.create(name)
+            for name in ('t1', 't2', 't3'):
+                assert self.client.get(f'/t/{name}/projects').status_code == 200
+            assert len(registry) == 2
+            assert 't1' not in registry and registry.evicted == 1
+            
+            registry.idle_seconds = 0
+            registry.evict_idle()
+            assert len(registry) == 0
+        self._with_tenants(test, max_open=2)
+
+    
+    def test_request_id_header(self):
+        """Test that request ids are echoed back, generated when missing or malformed"""
+        response = self.client.get('/projects', headers={'X-Request-ID': 'abc-123'})
+        assert response.headers['X-Request-ID'] == 'abc-123'
+        generated = self.client.get('/projects', headers={'X-Request-ID': 'bad id!'}).headers['X-Request-ID']
+        assert len(generated) == 32 and generated != 'bad id!'
+    
+    def test_database_unavailable_returns_503(self):
+        """Test that a busy database makes views answer 503 with Retry-After"""
+        from DAL import DatabaseUnavailable
+        def locked():
+            raise DatabaseUnavailable("get_all_projects failed: database is locked")
+        self.test_dal.get_all_projects = locked
+        response = self.client.get('/projects')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+    
+    def test_structured_log_pipeline(self):
+        """Test JSON records from the background writer, with request ids and rate limiting"""
+        import io
+        import json
+        import logging
+        from structured_logging import LogPipeline, REQUEST_ID
+        stream = io.StringIO()
+        pipeline = LogPipeline(stream=stream, burst=3, rate=0.001, sample_every=5)
+        pipeline.install('portfolio.test-pipeline')
+        logger = logging.getLogger('portfolio.test-pipeline')
+        token = REQUEST_ID.set('req-1')
+        try:
+            for _ in range(13):
+                logger.error("Storm", extra={'dal_method': 'get_all_projects', 'sql': 'SELECT 1'})
+        finally:
+            REQUEST_ID.reset(token)
+            pipeline.stop()
+            logger.removeHandler(pipeline.handler)
+        
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        # 3 from the burst, then one in five of the remaining 10
+        assert len(records) == 5
+        assert records[0]['request_id'] == 'req-1'
+        assert records[0]['dal_method'] == 'get_all_projects' and records[0]['sql'] == 'SELECT 1'
+        assert records[3]['suppressed'] == 5
+
+    
+    def test_sitemap_lists_projects(self):
+        """Test that the sitemap lists the pages and every project with its lastmod"""
+        project_id = self.test_dal.add_project("Mapped", "In the sitemap", "image.jpg")
+        response = self.client.get('/sitemap.xml')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/xml'
+        assert b'<loc>http://localhost/about</loc>' in response.data
+        assert f'<loc>http://localhost/projects/{project_id}</loc><lastmod>'.encode() in response.data
+    
+    def test_atom_feed_incremental_and_conditional(self):
+        """Test that the feed re-renders only changed projects and answers conditional GETs"""
+        import gzip
+        import app as app_module
+        first = self.test_dal.add_project("First <Entry>", "Feed entry one", "image.jpg")
+        self.test_dal.add_project("Second", "Feed entry two", "image.jpg")
+        response = self.client.get('/projects.atom')
+        assert response.mimetype == 'application/atom+xml'
+        assert b'<title>First &lt;Entry&gt;</title>' in response.data
+        etag = response.headers['ETag']
+        assert response.headers['Last-Modified']
+        
+        assert self.client.get('/projects.atom', headers={'If-None-Match': etag}).status_code == 304
+        
+        rendered = app_module.feed_cache.rendered
+        self.test_dal.update_project(first, "First Updated", "Feed entry one", "image.jpg")
+        response = self.client.get('/projects.atom', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert b'First Updated' in response.data
+        assert app_module.feed_cache.rendered == rendered + 1
+        
+        response = self.client.get('/projects.atom', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert b'First Updated' in gzip.decompress(response.data)
+
+    def test_project_images_have_size_and_placeholder(self):
+        """Test cards get intrinsic sizes and placeholders, with only the first few eager"""
+        import app as app_module
+        from image_meta import read_dimensions
+        assert read_dimensions('static/images/profile.jpg') == (800, 800)
+        
+        self.test_dal.get_image_assets()
+        for n in range(5):
+            self.test_dal.add_project(f"Card {n}", "Project with a measured image", "business-case.jpg")
+        page = self.client.get('/projects').get_data(as_text=True)
+        assert 'loading="lazy"' in page and 'width="400"' not in page
+        # The first view queued the image for the background pass
+        app_module.image_metadata.wait()
+        
+        page = self.client.get('/projects').get_data(as_text=True)
+        assert page.count('width="400" height="300"') == 5
+        assert page.count('loading="eager"') == app.config['EAGER_PROJECT_IMAGES']
+        assert page.count('loading="lazy"') == 5 - app.config['EAGER_PROJECT_IMAGES']
+        assert 'background:url(data:image/jpeg;base64,' in page
+        
+        app_module.image_metadata.run_pending(self.test_dal)
+        page = self.client.get('/about').get_data(as_text=True)
+        assert 'class="profile-image" loading="eager"' in page
+        assert 'width="800" height="800"' in page
+
+    def test_health_and_readiness(self):
+        """Test /healthz always answers and /readyz gates on warm-up and DB latency"""
+        import app as app_module
+        response = self.client.get('/healthz')
+        assert response.status_code == 200 and response.get_json() == {'status': 'ok'}
+        assert 'no-store' in response.headers['Cache-Control']
+        
+        try:
+            for state in ('cold', 'warming', 'failed'):
+                app_module.readiness.state = state
+                response = self.client.get('/readyz')
+                assert response.status_code == 503
+                assert response.get_json()['status'] == state
+            
+            app_module.readiness.state = 'ready'
+            response = self.client.get('/readyz')
+            assert response.status_code == 200
+            assert response.get_json()['status'] == 'ready'
+            assert response.get_json()['db_latency_ms'] >= 0
+            
+            app.config['READY_DB_LATENCY_MS'] = -1
+            response = self.client.get('/readyz')
+            assert response.status_code == 503
+            assert response.get_json()['status'] == 'database-slow'
+        finally:
+            app.config['READY_DB_LATENCY_MS'] = 250
+            app_module.readiness.reset()
+    
+    def test_warm_up_renders_routes_and_fills_caches(self):
+        """Test warm-up requests every GET route and leaves the page cache filled"""
+        import app as app_module
+        from DAL import DALError
+        project_id = self.test_dal.add_project("Warm", "Project rendered during warm-up", "image.jpg")
+        app_module.page_cache.clear()
+        
+        readiness = app_module.warm_up_process()
+        assert readiness.state == 'ready' and readiness.seconds is not None
+        assert readiness.routes['/about'][0] == 200
+        assert readiness.routes[f'/projects/{project_id}'][0] == 200
+        assert '/healthz' not in readiness.routes and '/add-project' in readiness.routes
+        assert all(status == 200 for status, _ in readiness.routes.values())
+        assert len(app_module.page_cache) > 0
+        assert self.client.get('/readyz').get_json()['warmup'] == 'ready'
+        app_module.readiness.reset()
+        
+        def warm_cache():
+            raise DALError("disk gone")
+        self.test_dal.warm_cache = warm_cache
+        try:
+            readiness = app_module.warm_up(app, self.test_dal, app_module.readiness)
+        finally:
+            del self.test_dal.warm_cache
+        assert readiness.state == 'failed'
+        response = self.client.get('/readyz')
+        assert response.status_code == 503 and response.get_json()['status'] == 'failed'
+        app_module.readiness.reset()
+
+    def test_service_worker_script(self):
+        """Test /sw.js lists the pages and precaches static files under content revisions"""
+        import json
+        response = self.client.get('/sw.js')
+        assert response.status_code == 200 and response.mimetype == 'text/javascript'
+        script = response.get_data(as_text=True)
+        pages = json.loads(script.split('const PAGES = ')[1].split(';\n')[0])
+        assert '/about' in pages and '/projects' in pages
+        assert '/sw.js' not in pages and '/healthz' not in pages and '/search' not in pages
+        precache = json.loads(script.split('const PRECACHE = ')[1].split(';\n')[0])
+        assert '/static/css/style.css' in precache and '/static/images/profile.jpg' in precache
+        assert '/static/Siddique_Saad_Resume.pdf' in script.split('const PDFS = ')[1].split(';\n')[0]
+        assert self.client.get('/sw.js', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+        # Navigations go to the network first, so redirects after a post show fresh pages
+        assert 'respondWith(networkFirst(event, PAGE_CACHE))' in script
+        
+        page = self.client.get('/about').get_data(as_text=True)
+        assert 'rel="manifest" href="/manifest.webmanifest"' in page
+        assert "serviceWorker.register('/sw.js'" in page
+        manifest = self.client.get('/manifest.webmanifest')
+        assert manifest.mimetype == 'application/manifest+json'
+        assert manifest.get_json()['start_url'] == '/'
+        assert manifest.get_json()['icons'][0]['sizes'] == '800x800'
+    
+    def test_service_worker_revisions_follow_content(self):
+        """Test a changed file changes only its own revision and the script version"""
+        from service_worker import ServiceWorker
+        with tempfile.TemporaryDirectory() as static_dir:
+            os.makedirs(os.path.join(static_dir, 'css'))
+            os.makedirs(os.path.join(static_dir, 'images'))
+            for name, data in (('css/style.css', 'body{}'), ('images/a.jpg', 'a'), ('images/b.png', 'b')):
+                with open(os.path.join(static_dir, name), 'w') as f:
+                    f.write(data)
+            worker = ServiceWorker(static_dir)
+            before = worker.revisions(worker.precache_files())
+            script, version = worker.script(['/'])
+            assert set(before) == {'/static/css/style.css', '/static/images/a.jpg', '/static/images/b.png'}
+            
+            with open(os.path.join(static_dir, 'images', 'a.jpg'), 'w') as f:
+                f.write('changed')
+            after = worker.revisions(worker.precache_files())
+            assert after['/static/images/a.jpg'] != before['/static/images/a.jpg']
+            assert {k: v for k, v in after.items() if k != '/static/images/a.jpg'} == \
+                {k: v for k, v in before.items() if k != '/static/images/a.jpg'}
+            assert worker.script(['/'])[1] != version
+            assert worker.script(['/about'], '/t/alice')[0].count('"/t/alice/about"') == 1
+
+    def test_speculation_rules_in_pages(self):
+        """Test pages carry speculation rules that skip form pages"""
+        import json
+        import re
+        page = self.client.get('/projects').get_data(as_text=True)
+        rules = json.loads(re.search(r'<script type="speculationrules">(.*?)</script>', page).group(1))
+        assert rules['prerender'][0]['eagerness'] == 'conservative'
+        assert {'not': {'href_matches': '/contact'}} in rules['prefetch'][0]['where']['and']
+        assert "supports('speculationrules')" in page
+    
+    def test_prefetch_budget_and_flashes(self):
+        """Test prefetches past the budget get 503, cached pages stay free and flashes survive"""
+        import app as app_module
+        app_module.page_cache.clear()
+        prefetch = {'Sec-Purpose': 'prefetch'}
+        app.config['PREFETCH_BUDGET'] = (0.001, 2)
+        try:
+            assert self.client.get('/about', headers=prefetch).status_code == 200
+            # Served from the page cache, so no budget is spent
+            for _ in range(3):
+                assert self.client.get('/about', headers=prefetch).status_code == 200
+            assert self.client.get('/projects', headers=prefetch).status_code == 200
+            response = self.client.get('/projects', headers={'Sec-Purpose': 'prefetch;prerender'})
+            assert response.status_code == 503 and 'no-store' in response.headers['Cache-Control']
+            assert self.client.get('/projects').status_code == 200
+        finally:
+            app.config['PREFETCH_BUDGET'] = (5.0, 20)
+        
+        with self.client.session_transaction() as session:
+            session['_flashes'] = [('success', 'Saved before the prefetch')]
+        assert b'Saved before the prefetch' not in self.client.get('/projects', headers=prefetch).data
+        assert b'Saved before the prefetch' in self.client.get('/projects').data
+
+    def test_export_projects_streams_csv_and_jsonl(self):
+        """Test /api/projects/export in both formats, plain and gzipped"""
+        import csv
+        import gzip
+        import io
+        import json
+        project_id = self.test_dal.add_project('Export, "quoted"', "Line one\nline two", "image.jpg")
+        
+        response = self.client.get('/api/projects/export')
+        assert response.status_code == 200 and response.mimetype == 'text/csv'
+        assert response.is_streamed
+        assert 'attachment; filename="projects-' in response.headers['Content-Disposition']
+        rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+        assert rows[0][:2] == ['id', 'title']
+        assert rows[-1][:3] == [str(project_id), 'Export, "quoted"', "Line one\nline two"]
+        
+        response = self.client.get('/api/projects/export?format=jsonl&gzip=1')
+        assert response.mimetype == 'application/gzip'
+        assert response.headers['Content-Disposition'].endswith('.jsonl.gz"')
+        records = [json.loads(line) for line in gzip.decompress(response.data).decode().splitlines()]
+        assert records[-1]['id'] == project_id and records[-1]['description'] == "Line one\nline two"
+        assert self.client.get('/api/projects/export?format=xml').status_code == 400
+
+    def test_stats_endpoint(self):
+        """Test /stats reports counts from the maintained aggregates"""
+        before = self.client.get('/stats').get_json()
+        self.test_dal.add_project("Stats Page", "Counted on the stats page", "stats-page.jpg")
+        stats = self.client.get('/stats').get_json()
+        assert stats['projects'] == before['projects'] + 1
+        assert {'image_filename': 'stats-page.jpg', 'projects': 1} in stats['image_usage']
+        assert stats['per_month'][0]['projects'] >= 1
+
+    
+    def test_projects_filtered_by_tags_with_facets(self):
+        """Test /projects?tag=... keeps projects with every tag and counts the refinements"""
+        from app import tag_index
+        flask_id = self.test_dal.add_project("Flask API", "Tagged python and flask", "image.jpg")
+        django_id = self.test_dal.add_project("Django Shop", "Tagged python and django", "image.jpg")
+        self.test_dal.add_project("Untagged", "No tags on this one", "image.jpg")
+        self.test_dal.set_project_tags(flask_id, ["Python", "Flask"])
+        self.test_dal.set_project_tags(django_id, ["python", "django"])
+        
+        response = self.client.get('/projects')
+        assert b'Untagged' in response.data
+        assert b'python <span class="tag-count">2</span>' in response.data
+        
+        response = self.client.get('/projects?tag=python')
+        assert b'Flask API' in response.data and b'Django Shop' in response.data
+        assert b'Untagged' not in response.data
+        assert b'href="/projects?tag=flask&amp;tag=python"' in response.data
+        assert b'flask <span class="tag-count">1</span>' in response.data
+        
+        response = self.client.get('/projects?tag=Python&tag=flask')
+        assert b'Flask API' in response.data and b'Django Shop' not in response.data
+        assert b'Clear filters' in response.data
+        
+        response = self.client.get('/projects?tag=flask&tag=django')
+        assert b'No projects carry all of the selected tags' in response.data
+        
+        # Retagging invalidates the index
+        self.test_dal.set_project_tags(django_id, ["python", "flask"])
+        assert tag_index.select(self.test_dal, ["flask"]) == {flask_id, django_id}
+        assert b'Django Shop' in self.client.get('/projects?tag=flask').data
+    
+    def test_add_project_with_tags(self):
+        """Test tags entered on the add-project form are stored and shown"""
+        response = self.client.post('/add-project', data={
+            'title': 'Tagged Project',
+            'description': 'A project submitted with a few tags.',
+            'image_filename': 'test-project.jpg',
+            'tags': 'SQLite, Flask,  flask ',
+        }, follow_redirects=True)
+        assert b'Project added successfully!' in response.data
+        project_id = self.test_dal.get_all_projects()[0][0]
+        assert self.test_dal.get_project_tags([project_id]) == {project_id: ['flask', 'sqlite']}
+        assert b'href="/projects?tag=sqlite"' in self.client.get(f'/projects/{project_id}').data
+
+    
+    def test_duplicate_contact_submissions_suppressed(self, caplog):
+        """Test a resent contact message is dropped (or only flagged) before it's processed"""
+        import logging
+        import app as app_module
+        data = {'first_name': 'John', 'last_name': 'Doe', 'email': 'john@example.com',
+                'message': 'Hello, I would like to talk about a project.'}
+        resent = dict(data, email='JOHN+spam@example.com', message='hello   I would like to talk about a project!!')
+        with caplog.at_level(logging.INFO, logger=app.logger.name):
+            first = self.client.post('/contact', data=data, follow_redirects=True)
+            again = self.client.post('/contact', data=resent, follow_redirects=True)
+            assert first.data == again.data and b'Thank you for your message!' in again.data
+            assert any("dropped" in record.getMessage() for record in caplog.records)
+            
+            app.config['CONTACT_DEDUP'] = 'flag'
+            try:
+                response = self.client.post('/contact', data=data)
+            finally:
+                app.config['CONTACT_DEDUP'] = 'drop'
+            assert response.status_code == 302
+            assert any("flagged" in record.getMessage() for record in caplog.records)
+        info = app_module.contact_filter.info()
+        assert (info['checks'], info['duplicates']) == (3, 2)
+        assert 0 <= info['estimated_fp_rate'] < info['target_fp_rate']
+    
+    def test_duplicate_filter_window_and_sharing(self):
+        """Test fingerprints expire with the window and are shared between processes"""
+        import multiprocessing
+        from dedup import DuplicateFilter, fingerprint
+        path = os.path.join(tempfile.mkdtemp(), 'filter.bloom')
+        duplicate_filter = DuplicateFilter(path, window=100, capacity=1000, fp_rate=0.01)
+        message = fingerprint('a@example.com', 'Same message')
+        assert not duplicate_filter.seen(message, now=1000)
+        assert duplicate_filter.seen(message, now=1099)
+        assert not duplicate_filter.seen(message, now=1250)
+        assert not any(duplicate_filter.seen(fingerprint('a@example.com', f"Message {n}"), now=1250)
+                       for n in range(500))
+        
+        # A forked worker records into the same file
+        child = multiprocessing.get_context('fork').Process(
+            target=duplicate_filter.seen, args=(fingerprint('b@example.com', 'From a worker'),))
+        child.start()
+        child.join()
+        assert duplicate_filter.seen(fingerprint('b@example.com', 'From a worker'))
+        
+        # Another configuration starts the file over
+        resized = DuplicateFilter(path, window=100, capacity=5000, fp_rate=0.01)
+        assert not resized.seen(message, now=1250)
+        assert os.path.getsize(path) == resized.size
+        duplicate_filter.close()
+        resized.close()
+
+    
+    def test_admin_query_stats_endpoint(self):
+        """Test /admin/query-stats needs ADMIN_TOKEN and returns the DAL's statement stats"""
+        assert self.client.get('/admin/query-stats').status_code == 404
+        app.config['ADMIN_TOKEN'] = 'secret'
+        try:
+            assert self.client.get('/admin/query-stats').status_code == 403
+            self.client.get('/projects')
+            response = self.client.get('/admin/query-stats', headers={'Authorization': 'Bearer secret'})
+        finally:
+            app.config['ADMIN_TOKEN'] = None
+        assert response.status_code == 200 and 'no-store' in response.headers['Cache-Control']
+        body = response.get_json()
+        assert body['slow_ms'] == self.test_dal.query_stats.slow_ms
+        assert any('FROM projects' in statement['sql'] and statement['calls'] >= 1
+                   for statement in body['statements'])
+
+    
+    def test_cached_pages_echo_each_request_id(self):
+        """Test responses from the page cache carry the id of their own request"""
+        import app as app_module
+        app_module.page_cache.clear()
+        first = self.client.get('/about', headers={'X-Request-ID': 'alice-1'})
+        second = self.client.get('/about', headers={'X-Request-ID': 'bob-2'})
+        third = self.client.get('/about')
+        assert len(app_module.page_cache) >= 1
+        assert first.headers['X-Request-ID'] == 'alice-1'
+        assert second.headers['X-Request-ID'] == 'bob-2'
+        assert third.headers['X-Request-ID'] not in ('alice-1', 'bob-2')
+        assert second.headers.getlist('X-Request-ID') == ['bob-2']
+
 
 if __name__ == "__main__":
     pytest.main([__file__])
@@ -8,6 +8,7 @@ import sqlite3
 import os
 import tempfile
 from DAL import DatabaseAccessLayer
+from testdb import make_test_dal, template_database
 
 
 class TestDatabase:
@@ -15,15 +16,12 @@ class TestDatabase:
     
     def setup_method(self):
         """Set up test database before each test"""
-        # Create a temporary database for testing
-        self.test_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
-        self.test_db.close()
-        self.dal = DatabaseAccessLayer(self.test_db.name)
+        # In-memory copy of the template database
+        self.dal = make_test_dal()
     
     def teardown_method(self):
         """Clean up test database after each test"""
-        if os.path.exists(self.test_db.name):
-            os.unlink(self.test_db.name)
+        self.dal.close()
     
     def test_database_connection(self):
         """Test that database connection works"""
@@ -155,6 +153,612 @@ class TestDatabase:
         assert project[4] is not None  # Created date should exist
         assert project[5] is not None  # Updated date should exist
 
+    def test_schema_initialized_once(self):
+        """Test reopening a current database doesn't run init_database, and images_dir=None imports nothing"""
+        from DAL import SCHEMA_VERSION
+        test_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
+        test_db.close()
+        try:
+            dal = DatabaseAccessLayer(test_db.name, template=template_database())
+            assert dal.schema_version() == SCHEMA_VERSION
+            conn = dal.get_connection()
+            conn.execute('DROP INDEX idx_project_tags_project')
+            conn.commit()
+            conn.close()
+            
+            reopened = DatabaseAccessLayer(test_db.name, images_dir=None)
+            conn = reopened.get_connection()
+            index = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_project_tags_project'").fetchone()
+            conn.close()
+            assert index is None
+            assert reopened.get_image_assets() == []
+        finally:
+            os.unlink(test_db.name)
+    
+    def test_enable_wal(self):
+        """Test switching the database to write-ahead logging"""
+        # WAL needs a database file, so copy the template to disk
+        test_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
+        test_db.close()
+        try:
+            dal = DatabaseAccessLayer(test_db.name, template=template_database())
+            assert dal.enable_wal() is True
+            
+            conn = dal.get_connection()
+            mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+            conn.close()
+            assert mode == 'wal'
+            
+            # Reads and writes keep working in WAL mode
+            project_id = dal.add_project("WAL Project", "Written in WAL mode", "wal.jpg")
+            assert dal.get_project_by_id(project_id)[1] == "WAL Project"
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(test_db.name + suffix):
+                    os.unlink(test_db.name + suffix)
+
+    def test_get_project_window(self):
+        """Test fetching a project with its newer and older neighbours"""
+        ids = [self.dal.add_project(f"Project {i}", f"Description {i}", "image.jpg") for i in range(5)]
+        
+        newer, project, older = self.dal.get_project_window(ids[2], radius=2)
+        assert project[0] == ids[2]
+        assert [row[0] for row in newer] == [ids[3], ids[4]]
+        assert [row[0] for row in older] == [ids[1], ids[0]]
+        
+        newer, project, older = self.dal.get_project_window(ids[4], radius=2)
+        assert newer == []
+        assert self.dal.get_project_window(9999) is None
+    
+    def test_write_listeners(self):
+        """Test that listeners are told about committed writes"""
+        events = []
+        self.dal.add_write_listener(lambda action, project_id: events.append((action, project_id)))
+        
+        project_id = self.dal.add_project("Listened", "Listener description", "image.jpg")
+        self.dal.update_project(project_id, "Listened 2", "Listener description", "image.jpg")
+        self.dal.delete_project(project_id)
+        self.dal.delete_project(project_id)
+        
+        assert events == [('add', project_id), ('update', project_id), ('delete', project_id)]
+
+    def test_add_asset_deduplicates_by_filename(self):
+        """Test that registering the same stored file twice keeps one row"""
+        first = self.dal.add_asset("ab" * 32, "assets/ab/file.png", "one.png", "image/png", 10)
+        second = self.dal.add_asset("ab" * 32, "assets/ab/file.png", "two.png", "image/png", 10)
+        assert first[0] == second[0]
+        assert self.dal.get_asset_by_hash("ab" * 32)[2] == "assets/ab/file.png"
+    
+    def test_get_image_assets_imports_existing_images(self):
+        """Test that the image catalog starts with the images in static/images"""
+        images = self.dal.get_image_assets()
+        filenames = [filename for filename, _ in images]
+        assert filenames == self.dal.get_available_images()
+        
+        self.dal.add_asset("cd" * 32, "assets/cd/doc.pdf", "doc.pdf", "application/pdf", 10)
+        assert "assets/cd/doc.pdf" not in [filename for filename, _ in self.dal.get_image_assets()]
+
+    
+    def test_change_log_records_writes(self):
+        """Test that every write lands in the change log with increasing sequence numbers"""
+        project_id = self.dal.add_project("Changed", "Change description", "image.jpg")
+        self.dal.update_project(project_id, "Changed 2", "Change description", "image.jpg")
+        self.dal.delete_project(project_id)
+        
+        changes, compacted_through = self.dal.get_changes(0)
+        assert [(change[1], change[2]) for change in changes] == [
+            (project_id, 'add'), (project_id, 'update'), (project_id, 'delete')]
+        assert [change[0] for change in changes] == sorted(change[0] for change in changes)
+        assert changes[-1][4] is None
+        assert compacted_through == 0
+        assert self.dal.get_latest_change_seq() == changes[-1][0]
+        
+        later, _ = self.dal.get_changes(changes[0][0])
+        assert len(later) == 2
+    
+    def test_compact_changes(self):
+        """Test that compaction keeps the latest change per project and expires tombstones"""
+        kept = self.dal.add_project("Kept", "Kept description", "image.jpg")
+        self.dal.update_project(kept, "Kept 2", "Kept description", "image.jpg")
+        gone = self.dal.add_project("Gone", "Gone description", "image.jpg")
+        self.dal.delete_project(gone)
+        latest = self.dal.get_latest_change_seq()
+        
+        assert self.dal.compact_changes() == 2
+        changes, compacted_through = self.dal.get_changes(0)
+        assert [(change[1], change[2]) for change in changes] == [(kept, 'update'), (gone, 'delete')]
+        assert compacted_through == 0
+        
+        assert self.dal.compact_changes(tombstone_max_age_days=-1) == 1
+        changes, compacted_through = self.dal.get_changes(0)
+        assert [(change[1], change[2]) for change in changes] == [(kept, 'update')]
+        assert compacted_through == latest
+        assert self.dal.get_latest_change_seq() == latest
+
+    
+    def test_backup_snapshots_verify_and_restore(self):
+        """Test online snapshots: unchanged databases are skipped and restores round-trip"""
+        import shutil
+        from backup import SnapshotStore
+        from project_cache import ProjectDetailCache
+        workdir = tempfile.mkdtemp()
+        try:
+            db_path = os.path.join(workdir, 'projects.db')
+            dal = DatabaseAccessLayer(db_path, template=template_database())
+            dal.add_project("Backed Up", "Saved in the snapshot", "image.jpg")
+            store = SnapshotStore(os.path.join(workdir, 'backups'))
+            
+            snapshot, stats = store.create(db_path, compress=True, pages=1, sleep=0)
+            assert snapshot['file'].endswith('.db.gz')
+            assert stats['steps'] > 1
+            assert store.create(db_path, pages=1, sleep=0)[0] is None
+            assert store.verify(snapshot) == (True, 'ok')
+            
+            later_id = dal.add_project("After Snapshot", "Not in the snapshot", "image.jpg")
+            dal.set_project_tags(later_id, ["later"])
+            cache = ProjectDetailCache(sync_interval=0)
+            assert cache.get(dal, later_id) is not None
+            before = dal.get_cache_versions()
+            
+            stats = store.restore(snapshot, db_path)
+            assert [project[1] for project in dal.get_all_projects()] == ["Backed Up"]
+            # The restored change log is ahead of the replaced one, so caches resync
+            seq, tags_version = dal.get_cache_versions()
+            assert seq == stats['change_seq'] > before[0] and tags_version > before[1]
+            assert dal.get_changes(before[0])[1] == seq
+            assert cache.get(dal, later_id) is None
+            assert dal.add_project("After Restore", "Logged after the restore", "image.jpg")
+            assert dal.get_latest_change_seq() == seq + 1
+            
+            with open(os.path.join(store.directory, snapshot['file']), 'r+b') as f:
+                f.seek(snapshot['stored_size'] // 2)
+                f.write(b'corrupt')
+            files = sorted(os.listdir(store.directory))
+            assert store.verify(snapshot)[0] is False
+            # The temporary copy of an unreadable snapshot isn't left behind
+            assert sorted(os.listdir(store.directory)) == files
+        finally:
+            shutil.rmtree(workdir)
+    
+    def test_backup_retention_policy(self):
+        """Test that retention keeps the newest snapshots plus one per day and week"""
+        from backup import select_retained
+        snapshots = [{'file': f"s{day}-{hour}", 'created': f"2024-03-{day:02d}T{hour:02d}:00:00+00:00"}
+                     for day in range(1, 22) for hour in (6, 18)]
+        keep = select_retained(snapshots, keep_last=2, keep_daily=3, keep_weekly=2)
+        # Newest two, newest of Mar 21/20/19, newest of ISO weeks 12 (Mar 18-21) and 11 (Mar 11-17)
+        assert keep == {"s21-18", "s21-6", "s20-18", "s19-18", "s17-18"}
+
+    
+    def test_locked_database_raises_unavailable(self):
+        """Test that a locked database surfaces as DatabaseUnavailable"""
+        from DAL import DatabaseUnavailable
+        conn = self.dal.get_connection()
+        try:
+            conn.execute('BEGIN EXCLUSIVE')
+            conn.execute("INSERT INTO projects (title, description, image_filename) VALUES ('a', 'b', 'c')")
+            with pytest.raises(DatabaseUnavailable) as info:
+                self.dal.get_all_projects()
+            assert info.value.method == 'get_all_projects'
+        finally:
+            conn.rollback()
+            conn.close()
+    
+    def test_failed_statement_raises_dal_error(self):
+        """Test that other failures raise DALError and are logged with the SQL"""
+        import logging
+        from DAL import DALError, DatabaseUnavailable
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('portfolio.dal')
+        logger.addHandler(handler)
+        try:
+            conn = self.dal.get_connection()
+            conn.execute('DROP TABLE assets')
+            conn.close()
+            with pytest.raises(DALError) as info:
+                self.dal.get_asset_by_hash("ab" * 32)
+            assert not isinstance(info.value, DatabaseUnavailable)
+        finally:
+            logger.removeHandler(handler)
+        assert records[-1].dal_method == 'get_asset_by_hash'
+        assert records[-1].sql.startswith('SELECT')
+        assert 'no such table' in records[-1].error
+
+    def test_image_metadata_per_hash(self):
+        """Test metadata is stored once per content hash and shared by duplicates"""
+        self.dal.add_asset('a' * 64, 'one.jpg', 'one.jpg', 'image/jpeg', 10)
+        self.dal.add_asset('a' * 64, 'assets/copy.jpg', 'copy.jpg', 'image/jpeg', 10)
+        self.dal.add_asset('b' * 64, 'two.png', 'two.png', 'image/png', 20)
+        assert self.dal.get_images_missing_metadata() == [('a' * 64, 'assets/copy.jpg'), ('b' * 64, 'two.png')]
+        
+        self.dal.save_image_metadata('a' * 64, 400, 300, 'data:image/jpeg;base64,AAAA')
+        metadata = self.dal.get_image_metadata(['one.jpg', 'assets/copy.jpg', 'two.png', 'unknown.jpg'])
+        assert metadata['one.jpg'] == ('a' * 64, True, 400, 300, 'data:image/jpeg;base64,AAAA')
+        assert metadata['assets/copy.jpg'] == metadata['one.jpg']
+        assert metadata['two.png'] == ('b' * 64, False, None, None, None)
+        assert 'unknown.jpg' not in metadata
+        assert self.dal.get_images_missing_metadata() == [('b' * 64, 'two.png')]
+    
+    def test_image_metadata_worker_logs_failures(self):
+        """Test an image the background worker can't measure is logged, not dropped silently"""
+        import logging
+        from image_meta import ImageMetadataWorker
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('portfolio.images')
+        logger.addHandler(handler)
+        conn = self.dal.get_connection()
+        conn.execute('DROP TABLE image_metadata')
+        conn.close()
+        try:
+            worker = ImageMetadataWorker(static_dir=tempfile.mkdtemp())
+            worker.request(self.dal, [('c' * 64, 'missing.jpg')])
+            worker.wait()
+        finally:
+            logger.removeHandler(handler)
+        assert records[-1].getMessage() == "Measuring missing.jpg failed"
+        assert records[-1].exc_info is not None
+    
+    def test_undecodable_images_keep_dimensions_without_placeholder(self):
+        """Test malformed, truncated and oversized images are measured without a placeholder"""
+        import struct
+        import zlib
+        pytest.importorskip('PIL')
+        from image_meta import compute_metadata
+        
+        def chunk(kind, data):
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+        
+        directory = tempfile.mkdtemp()
+        images = {
+            # 40000 x 40000 pixels trips Pillow's decompression bomb check
+            'bomb.png': b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 40000, 40000, 8, 2, 0, 0, 0))
+                        + chunk(b'IDAT', zlib.compress(b'')) + chunk(b'IEND', b''),
+            'truncated.jpg': b'\xff\xd8\xff\xc0\x00\x11\x08' + struct.pack('>HH', 30, 40) + b'\x03',
+            'zero-length.jpg': b'\xff\xd8\xff\xe0\x00\x00',
+            'garbage.gif': b'GIF89a\x10\x00\x20\x00' + b'\x00' * 8,
+        }
+        for filename, content in images.items():
+            with open(os.path.join(directory, filename), 'wb') as f:
+                f.write(content)
+        assert compute_metadata(os.path.join(directory, 'bomb.png')) == (40000, 40000, None)
+        assert compute_metadata(os.path.join(directory, 'truncated.jpg')) == (40, 30, None)
+        assert compute_metadata(os.path.join(directory, 'zero-length.jpg')) == (None, None, None)
+        assert compute_metadata(os.path.join(directory, 'garbage.gif')) == (16, 32, None)
+
+    def test_warm_cache_and_ping(self):
+        """Test warming reads every project and ping times a round trip"""
+        for n in range(3):
+            self.dal.add_project(f"Warm {n}", "Project read by the cache warmer", "image.jpg")
+        assert self.dal.warm_cache() == 3
+        assert 0 <= self.dal.ping() < 1
+
+    def test_iter_projects_in_chunks_without_pinning_wal(self):
+        """Test chunked iteration returns every row and lets checkpoints run mid-export"""
+        test_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
+        test_db.close()
+        try:
+            dal = DatabaseAccessLayer(test_db.name, template=template_database())
+            assert dal.enable_wal() is True
+            ids = [dal.add_project(f"Chunk {n}", "Project read in chunks", "image.jpg") for n in range(7)]
+            
+            rows = dal.iter_projects(chunk_size=3)
+            assert [next(rows)[0] for _ in range(4)] == ids[:4]
+            # Between chunks no read transaction is open, so a full checkpoint succeeds
+            dal.add_project("Mid export", "Written while exporting", "image.jpg")
+            conn = dal.get_connection()
+            busy = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()[0]
+            conn.close()
+            assert busy == 0
+            assert [row[0] for row in rows] == ids[4:] + [ids[-1] + 1]
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(test_db.name + suffix):
+                    os.unlink(test_db.name + suffix)
+    
+    def test_export_memory_is_flat(self):
+        """Test exporting ten times the rows doesn't take ten times the memory"""
+        import tracemalloc
+        from export import export_projects
+        
+        def peak_for(rows):
+            conn = self.dal.get_connection()
+            conn.execute('DELETE FROM projects')
+            conn.executemany(
+                'INSERT INTO projects (title, description, image_filename) VALUES (?, ?, ?)',
+                ((f"Project {n}", "x" * 200, "image.jpg") for n in range(rows)))
+            conn.commit()
+            conn.close()
+            tracemalloc.start()
+            size = sum(len(piece) for piece in export_projects(self.dal, 'jsonl', compress=True, chunk_size=200))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return size, peak
+        
+        small_size, small_peak = peak_for(1000)
+        large_size, large_peak = peak_for(10000)
+        assert large_size > 5 * small_size
+        assert large_peak < 2 * small_peak
+
+    def test_stats_follow_project_writes(self):
+        """Test the aggregates track adds, updates and deletes without scanning projects"""
+        base = self.dal.get_stats()
+        first = self.dal.add_project("Stats One", "Counted in the statistics", "stats-a.jpg")
+        second = self.dal.add_project("Stats Two", "Counted in the statistics", "stats-a.jpg")
+        stats = self.dal.get_stats()
+        assert stats['projects'] == base['projects'] + 2
+        assert ('stats-a.jpg', 2) in stats['image_usage']
+        assert sum(count for _, count in stats['per_month']) == stats['projects']
+        
+        assert self.dal.update_project(second, "Stats Two", "Now with another image", "stats-b.jpg")
+        assert not self.dal.update_project(99999, "Missing", "Not a project", "stats-c.jpg")
+        usage = dict(self.dal.get_stats()['image_usage'])
+        assert usage['stats-a.jpg'] == 1 and usage['stats-b.jpg'] == 1 and 'stats-c.jpg' not in usage
+        
+        self.dal.delete_project(first)
+        self.dal.delete_project(99999)
+        stats = self.dal.get_stats()
+        assert stats['projects'] == base['projects'] + 1
+        assert 'stats-a.jpg' not in dict(stats['image_usage'])
+        assert self.dal.rebuild_stats() is False
+        
+        # Reads come from the aggregate tables only
+        statements = []
+        get_connection = self.dal.get_connection
+        def traced_connection():
+            conn = get_connection()
+            conn.set_trace_callback(statements.append)
+            return conn
+        self.dal.get_connection = traced_connection
+        self.dal.get_stats()
+        del self.dal.get_connection
+        assert statements and not any('FROM projects' in sql for sql in statements)
+    
+    def test_rebuild_stats_fixes_drift(self):
+        """Test rebuilding recomputes aggregates after writes that bypassed the DAL"""
+        conn = self.dal.get_connection()
+        conn.execute("INSERT INTO projects (title, description, image_filename) VALUES ('Raw', 'Inserted directly', 'raw.jpg')")
+        conn.commit()
+        conn.close()
+        assert 'raw.jpg' not in dict(self.dal.get_stats()['image_usage'])
+        assert self.dal.rebuild_stats() is True
+        assert dict(self.dal.get_stats()['image_usage'])['raw.jpg'] == 1
+        assert self.dal.rebuild_stats() is False
+
+    def test_maintenance_vacuum_reclaims_and_records(self):
+        """Test incremental vacuum frees deleted pages and the run is recorded"""
+        from maintenance import Maintenance
+        ids = [self.dal.add_project(f"Churn {n}", "x" * 4000, "image.jpg") for n in range(50)]
+        for project_id in ids:
+            self.dal.delete_project(project_id)
+        
+        results = Maintenance().run_due(self.dal, force=True, jobs=['vacuum'])
+        status, reclaimed, _ = results['vacuum']
+        assert status == 'ok' and reclaimed >= 50 * 4000
+        _, job, _, duration_ms, status, bytes_reclaimed, _ = self.dal.get_maintenance_runs()[0]
+        assert (job, status, bytes_reclaimed) == ('vacuum', 'ok', reclaimed) and duration_ms >= 0
+        assert Maintenance().run_job(self.dal, 'vacuum')[2] == "no free pages"
+    
+    def test_maintenance_budget_lease_and_schedule(self):
+        """Test jobs stop at their budget, only the lease holder runs and intervals are kept"""
+        from datetime import datetime
+        from maintenance import DEFAULT_SCHEDULE, Maintenance, in_window
+        for n in range(200):
+            self.dal.add_project(f"Analyze {n}", "Row for the planner statistics", f"image-{n}.jpg")
+        
+        hurried = Maintenance(schedule={'analyze': {'interval': 0, 'budget': 0.0}})
+        assert hurried.run_job(self.dal, 'analyze')[0] == 'timeout'
+        
+        leader, follower = Maintenance(), Maintenance()
+        follower.holder = 'another-worker'
+        assert self.dal.acquire_lease('maintenance', leader.holder, 60)
+        assert follower.run_due(self.dal) == {}
+        assert set(leader.run_due(self.dal, keep_lease=True)) == set(DEFAULT_SCHEDULE)
+        assert leader.due_jobs(self.dal) == []
+        assert follower.run_due(self.dal, force=True) == {}
+        
+        assert in_window('23:00-02:00', datetime(2024, 1, 1, 1, 30))
+        assert not in_window('23:00-02:00', datetime(2024, 1, 1, 12, 0))
+        assert not Maintenance(window='00:00-00:00').run_due(self.dal)
+
+    
+    def _slow_reads(self, delay, error=None):
+        """Make every connection stall before use, so concurrent reads overlap"""
+        import time
+        get_connection = self.dal.get_connection
+        opened = []
+        def slow_connection():
+            opened.append(1)
+            time.sleep(delay)
+            if error is not None:
+                raise error
+            return get_connection()
+        self.dal.get_connection = slow_connection
+        return opened
+    
+    def _concurrently(self, call, count=8):
+        import threading
+        results = [None] * count
+        def run(index):
+            try:
+                results[index] = call()
+            except Exception as e:
+                results[index] = e
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+    
+    def test_concurrent_reads_share_one_query(self):
+        """Test identical concurrent reads run once and every caller gets the rows"""
+        expected = self.dal.get_all_projects()
+        opened = self._slow_reads(0.2)
+        results = self._concurrently(self.dal.get_all_projects)
+        assert len(opened) == 1 and self.dal.flights.shared == 7
+        assert all(result == expected for result in results)
+        # Each caller has its own list
+        results[0].clear()
+        assert results[1] == expected
+        assert len(self.dal.flights) == 0
+        
+        # Different arguments are different flights
+        opened.clear()
+        self._concurrently(lambda: self.dal.get_project_by_id(1), count=4)
+        self._concurrently(lambda: self.dal.get_project_by_id(2), count=4)
+        assert len(opened) == 2
+    
+    def test_coalesced_read_errors_and_timeouts(self):
+        """Test a failed read fails every waiter and slow reads time waiters out"""
+        from DAL import DALError, DatabaseUnavailable
+        opened = self._slow_reads(0.2, error=sqlite3.OperationalError("disk I/O error"))
+        results = self._concurrently(self.dal.get_all_projects, count=4)
+        assert len(opened) == 1
+        assert all(isinstance(result, sqlite3.OperationalError) for result in results)
+        
+        del self.dal.get_connection
+        self._slow_reads(0.3)
+        self.dal.flights.timeout = 0.05
+        results = self._concurrently(self.dal.get_all_projects, count=4)
+        timed_out = [result for result in results if isinstance(result, DatabaseUnavailable)]
+        assert len(timed_out) == 3 and isinstance(timed_out[0], DALError)
+        assert sum(isinstance(result, list) for result in results) == 1
+    
+    def test_write_starts_new_flight(self):
+        """Test reads after a write don't join a query that started before it"""
+        import threading
+        import time
+        opened = self._slow_reads(0.3)
+        before = threading.Thread(target=self.dal.get_all_projects)
+        before.start()
+        while not opened:
+            time.sleep(0.01)
+        del self.dal.get_connection
+        project_id = self.dal.add_project("Fresh", "Written mid-flight", "image.jpg")
+        assert self.dal.get_all_projects()[0][0] == project_id
+        before.join()
+
+    
+    def test_project_tags_and_filtering(self):
+        """Test tags are normalized, replaced, filtered on and removed with their project"""
+        first = self.dal.add_project("First", "Tagged project one", "image.jpg")
+        second = self.dal.add_project("Second", "Tagged project two", "image.jpg")
+        assert self.dal.set_project_tags(first, ["Python", " Machine   Learning ", "python"])
+        assert self.dal.set_project_tags(second, ["python"])
+        assert not self.dal.set_project_tags(999999, ["python"])
+        assert self.dal.get_project_tags([first, second]) == {
+            first: ['machine learning', 'python'], second: ['python']}
+        assert [row[0] for row in self.dal.get_projects_by_tags(["PYTHON"])] == [second, first]
+        assert [row[0] for row in self.dal.get_projects_by_tags(["python", "machine learning"])] == [first]
+        assert self.dal.get_projects_by_tags(["missing"]) == []
+        
+        self.dal.set_project_tags(first, ["rust"])
+        assert self.dal.get_tag_postings() == {'python': [second], 'rust': [first]}
+        self.dal.delete_project(first)
+        assert self.dal.get_tag_postings() == {'python': [second]}
+    
+    def test_tag_index_intersections_and_facets(self):
+        """Test the in-memory index matches the DAL filter and counts facets within a selection"""
+        from tags import TagIndex
+        ids = [self.dal.add_project(f"Project {n}", "Project for the tag index", "image.jpg") for n in range(30)]
+        for n, project_id in enumerate(ids):
+            tags = [name for name, step in (("two", 2), ("three", 3), ("five", 5)) if n % step == 0]
+            self.dal.set_project_tags(project_id, tags)
+        index = TagIndex()
+        selected = index.select(self.dal, ["two", "three"])
+        assert selected == {row[0] for row in self.dal.get_projects_by_tags(["two", "three"])}
+        assert len(selected) == 5
+        assert index.facets(self.dal, selected) == [('three', 5), ('two', 5), ('five', 1)]
+        assert index.facets(self.dal) == [('two', 15), ('three', 10), ('five', 6)]
+        assert index.select(self.dal, []) is None
+        
+        self.dal.set_project_tags(ids[1], ["two"])
+        assert ids[1] in index.select(self.dal, ["two"])
+    
+    def test_tag_index_sees_other_workers_writes(self):
+        """Test the index rebuilds when the tags version moves without a local listener call"""
+        from tags import TagIndex
+        first = self.dal.add_project("First", "Project for the tag index", "image.jpg")
+        second = self.dal.add_project("Second", "Project for the tag index", "image.jpg")
+        self.dal.set_project_tags(first, ["python"])
+        index = TagIndex()
+        assert index.select(self.dal, ["python"]) == {first}
+        
+        # Writes from another worker never reach this process's listeners
+        self.dal.remove_write_listener(index.on_write)
+        version = self.dal.get_tags_version()
+        self.dal.set_project_tags(second, ["python"])
+        assert self.dal.get_tags_version() > version
+        assert index.select(self.dal, ["python"]) == {first, second}
+        self.dal.delete_project(first)
+        assert index.select(self.dal, ["python"]) == {second}
+
+    
+    def test_query_stats_count_calls_latency_and_rows(self):
+        """Test each statement's calls, rows and percentiles are recorded, with its plan"""
+        project_id = self.dal.add_project("Measured", "Project for the query stats", "image.jpg")
+        projects = len(self.dal.get_all_projects())
+        for _ in range(4):
+            self.dal.get_all_projects()
+            self.dal.get_project_by_id(project_id)
+        self.dal.get_project_tags([1, 2, 3])
+        self.dal.get_project_tags([1])
+        statements = {statement['sql']: statement for statement in self.dal.query_stats.snapshot()}
+        listing = next(statement for sql, statement in statements.items()
+                       if sql.startswith('SELECT id') and 'ORDER BY created_date' in sql)
+        assert listing['calls'] == 5 and listing['rows'] == 5 * projects > 0
+        assert 0 <= listing['p50_ms'] <= listing['p95_ms'] <= listing['p99_ms'] <= listing['max_ms']
+        assert listing['plan'] and listing['full_scan'] == []
+        by_id = next(statement for sql, statement in statements.items() if sql.endswith('WHERE id = ?'))
+        assert (by_id['calls'], by_id['rows']) == (4, 4)
+        # IN lists of any length are one statement
+        assert [statement['calls'] for sql, statement in statements.items() if '(?, ...)' in sql] == [2]
+    
+    def test_slow_queries_logged_with_plan_and_full_scans_flagged(self, caplog):
+        """Test slow statements keep their EXPLAIN QUERY PLAN and hot full scans are flagged"""
+        import logging
+        from query_stats import full_scans
+        self.dal.query_stats.slow_ms = 0
+        self.dal.query_stats.hot_calls = 3
+        with caplog.at_level(logging.WARNING, logger='portfolio.dal.queries'):
+            for _ in range(3):
+                conn = self.dal.get_connection()
+                conn.execute('SELECT COUNT(*) FROM projects WHERE description LIKE ?', ('%a%',)).fetchone()
+                conn.close()
+        slow = self.dal.query_stats.slow_queries()
+        assert len(slow) == 3 and slow[0]['sql'].startswith('SELECT COUNT(*) FROM projects')
+        assert full_scans(slow[0]['plan']) == ['projects']
+        assert any(record.getMessage() == "Slow query" and record.plan for record in caplog.records)
+        assert [record.getMessage() for record in caplog.records].count("Full table scan on a hot query") == 1
+        assert full_scans(['SEARCH projects USING INTEGER PRIMARY KEY (rowid=?)',
+                           'SCAN projects USING INDEX idx_projects_created', 'SCAN CONSTANT ROW']) == []
+
+    
+    def test_unavailable_errors_recognized_without_error_names(self):
+        """Test busy and locked errors are classified from the message on Pythons without error names"""
+        from DAL import is_unavailable
+        conn = self.dal.get_connection()
+        other = self.dal.get_connection()
+        try:
+            conn.execute('BEGIN EXCLUSIVE')
+            conn.execute("INSERT INTO projects (title, description, image_filename) VALUES ('a', 'b', 'c')")
+            with pytest.raises(sqlite3.OperationalError) as info:
+                other.execute('SELECT * FROM projects').fetchall()
+        finally:
+            conn.rollback()
+            conn.close()
+            other.close()
+        # A copy carries only the message, as errors do before Python 3.11
+        error = sqlite3.OperationalError(*info.value.args)
+        assert getattr(error, 'sqlite_errorname', None) is None
+        assert is_unavailable(error)
+        assert is_unavailable(sqlite3.OperationalError("unable to open database file"))
+        assert not is_unavailable(sqlite3.OperationalError("no such table: assets"))
+
 
 if __name__ == "__main__":
     pytest.main([__file__])
@@ -4,14 +4,13 @@ Tests end-to-end functionality and user workflows
 """
 
 import pytest
-import tempfile
 import os
 import sys
-from DAL import DatabaseAccessLayer
+from testdb import make_test_dal
 
 # Import app after setting up the path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from app import app, dal
+from app import app
 
 
 class TestIntegration:
@@ -19,12 +18,8 @@ class TestIntegration:
     
     def setup_method(self):
         """Set up test environment"""
-        # Create temporary database
-        self.test_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
-        self.test_db.close()
-        
-        # Create test DAL instance
-        self.test_dal = DatabaseAccessLayer(self.test_db.name)
+        # Create test DAL instance on an in-memory copy of the template database
+        self.test_dal = make_test_dal()
         
         # Configure app for testing
         app.config['TESTING'] = True
@@ -34,12 +29,14 @@ class TestIntegration:
         import app as app_module
         app_module.dal = self.test_dal
         
+        # Start every test with fresh rate-limit buckets
+        app_module.write_admission.reset()
+        
         self.client = app.test_client()
     
     def teardown_method(self):
         """Clean up after each test"""
-        if os.path.exists(self.test_db.name):
-            os.unlink(self.test_db.name)
+        self.test_dal.close()
     
     def test_complete_user_journey(self):
         """Test complete user journey through the website"""
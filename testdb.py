@@ -0,0 +1,30 @@
+"""
+Test databases
+Tests get a private in-memory database cloned from a template that is built
+once per test process, instead of running init_database on a new file each time
+"""
+
+import atexit
+import os
+import tempfile
+
+from DAL import DatabaseAccessLayer
+
+_template_path = None
+
+
+def template_database():
+    """Path of a fully initialized database, built on first use"""
+    global _template_path
+    if _template_path is None:
+        handle, path = tempfile.mkstemp(suffix='.db', prefix='template-')
+        os.close(handle)
+        DatabaseAccessLayer(path)
+        atexit.register(os.unlink, path)
+        _template_path = path
+    return _template_path
+
+
+def make_test_dal():
+    """A DAL on a fresh in-memory copy of the template database; close() it after the test"""
+    return DatabaseAccessLayer.in_memory(template=template_database())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Warm-up and readiness
+Before a worker takes traffic it renders every GET route once, which compiles
+the templates and fills the page, project and feed caches. It also reads the
+projects table and its indexes so their pages are in the OS cache, and loads
+the image catalog. /readyz reports whether that has happened.
+
+    python warmup.py      # warm up in-process and print each route's timings
+"""
+
+import logging
+import sys
+import threading
+import time
+
+logger = logging.getLogger('portfolio.warmup')
+
+# Endpoints never requested during warm-up
+SKIP_ENDPOINTS = {'static', 'static_files', 'healthz', 'readyz', 'export_projects_file', 'query_stats'}
+
+COLD = 'cold'
+WARMING = 'warming'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class Readiness:
+    """Warm-up state of this process, as reported by /readyz"""
+
+    def __init__(self):
+        self.state = COLD
+        self.seconds = None
+        # url -> (status code, milliseconds) of the last warm-up
+        self.routes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def warming(self):
+        return self.state == WARMING
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    def reset(self):
+        with self._lock:
+            self.state = COLD
+            self.seconds = None
+            self.routes = {}
+
+
+def warmup_urls(app, project_ids):
+    """Paths of every GET route, with project routes filled in from project_ids"""
+    adapter = app.url_map.bind('localhost')
+    urls = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        if 'GET' not in rule.methods or rule.endpoint in SKIP_ENDPOINTS:
+            continue
+        if not rule.arguments:
+            urls.append(adapter.build(rule.endpoint, {}))
+        elif rule.arguments == {'project_id'}:
+            urls.extend(adapter.build(rule.endpoint, {'project_id': project_id})
+                        for project_id in project_ids)
+    return urls
+
+
+def warm_up(app, dal, readiness, host='localhost', project_limit=10, image_metadata=None):
+    """Prime the database, image catalog and response caches, then mark readiness ready
+
+    Images without metadata are measured first with image_metadata (an
+    ImageMetadataWorker), so the pages rendered next already carry it. If any
+    step raises, readiness ends up failed instead, and /readyz keeps answering 503.
+    """
+    with readiness._lock:
+        if readiness.state == WARMING:
+            return readiness
+        readiness.state = WARMING
+    start = time.perf_counter()
+    routes = {}
+    state = READY
+    try:
+        dal.warm_cache()
+        images = [filename for filename, _ in dal.get_image_assets()]
+        if image_metadata is not None:
+            image_metadata.run_pending(dal)
+        dal.get_image_metadata(images)
+        project_ids = [project[0] for project in dal.get_all_projects()[:project_limit]]
+
+        # Without cookies, like a first-time visitor, so anonymous caches fill
+        client = app.test_client(use_cookies=False)
+        for url in warmup_urls(app, project_ids):
+            request_start = time.perf_counter()
+            response = client.get(url, base_url=f"http://{host}")
+            response.close()
+            routes[url] = (response.status_code, (time.perf_counter() - request_start) * 1000)
+            logger.debug("Warmed %s", url)
+    except Exception:
+        logger.exception("Warm-up failed; reporting not ready")
+        state = FAILED
+    finally:
+        with readiness._lock:
+            readiness.routes = routes
+            readiness.seconds = time.perf_counter() - start
+            readiness.state = state
+    if state == READY:
+        logger.info("Warmed %d routes in %.0f ms", len(routes), readiness.seconds * 1000)
+    return readiness
+
+
+def main():
+    from app import app, dal, readiness
+
+    app.config['RATELIMIT_ENABLED'] = False
+    for label in ('cold', 'warm'):
+        readiness.reset()
+        warm_up(app, dal, readiness)
+        print(f"{label}: {len(readiness.routes)} routes in {readiness.seconds * 1000:.0f} ms")
+        for url, (status, milliseconds) in readiness.routes.items():
+            print(f"  {status} {milliseconds:7.1f} ms  {url}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
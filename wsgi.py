@@ -0,0 +1,22 @@
+"""
+Production WSGI entry point
+Run with: gunicorn -c gunicorn.conf.py wsgi:application
+"""
+
+import gc
+
+from app import app, dal, image_metadata
+
+# Several worker processes share the database, so let readers proceed during writes
+dal.enable_wal()
+
+# Measure images once here rather than in every worker's background thread
+dal.get_image_assets()
+image_metadata.run_pending(dal)
+
+application = app
+
+# With preload_app the master imports this module once before forking. Moving
+# everything allocated so far into the permanent generation keeps the cyclic
+# GC from touching those objects in the workers, so their pages stay shared.
+gc.freeze()